@@ -286,6 +286,42 @@ RQ_QUEUES = {
 
 # Salesforce
 SALESFORCE_LOGIN_URL = 'https://login.salesforce.com'
+# keep a local mirror of the knowledge catalog and sync it incrementally
+SALESFORCE_CATALOG_MIRROR = env.bool('SALESFORCE_CATALOG_MIRROR', default=False)
+# maximum number of concurrent article uploads
+SALESFORCE_MAX_WORKERS = env.int('SALESFORCE_MAX_WORKERS', default=8)
+# number of records per page of query results (200 to 2000)
+SALESFORCE_QUERY_BATCH_SIZE = env.int(
+    'SALESFORCE_QUERY_BATCH_SIZE',
+    default=2000,
+)
+# seconds to share an OAuth session between jobs via the cache
+SALESFORCE_SESSION_TIMEOUT = env.int('SALESFORCE_SESSION_TIMEOUT', default=3600)
 
 # Amazon
 AWS_S3_DRAFT_DIR = 'draft/'
+# maximum number of concurrent S3 transfers
+AWS_S3_MAX_WORKERS = env.int('AWS_S3_MAX_WORKERS', default=16)
+# keep an inventory of bucket objects instead of listing the bucket
+AWS_S3_INVENTORY = env.bool('AWS_S3_INVENTORY', default=False)
+# seconds between full reconciles of the inventory with the bucket
+AWS_S3_INVENTORY_RECONCILE_INTERVAL = env.int(
+    'AWS_S3_INVENTORY_RECONCILE_INTERVAL',
+    default=86400,
+)
+
+# Logging
+# number of buffered log messages written with one insert
+LOG_BUFFER_SIZE = env.int('LOG_BUFFER_SIZE', default=100)
+# maximum seconds between writes of buffered log messages
+LOG_FLUSH_INTERVAL = env.int('LOG_FLUSH_INTERVAL', default=5)
+
+# Bundle processing
+# number of worker processes used to scrub HTML files (1 = no pool)
+SCRUB_WORKERS = env.int('SCRUB_WORKERS', default=1)
+# read HTML from the bundle archive and only extract referenced images
+EXTRACT_REFERENCED_ONLY = env.bool('EXTRACT_REFERENCED_ONLY', default=False)
+# limits on extracting bundles, including nested ZIP files
+UNZIP_MAX_DEPTH = env.int('UNZIP_MAX_DEPTH', default=5)
+UNZIP_MAX_MEMBERS = env.int('UNZIP_MAX_MEMBERS', default=100000)
+UNZIP_MAX_SIZE = env.int('UNZIP_MAX_SIZE', default=2 * 1024 ** 3)
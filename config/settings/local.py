@@ -91,6 +91,8 @@ SALESFORCE_ARTICLE_URL_PATH_PREFIX = env(
     'SALESFORCE_ARTICLE_URL_PATH_PREFIX', default='/articles/Resource/')
 SALESFORCE_ARTICLE_TEXT_INDEX_FIELD = env(
     'SALESFORCE_ARTICLE_TEXT_INDEX_FIELD', default=False)
+SALESFORCE_ARTICLE_CHECKSUM_FIELD = env(
+    'SALESFORCE_ARTICLE_CHECKSUM_FIELD', default=False)
 SALESFORCE_ARTICLE_LINK_LIMIT = env(
     'SALESFORCE_ARTICLE_LINK_LIMIT', default=100)
 SALESFORCE_API_VERSION = env('SALESFORCE_API_VERSION')
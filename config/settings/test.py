@@ -80,6 +80,7 @@ SALESFORCE_ARTICLE_AUTHOR_OVERRIDE_FIELD = 'ArticleAuthorOverride__c'
 SALESFORCE_ARTICLE_TYPE = 'Knowledge__kav'
 SALESFORCE_ARTICLE_BODY_FIELD = 'ArticleBody__c'
 SALESFORCE_ARTICLE_TEXT_INDEX_FIELD = 'ArticleText__c'
+SALESFORCE_ARTICLE_CHECKSUM_FIELD = False
 SALESFORCE_ARTICLE_LINK_LIMIT = 100
 SALESFORCE_ARTICLE_URL_PATH_PREFIX = '/articles/'
 SALESFORCE_API_VERSION = '41.0'
@@ -1,7 +1,9 @@
 from django.contrib import admin
 
 from .models import Article
+from .models import BucketObject
 from .models import Bundle
+from .models import CatalogArticle
 from .models import Image
 from .models import Webhook
 
@@ -17,6 +19,17 @@ class ArticleAdmin(admin.ModelAdmin):
 admin.site.register(Article, ArticleAdmin)
 
 
+class BucketObjectAdmin(admin.ModelAdmin):
+    list_display = [
+        'pk',
+        'key',
+        'size',
+        'last_modified',
+    ]
+    search_fields = ('key',)
+admin.site.register(BucketObject, BucketObjectAdmin)
+
+
 class BundleAdmin(admin.ModelAdmin):
     list_display = [
         'pk',
@@ -29,6 +42,18 @@ class BundleAdmin(admin.ModelAdmin):
 admin.site.register(Bundle, BundleAdmin)
 
 
+class CatalogArticleAdmin(admin.ModelAdmin):
+    list_display = [
+        'pk',
+        'url_name',
+        'publish_status',
+        'kav_id',
+        'system_modstamp',
+    ]
+    list_filter = ('publish_status',)
+admin.site.register(CatalogArticle, CatalogArticleAdmin)
+
+
 class ImageAdmin(admin.ModelAdmin):
     list_display = [
         'pk',
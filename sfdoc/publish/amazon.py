@@ -1,18 +1,73 @@
 import filecmp
+from http import HTTPStatus
 import os
 from tempfile import TemporaryDirectory
 
 import boto3
 import botocore
+from botocore.config import Config
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.timezone import now
 
+from .concurrency import AdaptiveLimit
+from .concurrency import run_concurrently
+from .exceptions import CancelledError
+from .models import BucketObject
 from .models import Image
+from .utils import get_md5
+
+# maximum number of keys in one delete_objects request
+DELETE_BATCH_SIZE = 1000
+
+# cache key set while the bucket inventory does not need a full reconcile
+INVENTORY_RECONCILED_KEY = 's3-inventory-reconciled'
+
+# error codes for which a request is retried with less concurrency
+# (responses without a body, e.g. to HEAD requests, have the status code)
+RETRY_ERROR_CODES = ('SlowDown', 'ServiceUnavailable', '503')
+
+
+def is_retry_error(e):
+    """Determine if an S3 error asks us to slow down."""
+    return isinstance(e, botocore.exceptions.ClientError) and (
+        e.response['Error']['Code'] in RETRY_ERROR_CODES or
+        e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') ==
+        HTTPStatus.SERVICE_UNAVAILABLE
+    )
 
 
 class S3:
 
     def __init__(self):
-        self.api = boto3.resource('s3')
+        # the client is thread safe; its connection pool is shared by all
+        # transfer threads
+        self.api = boto3.resource('s3', config=Config(
+            max_pool_connections=settings.AWS_S3_MAX_WORKERS,
+        ))
+        self.cancelled = False
+        self.api.meta.client.meta.events.register(
+            'before-parameter-build.s3',
+            self._check_cancelled,
+        )
+
+    def _check_cancelled(self, **kwargs):
+        if self.cancelled:
+            raise CancelledError('S3 requests were cancelled')
+
+    def _run_concurrently(self, func, items):
+        """Run transfers on up to AWS_S3_MAX_WORKERS threads."""
+        return run_concurrently(
+            func,
+            items,
+            AdaptiveLimit(settings.AWS_S3_MAX_WORKERS),
+            is_throttled=is_retry_error,
+        )
+
+    def cancel(self):
+        """Make further API requests fail, e.g. to stop background calls."""
+        self.cancelled = True
 
     def copy_to_production(self, filename):
         """
@@ -32,6 +87,31 @@ class S3:
             Key=filename,
         )
 
+    def copy_to_draft(self, filename):
+        """Copy a production image to the draft location on S3."""
+        self.api.meta.client.copy_object(
+            ACL='public-read',
+            Bucket=settings.AWS_S3_BUCKET,
+            CopySource={'Bucket': settings.AWS_S3_BUCKET, 'Key': filename},
+            Key=settings.AWS_S3_DRAFT_DIR + filename,
+        )
+
+    def copy_images_to_production(self, filenames):
+        """
+        Copy images from draft to production concurrently.
+        Yields the filenames as the copies complete.
+        """
+        copies = []
+        try:
+            for filename, result in self._run_concurrently(
+                self.copy_to_production,
+                filenames,
+            ):
+                copies.append((settings.AWS_S3_DRAFT_DIR + filename, filename))
+                yield filename
+        finally:
+            self._copy_inventory(copies)
+
     def delete(self, filename):
         """Delete an image from production location."""
         self.api.meta.client.delete_object(
@@ -40,15 +120,61 @@ class S3:
         )
 
     def delete_draft_images(self):
-        """Delete all draft images at once."""
-        objects = []
-        for item in self.iter_objects(prefix=settings.AWS_S3_DRAFT_DIR):
-            objects.append({'Key': item['Key']})
-        if objects:
-            self.api.meta.client.delete_objects(
+        """
+        Delete all draft images.
+        Yields (key, error) per image, where error is None on success.
+        Images that fail to delete stay in the bucket inventory.
+        """
+        if settings.AWS_S3_INVENTORY:
+            self.check_inventory()
+            keys = list(BucketObject.objects.filter(
+                key__startswith=settings.AWS_S3_DRAFT_DIR,
+            ).values_list('key', flat=True))
+        else:
+            keys = [
+                item['Key'] for item in
+                self.iter_objects(prefix=settings.AWS_S3_DRAFT_DIR)
+            ]
+        return self.delete_objects(keys)
+
+    def delete_images(self, filenames):
+        """
+        Delete images from production location in batches.
+        Yields (filename, error) per image, where error is None on success.
+        """
+        return self.delete_objects(filenames)
+
+    def delete_objects(self, keys):
+        """
+        Delete objects with delete_objects requests of up to
+        DELETE_BATCH_SIZE keys, run concurrently.
+        Yields (key, error) per object, where error is None on success.
+        """
+        def delete_batch(batch):
+            response = self.api.meta.client.delete_objects(
                 Bucket=settings.AWS_S3_BUCKET,
-                Delete={'Objects': objects},
+                Delete={
+                    'Objects': [{'Key': key} for key in batch],
+                    'Quiet': True,
+                },
             )
+            return {
+                error['Key']: '{}: {}'.format(error['Code'], error['Message'])
+                for error in response.get('Errors', [])
+            }
+
+        keys = list(keys)
+        batches = [
+            tuple(keys[n:n + DELETE_BATCH_SIZE])
+            for n in range(0, len(keys), DELETE_BATCH_SIZE)
+        ]
+        for batch, errors in self._run_concurrently(delete_batch, batches):
+            if settings.AWS_S3_INVENTORY:
+                BucketObject.objects.filter(key__in=[
+                    key for key in batch if key not in errors
+                ]).delete()
+            for key in batch:
+                yield key, errors.get(key)
 
     def iter_objects(self, prefix=None):
         """Iterate over all objects in the bucket."""
@@ -66,50 +192,284 @@ class S3:
             else:
                 break
 
-    def process_image(self, filename, bundle):
-        """Upload image file to S3 if needed."""
-        basename = os.path.basename(filename)
-        key = settings.AWS_S3_DRAFT_DIR + basename
+    def check_inventory(self):
+        """Reconcile the bucket inventory if it is due."""
+        if not cache.get(INVENTORY_RECONCILED_KEY):
+            self.reconcile_inventory()
+
+    def get_production_objects(self):
+        """
+        Get production objects (bucket root) keyed by S3 key.
+        If AWS_S3_INVENTORY is set, the objects are loaded from the bucket
+        inventory instead of listing the bucket.
+        """
+        if settings.AWS_S3_INVENTORY:
+            self.check_inventory()
+            objects = {}
+            for obj in BucketObject.objects.exclude(
+                key__startswith=settings.AWS_S3_DRAFT_DIR,
+            ):
+                objects[obj.key] = {
+                    'ETag': obj.etag,
+                    'Key': obj.key,
+                    'LastModified': obj.last_modified,
+                    'Size': obj.size,
+                }
+                if obj.md5:
+                    objects[obj.key]['Metadata'] = {'md5': obj.md5}
+            return objects
+        return {
+            obj['Key']: obj for obj in self.iter_objects()
+            if not obj['Key'].startswith(settings.AWS_S3_DRAFT_DIR)
+        }
+
+    def is_unchanged(self, filename, md5, obj):
+        """
+        Compare a local file to a production object.
+        Single part uploads have the MD5 of the content as ETag. For
+        multipart uploads the MD5 stored in the object metadata is used,
+        and only if that is missing the object is downloaded and compared.
+        """
+        etag = obj['ETag'].strip('"')
+        if '-' not in etag:
+            return etag == md5
+        metadata = obj.get('Metadata')
+        if metadata is None:
+            metadata = self.api.meta.client.head_object(
+                Bucket=settings.AWS_S3_BUCKET,
+                Key=obj['Key'],
+            )['Metadata']
+        if 'md5' in metadata:
+            return metadata['md5'] == md5
         with TemporaryDirectory() as tempdir:
-            s3localname = os.path.join(tempdir, basename)
+            s3localname = os.path.join(tempdir, os.path.basename(filename))
+            self.api.meta.client.download_file(
+                settings.AWS_S3_BUCKET,
+                obj['Key'],
+                s3localname,
+            )
+            return filecmp.cmp(filename, s3localname, shallow=False)
+
+    def process_images(
+        self,
+        filenames,
+        bundle,
+        production_objects=None,
+        md5s=None,
+    ):
+        """
+        Upload image files to S3 if needed, concurrently.
+        md5s may map filenames to checksums that are already known.
+        Yields (filename, status) as images are processed, where status is
+        Image.STATUS_NEW/STATUS_CHANGED or None if the image is unchanged.
+        The Image objects and the inventory entries are written in bulk when
+        the uploads are done or have failed.
+        """
+        md5s = md5s or {}
+
+        def upload(filename):
+            md5 = md5s.get(filename) or get_md5(filename)
+            status = self.upload_image_if_changed(
+                filename,
+                production_objects,
+                md5,
+            )
+            return status, md5
+
+        images = []
+        uploads = []
+        try:
+            for filename, (status, md5) in self._run_concurrently(
+                upload,
+                filenames,
+            ):
+                if status:
+                    images.append(Image(
+                        bundle=bundle,
+                        filename=os.path.basename(filename),
+                        status=status,
+                    ))
+                    uploads.append(self._get_inventory_object(filename, md5))
+                yield filename, status
+        finally:
+            with transaction.atomic():
+                Image.objects.bulk_create(images)
+            self._save_inventory(uploads)
+
+    def reconcile_inventory(self):
+        """Replace the bucket inventory with a listing of the bucket."""
+        # checksums of multipart uploads are only known from sfdoc's writes
+        md5s = {
+            (key, etag): md5 for key, etag, md5 in
+            BucketObject.objects.exclude(md5='').values_list(
+                'key',
+                'etag',
+                'md5',
+            )
+        }
+        objects = []
+        for item in self.iter_objects():
+            etag = item['ETag'].strip('"')
+            objects.append(BucketObject(
+                etag=item['ETag'],
+                key=item['Key'],
+                last_modified=item['LastModified'],
+                md5=md5s.get(
+                    (item['Key'], item['ETag']),
+                    '' if '-' in etag else etag,
+                ),
+                size=item['Size'],
+            ))
+        with transaction.atomic():
+            BucketObject.objects.all().delete()
+            BucketObject.objects.bulk_create(objects)
+        cache.set(
+            INVENTORY_RECONCILED_KEY,
+            True,
+            settings.AWS_S3_INVENTORY_RECONCILE_INTERVAL,
+        )
+
+    def stage_images(self, filenames):
+        """
+        Stage unchanged image files for draft previews, concurrently.
+        The production copies are copied to the draft location on the
+        server side; images missing from production are uploaded.
+        Yields (filename, copied) as the images are staged.
+        """
+        def stage(filename):
             try:
-                # download image from root (production) dir for comparison
-                self.api.meta.client.download_file(
-                    settings.AWS_S3_BUCKET,
-                    basename,
-                    s3localname,
-                )
+                self.copy_to_draft(os.path.basename(filename))
+                return True, None
             except botocore.exceptions.ClientError as e:
-                if e.response['Error']['Code'] == '404':
-                    # image does not exist on S3, create a new one
-                    self.upload_image(filename, key)
-                    Image.objects.create(
-                        bundle=bundle,
-                        filename=basename,
-                        status=Image.STATUS_NEW,
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                    raise
+            md5 = get_md5(filename)
+            self.upload_image(
+                filename,
+                settings.AWS_S3_DRAFT_DIR + os.path.basename(filename),
+                md5,
+            )
+            return False, md5
+
+        copies = []
+        uploads = []
+        try:
+            for filename, (copied, md5) in self._run_concurrently(
+                stage,
+                filenames,
+            ):
+                basename = os.path.basename(filename)
+                if copied:
+                    copies.append(
+                        (basename, settings.AWS_S3_DRAFT_DIR + basename),
                     )
-                    return
                 else:
-                    raise
-            # image already in production; compare it to local image
-            if filecmp.cmp(filename, s3localname):
-                # files are the same, no update
-                return
-            else:
-                # files differ, update image
-                self.upload_image(filename, key)
-                Image.objects.create(
-                    bundle=bundle,
-                    filename=basename,
-                    status=Image.STATUS_CHANGED,
+                    uploads.append(self._get_inventory_object(filename, md5))
+                yield filename, copied
+        finally:
+            self._copy_inventory(copies)
+            self._save_inventory(uploads)
+
+    def upload_image_if_changed(
+        self,
+        filename,
+        production_objects=None,
+        md5=None,
+    ):
+        """
+        Upload image file to the draft location if it is new or changed.
+        Does not touch the database, so it is safe to call from worker
+        threads. Returns the Image status or None if the image is unchanged.
+        """
+        basename = os.path.basename(filename)
+        key = settings.AWS_S3_DRAFT_DIR + basename
+        if md5 is None:
+            md5 = get_md5(filename)
+        if production_objects is not None:
+            obj = production_objects.get(basename)
+        else:
+            try:
+                obj = self.api.meta.client.head_object(
+                    Bucket=settings.AWS_S3_BUCKET,
+                    Key=basename,
                 )
-                return
+                obj['Key'] = basename
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                    raise
+                obj = None
+        if obj is None:
+            # image does not exist on S3, create a new one
+            self.upload_image(filename, key, md5)
+            return Image.STATUS_NEW
+        elif not self.is_unchanged(filename, md5, obj):
+            # files differ, update image
+            self.upload_image(filename, key, md5)
+            return Image.STATUS_CHANGED
+        return None
 
-    def upload_image(self, filename, key):
+    def upload_image(self, filename, key, md5=None):
+        if md5 is None:
+            md5 = get_md5(filename)
         with open(filename, 'rb') as f:
             self.api.meta.client.put_object(
                 ACL='public-read',
                 Body=f,
                 Bucket=settings.AWS_S3_BUCKET,
                 Key=key,
+                Metadata={'md5': md5},
+            )
+
+    def _copy_inventory(self, copies):
+        """
+        Record copies made by sfdoc, given as (source_key, key) pairs, in
+        the bucket inventory.
+        """
+        if not settings.AWS_S3_INVENTORY or not copies:
+            return
+        sources = {
+            source.key: source for source in BucketObject.objects.filter(
+                key__in=[source_key for source_key, key in copies],
             )
+        }
+        objects = []
+        for source_key, key in copies:
+            source = sources.get(source_key)
+            if not source:
+                # the next reconcile picks it up
+                continue
+            objects.append(BucketObject(
+                # copies are single part objects
+                etag='"{}"'.format(source.md5) if source.md5 else source.etag,
+                key=key,
+                last_modified=now(),
+                md5=source.md5,
+                size=source.size,
+            ))
+        self._save_inventory(objects)
+
+    @staticmethod
+    def _get_inventory_object(filename, md5):
+        """Get the inventory entry for the draft key of an uploaded image."""
+        return BucketObject(
+            # put_object uploads are single part
+            etag='"{}"'.format(md5),
+            key=settings.AWS_S3_DRAFT_DIR + os.path.basename(filename),
+            last_modified=now(),
+            md5=md5,
+            size=os.path.getsize(filename),
+        )
+
+    def _save_inventory(self, objects):
+        """
+        Record objects written by sfdoc in the bucket inventory, replacing
+        any entries for their keys. Django 1.11 has no bulk update, so the
+        old entries are deleted and the new ones inserted in bulk.
+        """
+        if not settings.AWS_S3_INVENTORY or not objects:
+            return
+        # the last write of a key wins
+        objects = {obj.key: obj for obj in objects}
+        with transaction.atomic():
+            BucketObject.objects.filter(key__in=list(objects)).delete()
+            BucketObject.objects.bulk_create(objects.values())
@@ -0,0 +1,151 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import time
+
+from django.db import connections
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit that adapts to observed latency and throttling.
+    The limit grows by one after a full window of fast calls, shrinks by one
+    when a call is much slower than the fastest call seen so far, and is
+    halved when the remote service throttles us. Latencies are compared to
+    at least latency_floor seconds, so near-instant calls don't make every
+    other call count as slow.
+    """
+
+    def __init__(
+        self,
+        maximum,
+        initial=None,
+        minimum=1,
+        latency_tolerance=3.0,
+        latency_floor=0.01,
+    ):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        if initial is None:
+            initial = (self.maximum + 1) // 2
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.latency_tolerance = latency_tolerance
+        self.latency_floor = latency_floor
+        self.min_latency = None
+        self._successes = 0
+
+    def success(self, latency):
+        """Record a successful call and its latency in seconds."""
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+        if latency > (
+            max(self.min_latency, self.latency_floor) * self.latency_tolerance
+        ):
+            # calls are queueing up somewhere, ease off
+            self.limit = max(self.minimum, self.limit - 1)
+            self._successes = 0
+            return
+        self._successes += 1
+        if self._successes >= self.limit:
+            self.limit = min(self.maximum, self.limit + 1)
+            self._successes = 0
+
+    def throttle(self):
+        """Record a throttled call."""
+        self.limit = max(self.minimum, self.limit // 2)
+        self._successes = 0
+
+
+def run_in_background(func, *args):
+    """
+    Call func(*args) on a background thread.
+    Returns a Future; its result() waits for the call and returns its result
+    or raises its exception.
+    """
+    def call():
+        try:
+            return func(*args)
+        finally:
+            # close the thread's own database connections
+            connections.close_all()
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        return executor.submit(call)
+    finally:
+        # the thread exits once the call is done
+        executor.shutdown(wait=False)
+
+
+def run_concurrently(
+    func,
+    items,
+    limit,
+    is_throttled=None,
+    max_retries=5,
+    backoff=1.0,
+):
+    """
+    Call func(item) for each item on a pool of limit.maximum threads, with
+    at most limit.limit calls in flight at any time.
+    Yields (item, result) in completion order. Calls failing with an
+    exception for which is_throttled(e) is true are retried after a backoff
+    delay, up to max_retries times; any other exception is raised. The
+    delay is waited out by the retried call, so other calls keep being
+    collected and submitted meanwhile.
+    When a call fails, no more calls are started, and the results of the
+    calls still in flight are yielded before the exception is raised.
+    """
+    def timed_call(item, delay):
+        if delay:
+            # back off before a retry
+            time.sleep(delay)
+        start = time.monotonic()
+        result = func(item)
+        return result, time.monotonic() - start
+
+    items = iter(items)
+    retries = deque()
+    attempts = {}
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=limit.maximum) as executor:
+        while True:
+            while error is None and len(running) < limit.limit:
+                if retries:
+                    item, delay = retries.popleft()
+                else:
+                    item = next(items, StopIteration)
+                    if item is StopIteration:
+                        break
+                    delay = 0
+                running[executor.submit(timed_call, item, delay)] = item
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = running.pop(future)
+                try:
+                    result, latency = future.result()
+                except Exception as e:
+                    key = id(item)
+                    attempts[key] = attempts.get(key, 0) + 1
+                    if error is not None:
+                        # already failing, don't retry
+                        continue
+                    if (
+                        is_throttled is None or
+                        not is_throttled(e) or
+                        attempts[key] > max_retries
+                    ):
+                        error = e
+                        continue
+                    limit.throttle()
+                    retries.append((item, backoff * 2 ** (attempts[key] - 1)))
+                    continue
+                attempts.pop(id(item), None)
+                limit.success(latency)
+                yield item, result
+    if error is not None:
+        raise error
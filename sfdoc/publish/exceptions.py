@@ -3,9 +3,21 @@ class SfdocError(Exception):
     pass
 
 
+class CancelledError(SfdocError):
+    pass
+
+
+class DownloadError(SfdocError):
+    pass
+
+
 class HtmlError(SfdocError):
     pass
 
 
 class SalesforceError(SfdocError):
     pass
+
+
+class UnzipError(SfdocError):
+    pass
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 from urllib.parse import urlparse
 
@@ -10,7 +12,13 @@ from .utils import is_url_whitelisted
 
 
 class HTML:
-    """Article HTML utility class."""
+    """
+    Article HTML utility class.
+    The HTML is parsed once; all operations share the parsed article body
+    and the serialized draft and production bodies are cached until the
+    tree is modified. Pickled and released objects carry the serialized
+    bodies, which are parsed again only if the tree is needed.
+    """
 
     def __init__(self, html):
         """Parse article fields from HTML."""
@@ -64,9 +72,43 @@ class HTML:
             raise HtmlError('Body tag <div class={} ...> not found'.format(
                 settings.ARTICLE_BODY_CLASS,
             ))
-        self.body = body_tag.renderContents().decode('utf-8')
+        # detach the body so the rest of the document can be released
+        self._body_tag = body_tag.extract()
+        self._body = None
+        self._body_production = None
+        self._checksum = None
+        # set once links point to the draft locations
+        self.has_draft_links = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_body'] = self.body
+        state['_body_tag'] = None
+        return state
+
+    @property
+    def body(self):
+        """Article body, serialized from the parsed tree on first access."""
+        if self._body is None:
+            self._body = self.body_tag.renderContents().decode('utf-8')
+        return self._body
+
+    @property
+    def body_tag(self):
+        """Parsed article body, parsed from the serialized body if needed."""
+        if self._body_tag is None:
+            self._body_tag = BeautifulSoup(self._body, 'html.parser')
+        return self._body_tag
 
     def create_article_data(self):
+        data = self._get_article_fields()
+        if settings.SALESFORCE_ARTICLE_CHECKSUM_FIELD:
+            data[settings.SALESFORCE_ARTICLE_CHECKSUM_FIELD] = (
+                self.get_checksum()
+            )
+        return data
+
+    def _get_article_fields(self):
         return {
             'UrlName': self.url_name,
             'Title': self.title,
@@ -79,16 +121,69 @@ class HTML:
             settings.SALESFORCE_ARTICLE_AUTHOR_OVERRIDE_FIELD: self.author_override,
         }
 
+    def get_checksum(self):
+        """
+        MD5 checksum of the article fields, for detecting changes.
+        Computed on first use, which is before links are updated to the
+        draft locations at the latest.
+        """
+        if self._checksum is None:
+            data = json.dumps(self._get_article_fields(), sort_keys=True)
+            self._checksum = hashlib.md5(data.encode('utf-8')).hexdigest()
+        return self._checksum
+
     def get_image_paths(self):
         """Get paths to linked images."""
         image_paths = set([])
-        soup = BeautifulSoup(self.body, 'html.parser')
-        for img in soup('img'):
+        for img in self.body_tag('img'):
             image_paths.add(img['src'])
         return image_paths
 
-    def same_as_record(self, record):
-        """Compare this object with an article from a Salesforce query."""
+    def get_body_production(self):
+        """
+        Article body with image links pointing to the production location,
+        serialized from the parsed tree on first access.
+        """
+        if self._body_production is not None:
+            return self._body_production
+        images = self.body_tag('img')
+        sources = [img['src'] for img in images]
+        for img in images:
+            img['src'] = img['src'].replace(settings.AWS_S3_DRAFT_DIR, '')
+        try:
+            self._body_production = self.body_tag.renderContents().decode(
+                'utf-8',
+            )
+        finally:
+            for img, src in zip(images, sources):
+                img['src'] = src
+        return self._body_production
+
+    def release_tree(self):
+        """
+        Serialize the draft and production bodies and drop the parsed tree,
+        so articles waiting to be uploaded don't keep their trees in memory.
+        Call it once links are updated, so the tree is not needed again.
+        """
+        self.body
+        self.get_body_production()
+        self._body_tag = None
+
+    def same_as_record(self, record, draft=False):
+        """
+        Compare this object with an article from a Salesforce query.
+        If the record has a checksum, only the checksums are compared.
+        Draft records are compared to the body with draft links, so links
+        must already have been updated.
+        """
+        if (
+            settings.SALESFORCE_ARTICLE_CHECKSUM_FIELD and
+            record.get(settings.SALESFORCE_ARTICLE_CHECKSUM_FIELD)
+        ):
+            return self.get_checksum() == record[
+                settings.SALESFORCE_ARTICLE_CHECKSUM_FIELD
+            ]
+
         def same(item1, item2):
             if not item1 and not item2:
                 return True
@@ -116,7 +211,7 @@ class HTML:
             self.summary,
             record['Summary'],
         ) and same(
-            self.update_links_production(self.body).strip(),
+            (self.body if draft else self.get_body_production()).strip(),
             record[settings.SALESFORCE_ARTICLE_BODY_FIELD].strip(),
         )
 
@@ -134,12 +229,12 @@ class HTML:
                             if not is_url_whitelisted(child[attr]):
                                 raise HtmlError('URL {} not whitelisted'.format(child[attr]))
                     scrub_tree(child)
-        soup = BeautifulSoup(self.body, 'html.parser')
-        scrub_tree(soup)
+        scrub_tree(self.body_tag)
 
     def update_links_draft(self, base_url=''):
         """Update links to draft location."""
-        soup = BeautifulSoup(self.body, 'html.parser')
+        # checksum the article as authored
+        self.get_checksum()
         images_path = 'https://{}.s3.amazonaws.com/{}'.format(
             settings.AWS_S3_BUCKET,
             settings.AWS_S3_DRAFT_DIR,
@@ -147,7 +242,7 @@ class HTML:
 
         article_link_count = 1
 
-        for a in soup('a'):
+        for a in self.body_tag('a'):
             if 'href' in a.attrs:
                 o = urlparse(a['href'])
                 if o.scheme or not o.path or not is_html(o.path):
@@ -157,9 +252,11 @@ class HTML:
                     base_url_prefix = base_url
                 a['href'] = self.update_href(o, base_url_prefix)
                 article_link_count += 1
-        for img in soup('img'):
+        for img in self.body_tag('img'):
             img['src'] = images_path + os.path.basename(img['src'])
-        self.body = str(soup)
+        self._body = None
+        self._body_production = None
+        self.has_draft_links = True
 
     def update_href(self, parsed_url, base_url):
         basename = os.path.basename(parsed_url.path)
@@ -1,46 +1,142 @@
 import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.timezone import now
 
 from . import models
 
+# all objects log to this logger, their records are told apart by key
+LOGGER_NAME = 'sfdoc.publish.jobs'
+
+# log handlers of the objects with an open logger, by key
+_handlers = {}
+_handlers_lock = threading.Lock()
 
-class LogStream(object):
-    """File-like interface to Log model."""
+
+class LogHandler(logging.Handler):
+    """
+    Buffer log records of a model object and write them to the Log model
+    with bulk inserts. The buffer is written when it holds LOG_BUFFER_SIZE
+    records, LOG_FLUSH_INTERVAL seconds after the first buffered record,
+    on errors and when the handler is flushed or closed.
+    """
 
     def __init__(self, model):
+        super().__init__()
         self.model = model
-        self.message_buffer = ''
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.timer = None
 
-    def flush(self, force=False):
-        if self.message_buffer:
-            models.Log.objects.create(
+    def emit(self, record):
+        try:
+            self.buffer.append(models.Log(
                 content_object=self.model,
-                message=self.message_buffer.strip(),
+                message=self.format(record).strip(),
+                time=now(),
+            ))
+            if (
+                len(self.buffer) >= settings.LOG_BUFFER_SIZE or
+                time.monotonic() - self.last_flush >=
+                settings.LOG_FLUSH_INTERVAL or
+                record.levelno >= logging.ERROR
+            ):
+                self.flush()
+            elif self.timer is None:
+                # write the buffer even if nothing else is logged
+                self.timer = threading.Timer(
+                    settings.LOG_FLUSH_INTERVAL,
+                    self.flush_on_timer,
+                )
+                self.timer.daemon = True
+                self.timer.start()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            buffer, self.buffer = self.buffer, []
+            self.last_flush = time.monotonic()
+            if buffer:
+                models.Log.objects.bulk_create(buffer)
+        finally:
+            self.release()
+
+    def flush_on_timer(self):
+        """Write the buffer from the timer thread."""
+        try:
+            self.flush()
+        except Exception:
+            logging.getLogger(__name__).exception(
+                'Error writing log messages of %s',
+                self.model,
             )
-            self.message_buffer = ''
+        finally:
+            # the timer thread's database connection is not reused
+            connection.close()
 
-    def write(self, message):
-        self.message_buffer += message
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            super().close()
 
 
-def get_logger(model):
-    """Get an instance of the logger."""
-    logger_name = 'sfdoc_{}'.format(model.__class__.__name__)
-    logger = logging.getLogger(logger_name)
-    if logger.handlers:
-        # already configured
-        return logger
-    logger.setLevel(logging.DEBUG)
-    # create handlers
-    handler = logging.StreamHandler(stream=LogStream(model))
-    handler_console = logging.StreamHandler()
-    # set handler levels
-    handler.setLevel(logging.INFO)
-    handler_console.setLevel(logging.ERROR)
-    # set format
-    formatter = logging.Formatter('[%(levelname)s] %(message)s')
-    handler.setFormatter(formatter)
-    handler_console.setFormatter(formatter)
-    # add handlers to logger
-    logger.addHandler(handler)
-    logger.addHandler(handler_console)
+class ModelLoggerAdapter(logging.LoggerAdapter):
+    """Logger adapter that marks records with the key of a model object."""
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = dict(kwargs.get('extra') or {}, **self.extra)
+        return msg, kwargs
+
+
+def _get_shared_logger():
+    logger = logging.getLogger(LOGGER_NAME)
+    if not logger.handlers:
+        logger.setLevel(logging.DEBUG)
+        handler_console = logging.StreamHandler()
+        handler_console.setLevel(logging.ERROR)
+        handler_console.setFormatter(
+            logging.Formatter('[%(levelname)s] %(message)s'),
+        )
+        logger.addHandler(handler_console)
     return logger
+
+
+def get_logger(model):
+    """
+    Get the logger of a model object, e.g. a bundle or webhook.
+    Messages are stored with the object they were logged for by a handler
+    on a logger shared by all objects. Call close_logger when done with it.
+    """
+    key = '{}_{}'.format(model.__class__.__name__, model.pk)
+    logger = _get_shared_logger()
+    with _handlers_lock:
+        if key not in _handlers:
+            handler = LogHandler(model)
+            handler.setLevel(logging.INFO)
+            handler.setFormatter(
+                logging.Formatter('[%(levelname)s] %(message)s'),
+            )
+            handler.addFilter(
+                lambda record: getattr(record, 'log_key', None) == key,
+            )
+            logger.addHandler(handler)
+            _handlers[key] = handler
+    return ModelLoggerAdapter(logger, {'log_key': key})
+
+
+def close_logger(logger):
+    """Write buffered messages and release the handler of a logger."""
+    with _handlers_lock:
+        handler = _handlers.pop(logger.extra['log_key'], None)
+    if handler:
+        logger.logger.removeHandler(handler)
+        handler.close()
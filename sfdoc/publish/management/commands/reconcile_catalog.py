@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from sfdoc.publish.tasks import reconcile_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        'Queue a full reconcile of the knowledge catalog mirror with the org. '
+        'Run it periodically (e.g. daily) when SALESFORCE_CATALOG_MIRROR is set.'
+    )
+
+    def handle(self, *args, **options):
+        reconcile_catalog.delay()
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from sfdoc.publish.tasks import reconcile_inventory
+
+
+class Command(BaseCommand):
+    help = (
+        'Queue a full reconcile of the bucket inventory with the bucket. '
+        'Run it periodically (e.g. daily) when AWS_S3_INVENTORY is set.'
+    )
+
+    def handle(self, *args, **options):
+        reconcile_inventory.delay()
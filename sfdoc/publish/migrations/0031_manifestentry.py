@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2026-10-16 20:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('publish', '0030_auto_20180313_1948'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ManifestEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=32)),
+                ('name', models.CharField(max_length=255)),
+                ('type', models.CharField(choices=[('A', 'Article'), ('I', 'Image')], max_length=1)),
+                ('bundle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='manifest', to='publish.Bundle')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='manifestentry',
+            unique_together=set([('bundle', 'type', 'name')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2026-10-16 20:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('publish', '0031_manifestentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='draft_unchanged',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2026-10-16 20:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('publish', '0032_article_draft_unchanged'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogArticle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author', models.CharField(blank=True, default='', max_length=255)),
+                ('author_override', models.CharField(blank=True, default='', max_length=255)),
+                ('checksum', models.CharField(blank=True, default='', max_length=32)),
+                ('is_visible_in_csp', models.BooleanField(default=False)),
+                ('is_visible_in_pkb', models.BooleanField(default=False)),
+                ('is_visible_in_prm', models.BooleanField(default=False)),
+                ('ka_id', models.CharField(max_length=18)),
+                ('kav_id', models.CharField(max_length=18, unique=True)),
+                ('last_published_date', models.DateTimeField(blank=True, null=True)),
+                ('publish_status', models.CharField(max_length=16)),
+                ('summary', models.TextField(blank=True, default='')),
+                ('system_modstamp', models.DateTimeField(db_index=True)),
+                ('title', models.CharField(max_length=255)),
+                ('url_name', models.CharField(db_index=True, max_length=255)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2026-10-16 20:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('publish', '0033_catalogarticle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BucketObject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('etag', models.CharField(max_length=64)),
+                ('key', models.CharField(max_length=1024, unique=True)),
+                ('last_modified', models.DateTimeField()),
+                ('md5', models.CharField(blank=True, default='', max_length=32)),
+                ('size', models.BigIntegerField()),
+            ],
+        ),
+    ]
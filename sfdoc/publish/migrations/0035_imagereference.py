@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2026-10-16 20:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('publish', '0034_bucketobject'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageReference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.CharField(db_index=True, max_length=255)),
+                ('url_name', models.CharField(max_length=255)),
+                ('bundle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_references', to='publish.Bundle')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='imagereference',
+            unique_together=set([('bundle', 'url_name', 'image')]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2026-10-16 20:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('publish', '0035_imagereference'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='log',
+            name='time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,3 +1,5 @@
+from datetime import datetime
+from datetime import timedelta
 from traceback import format_exception
 
 from django.conf import settings
@@ -5,7 +7,10 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db import transaction
+from django.db.models import Q
 from django.utils.timezone import now
+from django.utils.timezone import utc
 
 from .logger import get_logger
 
@@ -29,6 +34,7 @@ class Article(models.Model):
         on_delete=models.CASCADE,
         related_name='articles',
     )
+    draft_unchanged = models.BooleanField(default=False)
     ka_id = models.CharField(max_length=18)
     kav_id = models.CharField(max_length=18)
     title = models.CharField(max_length=255, default='')
@@ -74,6 +80,19 @@ class Bundle(models.Model):
     def __str__(self):
         return 'easyDITA bundle {}'.format(self.pk)
 
+    def get_last_published(self):
+        """Get the last published bundle for the same easyDITA resource."""
+        return Bundle.objects.filter(
+            easydita_resource_id=self.easydita_resource_id,
+            status=self.STATUS_PUBLISHED,
+        ).exclude(pk=self.pk).order_by('-time_published').first()
+
+    def get_manifest(self, entry_type):
+        """Get the checksums of the bundle's articles or images by name."""
+        return dict(self.manifest.filter(
+            type=entry_type,
+        ).values_list('name', 'checksum'))
+
     def is_complete(self):
         return self.status in (
             self.STATUS_PUBLISHED,
@@ -81,18 +100,27 @@ class Bundle(models.Model):
             self.STATUS_ERROR,
         )
 
+    def is_running(self):
+        """Is the bundle queued or being processed/published?"""
+        return self.status in (
+            self.STATUS_QUEUED,
+            self.STATUS_PROCESSING,
+            self.STATUS_PUBLISHING,
+        )
+
     def get_absolute_url(self):
         return '/publish/bundles/{}/'.format(self.pk)
 
     def queue(self):
-        self.status = self.STATUS_QUEUED
-        self.time_queued = now()
-        self.error_message = ''
-        self.save()
-        for article in self.articles.all():
-            article.delete()
-        for image in self.images.all():
-            image.delete()
+        with transaction.atomic():
+            self.status = self.STATUS_QUEUED
+            self.time_queued = now()
+            self.error_message = ''
+            self.save()
+            self.articles.all().delete()
+            self.images.all().delete()
+            self.image_references.all().delete()
+            self.manifest.all().delete()
 
     def set_error(self, e):
         """Set error status and message."""
@@ -112,6 +140,42 @@ class Bundle(models.Model):
         )
 
 
+class BucketObject(models.Model):
+    """Inventory entry for an object in the S3 bucket."""
+    etag = models.CharField(max_length=64)
+    key = models.CharField(max_length=1024, unique=True)
+    last_modified = models.DateTimeField()
+    md5 = models.CharField(max_length=32, blank=True, default='')
+    size = models.BigIntegerField()
+
+    def __str__(self):
+        return self.key
+
+
+class CatalogArticle(models.Model):
+    """
+    Local mirror of a draft or online article version in the org, with the
+    fields that articles are compared on except for the body.
+    """
+    author = models.CharField(max_length=255, blank=True, default='')
+    author_override = models.CharField(max_length=255, blank=True, default='')
+    checksum = models.CharField(max_length=32, blank=True, default='')
+    is_visible_in_csp = models.BooleanField(default=False)
+    is_visible_in_pkb = models.BooleanField(default=False)
+    is_visible_in_prm = models.BooleanField(default=False)
+    ka_id = models.CharField(max_length=18)
+    kav_id = models.CharField(max_length=18, unique=True)
+    last_published_date = models.DateTimeField(null=True, blank=True)
+    publish_status = models.CharField(max_length=16)
+    summary = models.TextField(blank=True, default='')
+    system_modstamp = models.DateTimeField(db_index=True)
+    title = models.CharField(max_length=255)
+    url_name = models.CharField(max_length=255, db_index=True)
+
+    def __str__(self):
+        return '{} ({})'.format(self.url_name, self.publish_status)
+
+
 class Image(models.Model):
     STATUS_NEW = 'N'
     STATUS_CHANGED = 'C'
@@ -151,12 +215,46 @@ class Image(models.Model):
         return self._get_url(False)
 
 
+class ImageReference(models.Model):
+    """Use of an image by an article in a bundle."""
+    bundle = models.ForeignKey(
+        'Bundle',
+        on_delete=models.CASCADE,
+        related_name='image_references',
+    )
+    image = models.CharField(max_length=255, db_index=True)  # filename
+    url_name = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ('bundle', 'url_name', 'image')
+
+    def __str__(self):
+        return '{} uses {}'.format(self.url_name, self.image)
+
+
 class Log(models.Model):
+    EPOCH = datetime(1970, 1, 1, tzinfo=utc)
     content_object = GenericForeignKey('content_type', 'object_id')
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     message = models.TextField()
     object_id = models.PositiveIntegerField()
-    time = models.DateTimeField(auto_now_add=True)
+    # set when the message is logged, not when it is written
+    time = models.DateTimeField(default=now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id', 'time', 'id']),
+        ]
+
+    def get_cursor(self):
+        """
+        Get the position of the message in the log, for getting the
+        messages logged after it with filter_after.
+        """
+        return '{}-{}'.format(
+            (self.time - self.EPOCH) // timedelta(microseconds=1),
+            self.pk,
+        )
 
     def get_message(self):
         return '{} {}'.format(
@@ -164,6 +262,52 @@ class Log(models.Model):
             self.message,
         )
 
+    @classmethod
+    def filter_after(cls, logs, cursor):
+        """
+        Filter log messages to those logged after a cursor from get_cursor,
+        in log order. Raises ValueError if the cursor is invalid, or
+        OverflowError if its time is out of range.
+        """
+        logs = logs.order_by('time', 'pk')
+        if not cursor:
+            return logs
+        microseconds, pk = (int(part) for part in cursor.split('-'))
+        time = cls.EPOCH + timedelta(microseconds=microseconds)
+        return logs.filter(Q(time__gt=time) | Q(time=time, pk__gt=pk))
+
+
+class ManifestEntry(models.Model):
+    """Content checksum of an article or image in a bundle."""
+    TYPE_ARTICLE = 'A'
+    TYPE_IMAGE = 'I'
+    bundle = models.ForeignKey(
+        'Bundle',
+        on_delete=models.CASCADE,
+        related_name='manifest',
+    )
+    checksum = models.CharField(max_length=32)
+    # lowercase URL name, or image filename as in the bucket (S3 keys are
+    # case sensitive)
+    name = models.CharField(max_length=255)
+    type = models.CharField(
+        max_length=1,
+        choices=(
+            (TYPE_ARTICLE, 'Article'),
+            (TYPE_IMAGE, 'Image'),
+        ),
+    )
+
+    class Meta:
+        unique_together = ('bundle', 'type', 'name')
+
+    def __str__(self):
+        return '{} {}: {}'.format(
+            self.get_type_display(),
+            self.name,
+            self.checksum,
+        )
+
 
 class Webhook(models.Model):
     STATUS_NEW = 'N'        # not yet processed
@@ -1,30 +1,184 @@
 from calendar import timegm
 from datetime import datetime
 from http import HTTPStatus
+from itertools import islice
+import threading
+import time
 from urllib.parse import urljoin
 from urllib.parse import urlparse
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db import transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import utc
 import jwt
 import requests
+from requests.adapters import HTTPAdapter
 from simple_salesforce import Salesforce as SimpleSalesforce
+from simple_salesforce.exceptions import SalesforceMalformedRequest
+from simple_salesforce.util import exception_handler
 
+from .concurrency import AdaptiveLimit
+from .concurrency import run_concurrently
+from .exceptions import CancelledError
 from .exceptions import SalesforceError
 from .html import HTML
 from .models import Article
+from .models import CatalogArticle
+
+# error codes for which a request is retried with less concurrency
+RETRY_ERROR_CODES = ('REQUEST_LIMIT_EXCEEDED', 'UNABLE_TO_LOCK_ROW')
+
+# maximum number of records in one sObject Collections request
+COLLECTION_SIZE = 200
+
+# number of times records failing with a retry error code are resent
+COLLECTION_RETRIES = 3
+
+# maximum number of inputs in one knowledge action request
+ACTION_SIZE = 100
+
+# seconds to hold/wait for the lock while requesting a new session
+SESSION_LOCK_TIMEOUT = 30
+SESSION_LOCK_POLL_INTERVAL = 0.2
+
+
+def is_retry_error(e):
+    """
+    Determine if an API error is a throttling or record lock error.
+    Only the error codes of the API response are checked, so other errors
+    are never retried.
+    """
+    content = getattr(e, 'content', None)
+    if isinstance(content, list):
+        for error in content:
+            if (
+                isinstance(error, dict) and
+                error.get('errorCode') in RETRY_ERROR_CODES
+            ):
+                return True
+    return False
+
+
+def is_request_retry_error(e):
+    """
+    Determine if a whole API request failed with a throttling, record lock
+    or server error, so it can be sent again.
+    """
+    return is_retry_error(e) or getattr(e, 'status', 0) >= 500
+
+
+class KnowledgeCatalog:
+    """
+    Draft and online article versions in the org.
+    Article bodies are not part of the catalog; they are added to the
+    records by Salesforce.load_bodies while the articles are compared.
+    """
+
+    def __init__(self, drafts, online):
+        # records keyed by lowercase URL name
+        self.drafts = {r['UrlName'].lower(): r for r in drafts}
+        self.online = {r['UrlName'].lower(): r for r in online}
+        # lowercase URL names of the drafts created by sfdoc
+        self.created = set([])
+
+    def drop_bodies(self, url_names):
+        """Remove the bodies of articles that have been compared."""
+        for url_name in url_names:
+            for record in (self.get_draft(url_name), self.get_online(url_name)):
+                if record:
+                    record.pop(settings.SALESFORCE_ARTICLE_BODY_FIELD, None)
+
+    def get_draft(self, url_name):
+        return self.drafts.get(url_name.lower())
+
+    def get_online(self, url_name):
+        return self.online.get(url_name.lower())
+
+    def is_created(self, url_name):
+        """
+        Was the draft created by sfdoc? Its record has none of the fields
+        articles are compared on, so the draft is always updated.
+        """
+        return url_name.lower() in self.created
+
+    def set_draft(self, url_name, kav_id, ka_id):
+        """Record a draft created by sfdoc."""
+        self.drafts[url_name.lower()] = {
+            'Id': kav_id,
+            'KnowledgeArticleId': ka_id,
+            'UrlName': url_name,
+        }
+        self.created.add(url_name.lower())
+
+
+class SalesforceSession(requests.Session):
+    """
+    Requests session that renews the Salesforce session and retries once
+    when a call fails with INVALID_SESSION_ID.
+    """
+
+    def __init__(self, salesforce):
+        super().__init__()
+        self.salesforce = salesforce
+        # share connections between upload threads
+        self.mount('https://', HTTPAdapter(
+            pool_maxsize=settings.SALESFORCE_MAX_WORKERS,
+        ))
+
+    def request(self, method, url, **kwargs):
+        if self.salesforce.cancelled:
+            raise CancelledError('Salesforce requests were cancelled')
+        response = super().request(method, url, **kwargs)
+        if (
+            response.status_code == HTTPStatus.UNAUTHORIZED and
+            'INVALID_SESSION_ID' in response.text
+        ):
+            headers = dict(kwargs.get('headers') or {})
+            expired_token = headers.get('Authorization', '')[len('Bearer '):]
+            access_token = self.salesforce.renew_session(expired_token)
+            headers['Authorization'] = 'Bearer ' + access_token
+            kwargs['headers'] = headers
+            response = super().request(method, url, **kwargs)
+        return response
 
 
 class Salesforce:
     """Interact with a Salesforce org."""
 
     def __init__(self):
+        self._session_lock = threading.Lock()
+        self.cancelled = False
         self.api = self._get_salesforce_api()
+        self.catalog = None
 
-    def _get_salesforce_api(self):
-        """Get an instance of the Salesforce REST API."""
+    def _get_login_url(self):
         url = settings.SALESFORCE_LOGIN_URL
         if settings.SALESFORCE_SANDBOX:
             url = url.replace('login', 'test')
+        return url
+
+    def _get_salesforce_api(self):
+        """Get an instance of the Salesforce REST API."""
+        session_data = cache.get(self._get_session_cache_key())
+        if not session_data:
+            session_data = self._refresh_session()
+        sf = SimpleSalesforce(
+            instance_url=session_data['instance_url'],
+            session_id=session_data['access_token'],
+            sandbox=settings.SALESFORCE_SANDBOX,
+            version=settings.SALESFORCE_API_VERSION,
+            client_id='sfdoc',
+            session=SalesforceSession(self),
+        )
+        return sf
+
+    def _get_session(self):
+        """Get a new session from the OAuth token endpoint (JWT flow)."""
+        url = self._get_login_url()
         payload = {
             'alg': 'RS256',
             'iss': settings.SALESFORCE_CLIENT_ID,
@@ -46,14 +200,70 @@ class Salesforce:
         response = requests.post(url=auth_url, data=data, headers=headers)
         response.raise_for_status()
         response_data = response.json()
-        sf = SimpleSalesforce(
-            instance_url=response_data['instance_url'],
-            session_id=response_data['access_token'],
-            sandbox=settings.SALESFORCE_SANDBOX,
-            version=settings.SALESFORCE_API_VERSION,
-            client_id='sfdoc',
+        return {
+            'instance_url': response_data['instance_url'],
+            'access_token': response_data['access_token'],
+        }
+
+    def _get_session_cache_key(self):
+        """Cache key for the session shared by all workers (org and user)."""
+        return 'salesforce-session:{}:{}'.format(
+            self._get_login_url(),
+            settings.SALESFORCE_USERNAME,
         )
-        return sf
+
+    def _refresh_session(self, expired_token=None):
+        """
+        Get a new session and share it with other workers via the cache.
+        A cache lock makes sure only one worker requests a new token; the
+        others wait for it to appear in the cache.
+        """
+        key = self._get_session_cache_key()
+        lock_key = key + ':lock'
+        deadline = time.monotonic() + SESSION_LOCK_TIMEOUT
+        while True:
+            if cache.add(lock_key, True, SESSION_LOCK_TIMEOUT):
+                try:
+                    session_data = cache.get(key)
+                    if (
+                        not session_data or
+                        session_data['access_token'] == expired_token
+                    ):
+                        session_data = self._get_session()
+                        cache.set(
+                            key,
+                            session_data,
+                            settings.SALESFORCE_SESSION_TIMEOUT,
+                        )
+                    return session_data
+                finally:
+                    cache.delete(lock_key)
+            session_data = cache.get(key)
+            if (
+                session_data and
+                session_data['access_token'] != expired_token
+            ):
+                return session_data
+            if time.monotonic() > deadline:
+                # lock holder died or the cache is unavailable
+                session_data = self._get_session()
+                cache.set(key, session_data, settings.SALESFORCE_SESSION_TIMEOUT)
+                return session_data
+            time.sleep(SESSION_LOCK_POLL_INTERVAL)
+
+    def renew_session(self, expired_token):
+        """
+        Replace an expired session, unless another thread already did.
+        Returns the current access token.
+        """
+        with self._session_lock:
+            if self.api.session_id == expired_token:
+                session_data = self._refresh_session(expired_token)
+                self.api.session_id = session_data['access_token']
+                self.api.headers['Authorization'] = (
+                    'Bearer ' + self.api.session_id
+                )
+            return self.api.session_id
 
     def archive(self, ka_id, kav_id):
         """Archive a published article."""
@@ -71,6 +281,75 @@ class Salesforce:
         # archive published version
         self.set_publish_status(kav_id, 'archived')
 
+    def archive_articles(self, articles):
+        """
+        Archive published articles, given as (ka_id, kav_id) pairs.
+        Where the API version supports it, existing drafts are deleted
+        concurrently and the published versions are archived in batches
+        with the archiveKnowledgeArticles action.
+        Yields (kav_id, error) per article, where error is None on success.
+        """
+        if not self.uses_knowledge_actions():
+            for ka_id, kav_id in articles:
+                self.archive(ka_id, kav_id)
+                yield kav_id, None
+            return
+        articles = list(articles)
+        if settings.SALESFORCE_CATALOG_MIRROR:
+            self.sync_catalog()
+        limit = AdaptiveLimit(settings.SALESFORCE_MAX_WORKERS)
+        for n in range(0, len(articles), COLLECTION_SIZE):
+            batch = articles[n:n + COLLECTION_SIZE]
+            kav_ids = dict(batch)
+            errors = {}
+            # delete drafts
+            if settings.SALESFORCE_CATALOG_MIRROR:
+                drafts = [{
+                    'Id': article.kav_id,
+                    'KnowledgeArticleId': article.ka_id,
+                } for article in CatalogArticle.objects.filter(
+                    ka_id__in=kav_ids,
+                    publish_status='draft',
+                )]
+            else:
+                query_str = (
+                    "SELECT Id,KnowledgeArticleId FROM {} "
+                    "WHERE KnowledgeArticleId IN ({}) "
+                    "AND PublishStatus='draft' AND language='en_US'"
+                ).format(
+                    settings.SALESFORCE_ARTICLE_TYPE,
+                    ','.join("'{}'".format(ka_id) for ka_id, kav_id in batch),
+                )
+                drafts = list(self.query_iter(query_str))
+
+            def delete(record):
+                try:
+                    self.delete(record['Id'])
+                except Exception as e:
+                    if is_retry_error(e):
+                        raise
+                    return str(e)
+
+            for record, error in run_concurrently(
+                delete,
+                drafts,
+                limit,
+                is_throttled=is_retry_error,
+            ):
+                if error:
+                    errors[kav_ids[record['KnowledgeArticleId']]] = error
+            # archive published versions
+            errors.update(self.run_knowledge_action(
+                'archiveKnowledgeArticles',
+                [kav_id for ka_id, kav_id in batch if kav_id not in errors],
+            ))
+            for ka_id, kav_id in batch:
+                yield kav_id, errors.get(kav_id)
+
+    def cancel(self):
+        """Make further API requests fail, e.g. to stop background calls."""
+        self.cancelled = True
+
     def create_article(self, html):
         """Create a new article in draft state."""
         kav_api = getattr(self.api, settings.SALESFORCE_ARTICLE_TYPE)
@@ -125,17 +404,31 @@ class Salesforce:
         elif result['totalSize'] == 1:  # can only be 0 or 1
             return result['records'][0]['KnowledgeArticleId']
 
-    def get_articles(self, publish_status):
-        """Get all article versions with a given publish status."""
-        query_str = (
-            "SELECT Id,KnowledgeArticleId,Title,UrlName FROM {} "
-            "WHERE PublishStatus='{}' AND language='en_US'"
-        ).format(
-            settings.SALESFORCE_ARTICLE_TYPE,
-            publish_status,
-        )
-        result = self.api.query(query_str)
-        return result['records']
+    def get_ka_ids(self, kav_ids):
+        """Get KnowledgeArticleIds of draft KnowledgeArticleVersions."""
+        ka_ids = {}
+        kav_ids = list(kav_ids)
+        for n in range(0, len(kav_ids), COLLECTION_SIZE):
+            query_str = (
+                "SELECT Id,KnowledgeArticleId FROM {} "
+                "WHERE Id IN ({}) AND PublishStatus='draft' "
+                "AND language='en_US'"
+            ).format(
+                settings.SALESFORCE_ARTICLE_TYPE,
+                ','.join(
+                    "'{}'".format(kav_id)
+                    for kav_id in kav_ids[n:n + COLLECTION_SIZE]
+                ),
+            )
+            for record in self.query_iter(query_str):
+                ka_ids[record['Id']] = record['KnowledgeArticleId']
+        return ka_ids
+
+    def get_catalog(self):
+        """Get the knowledge catalog, loading it on first use."""
+        if self.catalog is None:
+            self.catalog = self.load_catalog()
+        return self.catalog
 
     def get_base_url(self):
         """ Return base URL e.g. https://powerofus.force.com """
@@ -172,43 +465,562 @@ class Salesforce:
             preview_url += '&pubstatus=o'
         return preview_url
 
-    def process_article(self, html, bundle):
-        """Create a draft KnowledgeArticleVersion."""
+    def load_bodies(self, url_names):
+        """
+        Load the bodies of the catalog articles with the given URL names,
+        for comparing them to articles in a bundle. Articles with a checksum
+        are compared by checksum, so their bodies are not loaded.
+        """
+        catalog = self.get_catalog()
+        body_field = settings.SALESFORCE_ARTICLE_BODY_FIELD
+        checksum_field = settings.SALESFORCE_ARTICLE_CHECKSUM_FIELD
+        for publish_status, get_record in (
+            ('draft', catalog.get_draft),
+            ('online', catalog.get_online),
+        ):
+            records = []
+            for url_name in url_names:
+                record = get_record(url_name)
+                if (
+                    record and
+                    body_field not in record and
+                    not (checksum_field and record.get(checksum_field))
+                ):
+                    records.append(record)
+            self.load_fields(records, publish_status, [body_field])
 
-        # update links to draft versions
-        html.update_links_draft(self.get_base_url())
+    def load_catalog(self):
+        """
+        Load all draft and online article versions from the org, with the
+        fields needed to compare them to articles in a bundle, except for
+        the bodies (see load_bodies).
+        If SALESFORCE_ARTICLE_CHECKSUM_FIELD is set, the articles are loaded
+        with their checksums.
+        If SALESFORCE_CATALOG_MIRROR is set, the articles are loaded from the
+        catalog mirror after syncing it with the org.
+        """
+        if settings.SALESFORCE_CATALOG_MIRROR:
+            return self.load_catalog_mirror()
+        checksum_field = settings.SALESFORCE_ARTICLE_CHECKSUM_FIELD
+        records = {}
+        for publish_status in ('draft', 'online'):
+            query_str = (
+                "SELECT Id,KnowledgeArticleId,Title,UrlName,Summary,"
+                "IsVisibleInCsp,IsVisibleInPkb,IsVisibleInPrm,"
+                "LastPublishedDate,{}{},{} FROM {} "
+                "WHERE PublishStatus='{}' AND language='en_US'"
+            ).format(
+                checksum_field + ',' if checksum_field else '',
+                settings.SALESFORCE_ARTICLE_AUTHOR_FIELD,
+                settings.SALESFORCE_ARTICLE_AUTHOR_OVERRIDE_FIELD,
+                settings.SALESFORCE_ARTICLE_TYPE,
+                publish_status,
+            )
+            records[publish_status] = list(self.query_iter(query_str))
+        return KnowledgeCatalog(records['draft'], records['online'])
 
-        # query for existing article
-        result_draft = self.query_articles(html.url_name, 'draft')
-        result_online = self.query_articles(html.url_name, 'online')
+    def load_catalog_mirror(self):
+        """Sync the catalog mirror and load the knowledge catalog from it."""
+        self.sync_catalog()
+        checksum_field = settings.SALESFORCE_ARTICLE_CHECKSUM_FIELD
+        records = {'draft': [], 'online': []}
+        for article in CatalogArticle.objects.all():
+            record = {
+                'Id': article.kav_id,
+                'IsVisibleInCsp': article.is_visible_in_csp,
+                'IsVisibleInPkb': article.is_visible_in_pkb,
+                'IsVisibleInPrm': article.is_visible_in_prm,
+                'KnowledgeArticleId': article.ka_id,
+                'LastPublishedDate': (
+                    article.last_published_date and
+                    article.last_published_date.isoformat()
+                ),
+                'Summary': article.summary,
+                'Title': article.title,
+                'UrlName': article.url_name,
+                settings.SALESFORCE_ARTICLE_AUTHOR_FIELD: article.author,
+                settings.SALESFORCE_ARTICLE_AUTHOR_OVERRIDE_FIELD: (
+                    article.author_override
+                ),
+            }
+            if checksum_field:
+                record[checksum_field] = article.checksum
+            records[article.publish_status].append(record)
+        return KnowledgeCatalog(records['draft'], records['online'])
 
-        if result_draft['totalSize'] == 1:
+    def load_fields(self, records, publish_status, fields):
+        """Add fields to article version records, querying them by Id."""
+        records = {record['Id']: record for record in records}
+        kav_ids = list(records)
+        for n in range(0, len(kav_ids), COLLECTION_SIZE):
+            query_str = (
+                "SELECT Id,{} FROM {} WHERE Id IN ({}) "
+                "AND PublishStatus='{}' AND language='en_US'"
+            ).format(
+                ','.join(fields),
+                settings.SALESFORCE_ARTICLE_TYPE,
+                ','.join(
+                    "'{}'".format(kav_id)
+                    for kav_id in kav_ids[n:n + COLLECTION_SIZE]
+                ),
+                publish_status,
+            )
+            for record in self.query_iter(query_str):
+                for field in fields:
+                    records[record['Id']][field] = record[field]
+
+    def count_articles(self, publish_status):
+        """Count the article versions with a given publish status."""
+        query_str = (
+            "SELECT COUNT() FROM {} "
+            "WHERE PublishStatus='{}' AND language='en_US'"
+        ).format(
+            settings.SALESFORCE_ARTICLE_TYPE,
+            publish_status,
+        )
+        return self.api.query(query_str)['totalSize']
+
+    def query_catalog(self, publish_status, modified_since=None):
+        """
+        Yield article versions with a given publish status, with the fields
+        kept in the catalog mirror. If modified_since is given, only the
+        versions modified at or after that time are yielded.
+        """
+        query_str = (
+            "SELECT Id,KnowledgeArticleId,Title,UrlName,Summary,"
+            "IsVisibleInCsp,IsVisibleInPkb,IsVisibleInPrm,LastPublishedDate,"
+            "SystemModstamp,{}{},{} FROM {} "
+            "WHERE PublishStatus='{}' AND language='en_US'"
+        ).format(
+            settings.SALESFORCE_ARTICLE_CHECKSUM_FIELD + ','
+            if settings.SALESFORCE_ARTICLE_CHECKSUM_FIELD else '',
+            settings.SALESFORCE_ARTICLE_AUTHOR_FIELD,
+            settings.SALESFORCE_ARTICLE_AUTHOR_OVERRIDE_FIELD,
+            settings.SALESFORCE_ARTICLE_TYPE,
+            publish_status,
+        )
+        if modified_since:
+            query_str += ' AND SystemModstamp>={}'.format(
+                modified_since.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            )
+        return self.query_iter(query_str)
+
+    @staticmethod
+    def _lock_catalog():
+        """
+        Lock the catalog mirror until the end of the transaction, so syncs
+        and reconciles running on different workers don't interleave.
+        Reading the mirror is not blocked.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('LOCK TABLE {} IN EXCLUSIVE MODE'.format(
+                connection.ops.quote_name(CatalogArticle._meta.db_table),
+            ))
+
+    def reconcile_catalog(self):
+        """Replace the catalog mirror with the catalog in the org."""
+        articles = [
+            self._get_catalog_article(record, publish_status)
+            for publish_status in ('draft', 'online')
+            for record in self.query_catalog(publish_status)
+        ]
+        with transaction.atomic():
+            self._lock_catalog()
+            CatalogArticle.objects.all().delete()
+            CatalogArticle.objects.bulk_create(articles)
+
+    def sync_catalog(self):
+        """
+        Bring the catalog mirror up to date with the org.
+        Only article versions modified since the last sync are loaded,
+        unless the mirror is empty. Versions that are no longer draft or
+        online (archived or deleted) are pruned by _prune_catalog.
+        Anything else the incremental sync misses is fixed by the scheduled
+        reconcile_catalog management command.
+        """
+        with transaction.atomic():
+            self._lock_catalog()
+            last_sync = CatalogArticle.objects.aggregate(
+                Max('system_modstamp'),
+            )['system_modstamp__max']
+            if last_sync is None:
+                self.reconcile_catalog()
+                return
+            for publish_status in ('draft', 'online'):
+                for record in self.query_catalog(publish_status, last_sync):
+                    article = self._get_catalog_article(record, publish_status)
+                    CatalogArticle.objects.update_or_create(
+                        kav_id=article.kav_id,
+                        defaults={
+                            field.attname: getattr(article, field.attname)
+                            for field in CatalogArticle._meta.concrete_fields
+                            if field.attname not in ('id', 'kav_id')
+                        },
+                    )
+                    if publish_status == 'online':
+                        # the previous online version was archived
+                        CatalogArticle.objects.filter(
+                            ka_id=article.ka_id,
+                            publish_status='online',
+                        ).exclude(kav_id=article.kav_id).delete()
+            for publish_status in ('draft', 'online'):
+                self._prune_catalog(publish_status)
+
+    def _prune_catalog(self, publish_status):
+        """
+        Remove article versions from the catalog mirror that no longer have
+        the publish status in the org. The mirror holds every version of
+        the org after a sync, so the versions are only looked up by Id if
+        there are more of them in the mirror than in the org.
+        """
+        articles = CatalogArticle.objects.filter(publish_status=publish_status)
+        if articles.count() <= self.count_articles(publish_status):
+            return
+        kav_ids = list(articles.values_list('kav_id', flat=True))
+        found = set([])
+        for n in range(0, len(kav_ids), COLLECTION_SIZE):
+            query_str = (
+                "SELECT Id FROM {} WHERE Id IN ({}) "
+                "AND PublishStatus='{}' AND language='en_US'"
+            ).format(
+                settings.SALESFORCE_ARTICLE_TYPE,
+                ','.join(
+                    "'{}'".format(kav_id)
+                    for kav_id in kav_ids[n:n + COLLECTION_SIZE]
+                ),
+                publish_status,
+            )
+            found.update(record['Id'] for record in self.query_iter(query_str))
+        missing = [kav_id for kav_id in kav_ids if kav_id not in found]
+        for n in range(0, len(missing), COLLECTION_SIZE):
+            CatalogArticle.objects.filter(
+                kav_id__in=missing[n:n + COLLECTION_SIZE],
+            ).delete()
+
+    def _get_catalog_article(self, record, publish_status):
+        checksum_field = settings.SALESFORCE_ARTICLE_CHECKSUM_FIELD
+        return CatalogArticle(
+            author=record[settings.SALESFORCE_ARTICLE_AUTHOR_FIELD] or '',
+            author_override=(
+                record[settings.SALESFORCE_ARTICLE_AUTHOR_OVERRIDE_FIELD] or ''
+            ),
+            checksum=(checksum_field and record[checksum_field]) or '',
+            is_visible_in_csp=record['IsVisibleInCsp'],
+            is_visible_in_pkb=record['IsVisibleInPkb'],
+            is_visible_in_prm=record['IsVisibleInPrm'],
+            ka_id=record['KnowledgeArticleId'],
+            kav_id=record['Id'],
+            last_published_date=parse_datetime(
+                record['LastPublishedDate'] or '',
+            ),
+            publish_status=publish_status,
+            summary=record['Summary'] or '',
+            system_modstamp=parse_datetime(record['SystemModstamp']),
+            title=record['Title'],
+            url_name=record['UrlName'],
+        )
+
+    def process_articles(self, htmls, bundle):
+        """
+        Create draft KnowledgeArticleVersions concurrently.
+        Uploads run on up to SALESFORCE_MAX_WORKERS threads, with the number
+        of concurrent uploads adapted to the observed latency and to
+        throttling/record lock errors. Where the API version supports it,
+        articles are uploaded in batches of COLLECTION_SIZE instead of one
+        at a time. Articles are compared to the catalog in batches of
+        COLLECTION_SIZE, with the catalog bodies of only the batch loaded.
+        Yields (html, article) as uploads complete, where article is the
+        Article or None if unchanged. The articles are written with one bulk
+        insert when the uploads are done or have failed.
+        """
+        articles = []
+        try:
+            for html, article in self._process_articles(htmls, bundle):
+                if article:
+                    articles.append(article)
+                yield html, article
+        finally:
+            with transaction.atomic():
+                Article.objects.bulk_create(articles)
+
+    def _process_articles(self, htmls, bundle):
+        base_url = self.get_base_url()
+        # load the catalog before any threads need it
+        catalog = self.get_catalog()
+
+        def prepare():
+            for html in htmls:
+                if not html.has_draft_links:
+                    # update links to draft versions
+                    html.update_links_draft(base_url)
+                # keep only the serialized bodies while the batch is uploaded
+                html.release_tree()
+                yield html
+
+        limit = AdaptiveLimit(settings.SALESFORCE_MAX_WORKERS)
+        prepared = prepare()
+        while True:
+            batch = list(islice(prepared, COLLECTION_SIZE))
+            if not batch:
+                break
+            url_names = [html.url_name for html in batch]
+            self.load_bodies(url_names)
+            try:
+                if self.uses_collections():
+                    yield from self._process_article_batch(
+                        batch,
+                        bundle,
+                        limit,
+                    )
+                    continue
+                for html, result in run_concurrently(
+                    self.upload_article,
+                    batch,
+                    limit,
+                    is_throttled=is_retry_error,
+                ):
+                    article = None
+                    if result:
+                        kav_id, ka_id, status, draft_unchanged = result
+                        article = self.build_article(
+                            kav_id,
+                            html,
+                            bundle,
+                            status,
+                            ka_id,
+                            draft_unchanged,
+                        )
+                    yield html, article
+            finally:
+                catalog.drop_bodies(url_names)
+
+    def _process_article_batch(self, htmls, bundle, limit):
+        """
+        Create draft KnowledgeArticleVersions for up to COLLECTION_SIZE
+        articles with batched requests:
+        - draft copies of changed published articles are created
+          concurrently (the knowledge management resource has no batch form)
+        - new articles are created with one sObject Collections request and
+          their KnowledgeArticleIds are read with one query
+        - all drafts are updated with one sObject Collections request,
+          except existing drafts that are already up to date
+        Per-record errors are mapped back to the article URL names and
+        raised after the successful articles have been yielded.
+        """
+        catalog = self.get_catalog()
+        results = {}
+        errors = {}
+        creates = []
+        updates = []
+        copies = []
+        for html in htmls:
+            record_draft = catalog.get_draft(html.url_name)
+            record_online = catalog.get_online(html.url_name)
+            if record_draft:
+                status = (
+                    Article.STATUS_CHANGED if record_online
+                    else Article.STATUS_NEW
+                )
+                if (
+                    not catalog.is_created(html.url_name) and
+                    html.same_as_record(record_draft, draft=True)
+                ):
+                    if not (
+                        record_online and html.same_as_record(record_online)
+                    ):
+                        results[html.url_name] = (
+                            record_draft['Id'],
+                            record_draft['KnowledgeArticleId'],
+                            status,
+                            True,
+                        )
+                    continue
+                updates.append((
+                    record_draft['Id'],
+                    record_draft['KnowledgeArticleId'],
+                    html,
+                    status,
+                ))
+            elif not record_online:
+                creates.append(html)
+            elif not html.same_as_record(record_online):
+                copies.append((record_online['KnowledgeArticleId'], html))
+
+        # create draft copies of changed published articles
+        def create_draft(item):
+            ka_id, html = item
+            try:
+                return self.create_draft(ka_id), None
+            except Exception as e:
+                if is_retry_error(e):
+                    raise
+                return None, str(e)
+
+        for (ka_id, html), (kav_id, error) in run_concurrently(
+            create_draft,
+            copies,
+            limit,
+            is_throttled=is_retry_error,
+        ):
+            if error:
+                errors[html.url_name] = error
+                continue
+            catalog.set_draft(html.url_name, kav_id, ka_id)
+            updates.append((kav_id, ka_id, html, Article.STATUS_CHANGED))
+
+        # create new articles
+        if creates:
+            created = {}
+            records = [self._get_record(html) for html in creates]
+            for html, result in zip(
+                creates,
+                self.save_records('POST', records, limit),
+            ):
+                if result['success']:
+                    created[result['id']] = html
+                else:
+                    errors[html.url_name] = self._get_record_error(result)
+            ka_ids = self.get_ka_ids(created)
+            for kav_id, html in created.items():
+                if kav_id not in ka_ids:
+                    errors[html.url_name] = (
+                        'KnowledgeArticleVersion {} not found'.format(kav_id)
+                    )
+                    continue
+                ka_id = ka_ids[kav_id]
+                catalog.set_draft(html.url_name, kav_id, ka_id)
+                results[html.url_name] = (
+                    kav_id,
+                    ka_id,
+                    Article.STATUS_NEW,
+                    False,
+                )
+
+        # update drafts
+        if updates:
+            records = [
+                self._get_record(html, kav_id)
+                for kav_id, ka_id, html, status in updates
+            ]
+            for (kav_id, ka_id, html, status), result in zip(
+                updates,
+                self.save_records('PATCH', records, limit),
+            ):
+                if result['success']:
+                    results[html.url_name] = (kav_id, ka_id, status, False)
+                else:
+                    errors[html.url_name] = self._get_record_error(result)
+
+        for html in htmls:
+            if html.url_name in errors:
+                continue
+            article = None
+            if html.url_name in results:
+                kav_id, ka_id, status, draft_unchanged = results[
+                    html.url_name
+                ]
+                article = self.build_article(
+                    kav_id,
+                    html,
+                    bundle,
+                    status,
+                    ka_id,
+                    draft_unchanged,
+                )
+            yield html, article
+        if errors:
+            msg = 'Error saving draft articles:'
+            for url_name in sorted(errors.keys()):
+                msg += '\n{}: {}'.format(url_name, errors[url_name])
+            raise SalesforceError(msg)
+
+    @staticmethod
+    def _get_record(html, kav_id=None):
+        """Get sObject Collections record data for an article."""
+        record = html.create_article_data()
+        record['attributes'] = {'type': settings.SALESFORCE_ARTICLE_TYPE}
+        if kav_id:
+            record['id'] = kav_id
+        return record
+
+    @staticmethod
+    def _get_record_error(result):
+        """Get the error message of a failed record or action input."""
+        return '; '.join(
+            '{}: {}'.format(error['statusCode'], error['message'])
+            for error in result['errors'] or []
+        ) or 'Unknown error'
+
+    def uses_collections(self):
+        """sObject Collections are available from API version 42.0."""
+        return float(settings.SALESFORCE_API_VERSION) >= 42.0
+
+    def uses_knowledge_actions(self):
+        """Knowledge publish/archive actions are available from 44.0."""
+        return float(settings.SALESFORCE_API_VERSION) >= 44.0
+
+    def upload_article(self, html):
+        """
+        Upload an article as a draft KnowledgeArticleVersion.
+        Links must already point to the draft locations. Does not touch the
+        database, so it is safe to call from worker threads.
+        Returns (kav_id, ka_id, status, draft_unchanged) or None if the
+        article is unchanged.
+        """
+
+        # look up existing article
+        catalog = self.get_catalog()
+        record_draft = catalog.get_draft(html.url_name)
+        record_online = catalog.get_online(html.url_name)
+        draft_unchanged = False
+
+        if record_draft:
             # draft exists, update fields
-            kav_id = result_draft['records'][0]['Id']
-            self.update_draft(kav_id, html)
-            if result_online['totalSize'] == 1:
+            kav_id = record_draft['Id']
+            ka_id = record_draft['KnowledgeArticleId']
+            if ka_id is None:
+                # created by an earlier attempt that failed to look it up
+                ka_id = self.get_ka_id(kav_id, 'draft')
+                catalog.set_draft(html.url_name, kav_id, ka_id)
+            if record_online:
                 # published version exists
                 status = Article.STATUS_CHANGED
             else:
                 # not published
                 status = Article.STATUS_NEW
-        elif result_online['totalSize'] == 0:
+            if (
+                not catalog.is_created(html.url_name) and
+                html.same_as_record(record_draft, draft=True)
+            ):
+                # draft is up to date
+                if record_online and html.same_as_record(record_online):
+                    # and so is the published version
+                    return None
+                draft_unchanged = True
+            else:
+                self.update_draft(kav_id, html)
+        elif not record_online:
             # new draft, new article
             kav_id = self.create_article(html)
+            # record the draft first, so a retry does not create it again
+            catalog.set_draft(html.url_name, kav_id, None)
+            ka_id = self.get_ka_id(kav_id, 'draft')
+            catalog.set_draft(html.url_name, kav_id, ka_id)
             status = Article.STATUS_NEW
-        elif result_online['totalSize'] == 1:
+        else:
             # new draft of existing article
-            record = result_online['records'][0]
             # check for changes in article fields
-            if html.same_as_record(record):
+            if html.same_as_record(record_online):
                 # no update
-                return
+                return None
             # create draft copy of published article
-            kav_id = self.create_draft(record['KnowledgeArticleId'])
+            ka_id = record_online['KnowledgeArticleId']
+            kav_id = self.create_draft(ka_id)
+            catalog.set_draft(html.url_name, kav_id, ka_id)
             self.update_draft(kav_id, html)
             status = Article.STATUS_CHANGED
 
-        self.save_article(kav_id, html, bundle, status)
+        return kav_id, ka_id, status, draft_unchanged
 
     def publish_draft(self, kav_id):
         """Publish a draft KnowledgeArticleVersion."""
@@ -225,28 +1037,136 @@ class Salesforce:
         kav_api.update(kav_id, data)
         self.set_publish_status(kav_id, 'online')
 
-    def query_articles(self, url_name, publish_status):
-        """Query KnowledgeArticleVersion objects."""
-        query_str = (
-            "SELECT Id,KnowledgeArticleId,Title,Summary,"
-            "IsVisibleInCsp,IsVisibleInPkb,IsVisibleInPrm,{},{},{} FROM {} "
-            "WHERE UrlName='{}' AND PublishStatus='{}' AND language='en_US'"
-        ).format(
-            settings.SALESFORCE_ARTICLE_BODY_FIELD,
-            settings.SALESFORCE_ARTICLE_AUTHOR_FIELD,
-            settings.SALESFORCE_ARTICLE_AUTHOR_OVERRIDE_FIELD,
-            settings.SALESFORCE_ARTICLE_TYPE,
-            url_name,
-            publish_status,
-        )
-        result = self.api.query(query_str)
-        return result
+    def publish_drafts(self, kav_ids):
+        """
+        Publish draft KnowledgeArticleVersions.
+        Where the API version supports it, bodies are rewritten to the
+        production image links with sObject Collections and the drafts are
+        published in batches with the publishKnowledgeArticles action.
+        Yields (kav_id, error) per article, where error is None on success.
+        """
+        if not self.uses_knowledge_actions():
+            for kav_id in kav_ids:
+                self.publish_draft(kav_id)
+                yield kav_id, None
+            return
+        kav_ids = list(kav_ids)
+        for n in range(0, len(kav_ids), COLLECTION_SIZE):
+            batch = kav_ids[n:n + COLLECTION_SIZE]
+            errors = {}
+            # update links to production
+            query_str = (
+                "SELECT Id,{} FROM {} WHERE Id IN ({}) "
+                "AND PublishStatus='draft' AND language='en_US'"
+            ).format(
+                settings.SALESFORCE_ARTICLE_BODY_FIELD,
+                settings.SALESFORCE_ARTICLE_TYPE,
+                ','.join("'{}'".format(kav_id) for kav_id in batch),
+            )
+            records = []
+            for kav in self.query_iter(query_str):
+                body = HTML.update_links_production(
+                    kav[settings.SALESFORCE_ARTICLE_BODY_FIELD],
+                )
+                record = {
+                    'attributes': {'type': settings.SALESFORCE_ARTICLE_TYPE},
+                    'id': kav['Id'],
+                    settings.SALESFORCE_ARTICLE_BODY_FIELD: body,
+                }
+                if settings.SALESFORCE_ARTICLE_TEXT_INDEX_FIELD is not False:
+                    record[settings.SALESFORCE_ARTICLE_TEXT_INDEX_FIELD] = body
+                records.append(record)
+            found = set(record['id'] for record in records)
+            for kav_id in batch:
+                if kav_id not in found:
+                    errors[kav_id] = (
+                        'KnowledgeArticleVersion {} not found'.format(kav_id)
+                    )
+            for record, result in zip(
+                records,
+                self.save_records('PATCH', records),
+            ):
+                if not result['success']:
+                    errors[record['id']] = self._get_record_error(result)
+            # publish drafts
+            errors.update(self.run_knowledge_action(
+                'publishKnowledgeArticles',
+                [kav_id for kav_id in batch if kav_id not in errors],
+                pubActionType='PUBLISH_ARTICLE',
+            ))
+            for kav_id in batch:
+                yield kav_id, errors.get(kav_id)
 
-    def save_article(self, kav_id, html, bundle, status):
-        """Create an Article object from parsed HTML."""
-        ka_id = self.get_ka_id(kav_id, 'draft')
-        Article.objects.create(
+    def query_iter(self, query_str):
+        """
+        Run a SOQL query, yielding the records as the result pages are
+        fetched. Pages hold up to SALESFORCE_QUERY_BATCH_SIZE records.
+        """
+        url = self.api.base_url + 'query/'
+        params = {'q': query_str}
+        while True:
+            # the session may be renewed between pages
+            headers = dict(self.api.headers)
+            headers['Sforce-Query-Options'] = 'batchSize={}'.format(
+                settings.SALESFORCE_QUERY_BATCH_SIZE,
+            )
+            response = self.api.session.request(
+                'GET',
+                url,
+                headers=headers,
+                params=params,
+            )
+            if response.status_code >= 300:
+                exception_handler(response)
+            result = response.json()
+            yield from result['records']
+            if result['done']:
+                break
+            url = urljoin(self.api.base_url, result['nextRecordsUrl'])
+            params = None
+
+    def run_knowledge_action(self, action, kav_ids, **params):
+        """
+        Run a standard knowledge action (e.g. publishKnowledgeArticles) with
+        one input per KnowledgeArticleVersion, ACTION_SIZE inputs per
+        request. Returns error messages keyed by KnowledgeArticleVersion ID.
+        """
+        url = self.api.base_url + 'actions/standard/' + action
+        errors = {}
+        for n in range(0, len(kav_ids), ACTION_SIZE):
+            batch = kav_ids[n:n + ACTION_SIZE]
+            data = {'inputs': [
+                dict(params, articleVersionIdList=[kav_id])
+                for kav_id in batch
+            ]}
+            try:
+                response = self.api._call_salesforce('POST', url, json=data)
+                results = response.json()
+            except SalesforceMalformedRequest as e:
+                # all inputs failed
+                if not isinstance(e.content, list):
+                    raise
+                results = e.content
+            for kav_id, result in zip(batch, results):
+                if not result['isSuccess']:
+                    errors[kav_id] = self._get_record_error(result)
+        return errors
+
+    def build_article(
+        self,
+        kav_id,
+        html,
+        bundle,
+        status,
+        ka_id=None,
+        draft_unchanged=False,
+    ):
+        """Build an unsaved Article object from parsed HTML."""
+        if ka_id is None:
+            ka_id = self.get_ka_id(kav_id, 'draft')
+        return Article(
             bundle=bundle,
+            draft_unchanged=draft_unchanged,
             ka_id=ka_id,
             kav_id=kav_id,
             preview_url=self.get_preview_url(ka_id),
@@ -255,6 +1175,59 @@ class Salesforce:
             url_name=html.url_name,
         )
 
+    def save_records(self, method, records, limit=None):
+        """
+        Create (POST) or update (PATCH) records using sObject Collections,
+        COLLECTION_SIZE records per request. The requests run concurrently
+        within limit, and are sent again with backoff if they fail with a
+        throttling or record lock error. Updates are also sent again after a
+        server error; creates are not, since the records may have been
+        created. Records failing with a retry error code are resent up to
+        COLLECTION_RETRIES times.
+        Returns the per-record results in the order of records.
+        """
+        url = self.api.base_url + 'composite/sobjects'
+        if limit is None:
+            limit = AdaptiveLimit(settings.SALESFORCE_MAX_WORKERS)
+        if method == 'PATCH':
+            is_throttled = is_request_retry_error
+        else:
+            is_throttled = is_retry_error
+
+        def send(batch):
+            data = {
+                'allOrNone': False,
+                'records': [records[i] for i in batch],
+            }
+            return self.api._call_salesforce(method, url, json=data).json()
+
+        results = [None] * len(records)
+        pending = list(range(len(records)))
+        for attempt in range(COLLECTION_RETRIES + 1):
+            retry = []
+            batches = [
+                tuple(pending[n:n + COLLECTION_SIZE])
+                for n in range(0, len(pending), COLLECTION_SIZE)
+            ]
+            for batch, batch_results in run_concurrently(
+                send,
+                batches,
+                limit,
+                is_throttled=is_throttled,
+            ):
+                for i, result in zip(batch, batch_results):
+                    results[i] = result
+                    if not result['success'] and any(
+                        error['statusCode'] in RETRY_ERROR_CODES
+                        for error in result['errors']
+                    ):
+                        retry.append(i)
+            if not retry or attempt == COLLECTION_RETRIES:
+                break
+            pending = sorted(retry)
+            time.sleep(2 ** attempt)
+        return results
+
     def set_publish_status(self, kav_id, status):
         url = (
             self.api.base_url +
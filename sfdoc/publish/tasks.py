@@ -1,26 +1,210 @@
-from io import BytesIO
 import json
+import logging
+from multiprocessing import get_context
 import os
+import threading
 from tempfile import TemporaryDirectory
+import time
 
 from django.conf import settings
+from django.utils.dateparse import parse_datetime
 from django.utils.timezone import now
 from django_rq import job
-import requests
 
 from .amazon import S3
+from .concurrency import run_in_background
+from .exceptions import CancelledError
+from .exceptions import HtmlError
 from .exceptions import SfdocError
 from .html import HTML
+from .logger import close_logger
 from .logger import get_logger
 from .models import Article
 from .models import Bundle
 from .models import Image
+from .models import ImageReference
+from .models import ManifestEntry
 from .models import Webhook
 from .salesforce import Salesforce
-from .logger import get_logger
+from .utils import download
+from .utils import get_md5
+from .utils import init_worker_process
 from .utils import is_html
 from .utils import skip_html_file
 from .utils import unzip
+from .utils import ZipIndex
+
+# settings read while scrubbing, passed on to the worker processes
+SCRUB_SETTINGS = (
+    'ARTICLE_AUTHOR',
+    'ARTICLE_AUTHOR_OVERRIDE',
+    'ARTICLE_BODY_CLASS',
+    'AWS_S3_BUCKET',
+    'AWS_S3_DRAFT_DIR',
+    'SALESFORCE_ARTICLE_AUTHOR_FIELD',
+    'SALESFORCE_ARTICLE_AUTHOR_OVERRIDE_FIELD',
+    'SALESFORCE_ARTICLE_BODY_FIELD',
+    'SALESFORCE_ARTICLE_LINK_LIMIT',
+    'SALESFORCE_ARTICLE_URL_PATH_PREFIX',
+    'WHITELIST_HTML',
+    'WHITELIST_URL',
+)
+
+
+def _read_html_file(html_file, source=None):
+    """Parse an HTML file, reading it from disk unless source is given."""
+    if source is None:
+        with open(html_file) as f:
+            source = f.read()
+    return HTML(source)
+
+
+def _scrub_html_file(html_file, source=None, base_url=''):
+    """
+    Scrub an HTML file and update its links to the draft locations.
+    Returns the parsed HTML and the absolute paths of the linked images.
+    """
+    html = _read_html_file(html_file, source)
+    html.scrub()
+    image_paths = set([])
+    for image_path in html.get_image_paths():
+        image_paths.add(os.path.abspath(os.path.join(
+            os.path.dirname(html_file),
+            image_path,
+        )))
+    html.update_links_draft(base_url)
+    return html, image_paths
+
+
+def _scrub_html_file_safe(html_file, source=None, base_url=''):
+    """
+    Scrub an HTML file, returning HTML errors instead of raising them.
+    The parsed tree is released once the links are updated, so only the
+    serialized bodies are kept until the article is uploaded and the file
+    is parsed only once.
+    """
+    try:
+        html, image_paths = _scrub_html_file(html_file, source, base_url)
+    except HtmlError as e:
+        return None, None, None, None, e
+    html.release_tree()
+    return html, html.url_name, html.get_checksum(), image_paths, None
+
+
+def _scrub_html_file_worker(args):
+    """
+    Scrub an HTML file in a worker process.
+    The HTML is sent back with its serialized bodies, not the parsed tree.
+    """
+    return _scrub_html_file_safe(*args)
+
+
+def _scrub_html_files(html_files, read_source=None, base_url=''):
+    """
+    Scrub HTML files, using a pool of SCRUB_WORKERS processes if configured.
+    HTML is read with read_source(html_file) if given, or from disk otherwise.
+    Sources are read as the files are queued for scrubbing, at most two
+    chunks per worker ahead of the results, so they are never all in memory.
+    Links are updated to the draft locations, with base_url for article links
+    over the link limit.
+    Yields (html, url_name, checksum, image_paths, error) in the order of
+    html_files.
+    The worker processes are started by a fork server rather than forked
+    from this process, so they do not inherit the state of its threads.
+    """
+    def iter_items(ahead=None, stop=None):
+        for html_file in html_files:
+            if ahead:
+                # the pool's task thread reads the items as fast as it can
+                while not ahead.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+            source = read_source(html_file) if read_source else None
+            yield html_file, source, base_url
+
+    workers = min(settings.SCRUB_WORKERS, len(html_files))
+    if workers <= 1:
+        for item in iter_items():
+            yield _scrub_html_file_safe(*item)
+        return
+    chunksize = max(1, len(html_files) // (workers * 4))
+    ahead = threading.Semaphore(workers * chunksize * 2)
+    stop = threading.Event()
+    with get_context('forkserver').Pool(
+        workers,
+        initializer=init_worker_process,
+        initargs=({name: getattr(settings, name) for name in SCRUB_SETTINGS},),
+    ) as pool:
+        try:
+            for result in pool.imap(
+                _scrub_html_file_worker,
+                iter_items(ahead, stop),
+                chunksize=chunksize,
+            ):
+                ahead.release()
+                yield result
+        finally:
+            # let the task thread finish so the pool can shut down
+            stop.set()
+
+
+def _get_images_used(bundle):
+    """
+    Get the lowercase filenames of the images referenced by the bundle.
+    Like articles missing from the bundle are archived, images it does not
+    reference are deleted, so both are scoped to the bundle.
+    """
+    return set(
+        image.lower() for image in bundle.image_references.values_list(
+            'image',
+            flat=True,
+        ).distinct()
+    )
+
+
+def _get_manifest(bundle, salesforce, production_objects, logger):
+    """
+    Get the article and image checksums of the last published bundle for
+    the same easyDITA resource, keyed by lowercase URL name and by filename
+    in its original case, which is the image's S3 key.
+    The manifest is ignored if the org or the bucket have drifted from it
+    since that bundle was published.
+    """
+    last_published = bundle.get_last_published()
+    if not last_published:
+        return {}, {}
+    articles = last_published.get_manifest(ManifestEntry.TYPE_ARTICLE)
+    images = last_published.get_manifest(ManifestEntry.TYPE_IMAGE)
+    if not articles and not images:
+        return {}, {}
+    drift = []
+    catalog = salesforce.get_catalog()
+    for url_name in sorted(articles):
+        record = catalog.get_online(url_name)
+        if not record:
+            drift.append('Article {} is not online'.format(url_name))
+            continue
+        time_published = parse_datetime(record.get('LastPublishedDate') or '')
+        if time_published and time_published > last_published.time_published:
+            drift.append('Article {} was published at {}'.format(
+                url_name,
+                time_published,
+            ))
+    for filename in sorted(images):
+        obj = production_objects.get(filename)
+        if not obj:
+            drift.append('Image {} is not in the bucket'.format(filename))
+            continue
+        etag = obj['ETag'].strip('"')
+        if '-' not in etag and etag != images[filename]:
+            # single part upload changed since publishing
+            drift.append('Image {} has changed'.format(filename))
+    if drift:
+        logger.info('Not using manifest of %s, found changes since it '
+            'was published:\n%s', last_published, '\n'.join(drift))
+        return {}, {}
+    logger.info('Using manifest of %s', last_published)
+    return articles, images
 
 
 def _process_bundle(bundle, path):
@@ -28,17 +212,40 @@ def _process_bundle(bundle, path):
     # get APIs
     salesforce = Salesforce()
     s3 = S3()
-    # download bundle
-    logger.info('Downloading easyDITA bundle from %s', bundle.url)
-    auth = (settings.EASYDITA_USERNAME, settings.EASYDITA_PASSWORD)
-    response = requests.get(bundle.url, auth=auth)
-    zip_file = BytesIO(response.content)
-    unzip(zip_file, path, recursive=True)
-    # collect paths to all HTML files
-    html_files = []
-    for dirpath, dirnames, filenames in os.walk(path):
-        for filename in filenames:
-            filename_full = os.path.join(dirpath, filename)
+    # fetch the remote listings while the bundle is downloaded and scrubbed
+    logger.info('Loading knowledge catalog and bucket listing')
+    catalog_loaded = run_in_background(salesforce.get_catalog)
+    production_objects_loaded = run_in_background(s3.get_production_objects)
+    try:
+        # download bundle
+        logger.info('Downloading easyDITA bundle from %s', bundle.url)
+        auth = (settings.EASYDITA_USERNAME, settings.EASYDITA_PASSWORD)
+        zip_file = os.path.join(path, 'bundle.zip')
+        start = time.monotonic()
+        size = download(bundle.url, zip_file, auth=auth)
+        elapsed = max(time.monotonic() - start, 1e-6)
+        logger.info('Downloaded %d bytes in %.1f seconds (%d bytes/sec)',
+            size,
+            elapsed,
+            size / elapsed,
+        )
+        path = os.path.join(path, 'bundle')
+        zip_index = None
+        if settings.EXTRACT_REFERENCED_ONLY:
+            # read HTML from the archive, extract referenced images later
+            zip_index = ZipIndex(zip_file, path, recursive=True)
+            filenames = list(zip_index)
+        else:
+            unzip(zip_file, path, recursive=True)
+            os.remove(zip_file)
+            filenames = []
+            for dirpath, dirnames, dir_filenames in os.walk(path):
+                for filename in dir_filenames:
+                    filenames.append(os.path.join(dirpath, filename))
+        # collect paths to all HTML files
+        html_files = []
+        for filename_full in filenames:
+            filename = os.path.basename(filename_full)
             if is_html(filename):
                 if skip_html_file(filename):
                     logger.info(
@@ -47,128 +254,252 @@ def _process_bundle(bundle, path):
                     )
                     continue
                 html_files.append(filename_full)
-    # check all HTML files and create list of image files
-    url_map = {}
-    images = set([])
-    article_image_map = {}
-    logger.info('Scrubbing all HTML files in %s', bundle)
-    for n, html_file in enumerate(html_files, start=1):
-        logger.info('Scrubbing HTML file %d of %d: %s',
-            n,
-            len(html_files),
-            html_file.replace(path + os.sep, ''),
-        )
-        with open(html_file) as f:
-            html_raw = f.read()
-        html = HTML(html_raw)
-        html.scrub()
-        article_image_map[html.url_name] = set([])
-        for image_path in html.get_image_paths():
-            image_path_full = os.path.abspath(os.path.join(
-                os.path.dirname(html_file),
-                image_path,
-            ))
-            article_image_map[html.url_name].add(image_path_full)
-            images.add(image_path_full)
-        url_name = html.url_name.lower()
-        if url_name not in url_map:
-            url_map[url_name] = []
-        url_map[url_name].append(html_file)
-    # check for duplicate URL names
-    if any(map(lambda x: len(x) > 1, url_map.values())):
-        msg = 'Found URL name duplicates:'
-        for url_name in sorted(url_map.keys()):
-            if len(url_map[url_name]) == 1:
-                continue
-            msg += '\n{}'.format(url_name)
-            for html_file in sorted(url_map[url_name]):
-                msg += '\n\t{}'.format(html_file)
-        raise SfdocError(msg)
-    # check for duplicate image filenames
-    image_map = {}
-    duplicate_images = False
-    for image in images:
-        basename = os.path.basename(image).lower()
-        if basename not in image_map:
-            image_map[basename] = []
-        image_map[basename].append(image)
-        if len(image_map[basename]) > 1:
-            duplicate_images = True
-    if duplicate_images:
-        msg = 'Found image duplicates:'
-        for basename in sorted(image_map.keys()):
-            msg += '\n{}'.format(basename)
-            for image in sorted(image_map[basename]):
-                msg += '\n\t{}'.format(image)
-        raise SfdocError(msg)
-    # build list of published articles to archive
-    for article in salesforce.get_articles('online'):
-        if article['UrlName'].lower() not in url_map:
-            Article.objects.create(
+        # check all HTML files and create list of image files
+        url_map = {}
+        images = set([])
+        article_checksums = {}
+        article_url_names = {}
+        article_image_map = {}
+        html_map = {}
+        try:
+            if zip_index:
+                def read_source(html_file):
+                    return zip_index.read(html_file).decode('utf-8')
+            else:
+                read_source = None
+            logger.info('Scrubbing all HTML files in %s', bundle)
+            results = _scrub_html_files(
+                html_files,
+                read_source,
+                salesforce.get_base_url(),
+            )
+            try:
+                for n, (html_file, result) in enumerate(
+                    zip(html_files, results),
+                    start=1,
+                ):
+                    html, url_name, checksum, image_paths, error = result
+                    logger.info('Scrubbed HTML file %d of %d: %s',
+                        n,
+                        len(html_files),
+                        html_file.replace(path + os.sep, ''),
+                    )
+                    if error:
+                        raise error
+                    html_map[html_file] = html
+                    article_image_map[url_name] = image_paths
+                    images.update(image_paths)
+                    url_name = url_name.lower()
+                    article_checksums[url_name] = checksum
+                    article_url_names[html_file] = url_name
+                    if url_name not in url_map:
+                        url_map[url_name] = []
+                    url_map[url_name].append(html_file)
+            finally:
+                # shut down the worker pool
+                results.close()
+            if zip_index:
+                referenced = [image for image in images if image in zip_index]
+                for image in referenced:
+                    zip_index.extract(image)
+                logger.info('Extracted %d referenced images of %d files',
+                    len(referenced),
+                    len(zip_index),
+                )
+        finally:
+            if zip_index:
+                zip_index.close()
+                os.remove(zip_file)
+        # check for duplicate URL names
+        if any(map(lambda x: len(x) > 1, url_map.values())):
+            msg = 'Found URL name duplicates:'
+            for url_name in sorted(url_map.keys()):
+                if len(url_map[url_name]) == 1:
+                    continue
+                msg += '\n{}'.format(url_name)
+                for html_file in sorted(url_map[url_name]):
+                    msg += '\n\t{}'.format(html_file)
+            raise SfdocError(msg)
+        # check for duplicate image filenames
+        image_map = {}
+        duplicate_images = False
+        for image in images:
+            basename = os.path.basename(image).lower()
+            if basename not in image_map:
+                image_map[basename] = []
+            image_map[basename].append(image)
+            if len(image_map[basename]) > 1:
+                duplicate_images = True
+        if duplicate_images:
+            msg = 'Found image duplicates:'
+            for basename in sorted(image_map.keys()):
+                msg += '\n{}'.format(basename)
+                for image in sorted(image_map[basename]):
+                    msg += '\n\t{}'.format(image)
+            raise SfdocError(msg)
+        # record which articles use which images
+        ImageReference.objects.bulk_create([
+            ImageReference(
                 bundle=bundle,
-                ka_id=article['KnowledgeArticleId'],
-                kav_id=article['Id'],
-                status=Article.STATUS_DELETED,
-                title=article['Title'],
-                url_name=article['UrlName'],
-                preview_url=salesforce.get_preview_url(
-                    article['KnowledgeArticleId'],
-                    online=True,
-                ),
+                image=os.path.basename(image),
+                url_name=url_name,
             )
+            for url_name, image_paths in article_image_map.items()
+            for image in set(image_paths)
+        ])
+        # wait for the remote listings
+        catalog_loaded.result()
+        production_objects = production_objects_loaded.result()
+    except Exception as e:
+        # stop the background calls from using the APIs any further and
+        # wait for them, so their errors are logged with the bundle
+        salesforce.cancel()
+        s3.cancel()
+        for future in (catalog_loaded, production_objects_loaded):
+            error = future.exception()
+            if (
+                error and
+                error is not e and
+                not isinstance(error, CancelledError)
+            ):
+                logger.error('Error loading in the background: %s', error)
+        raise
+    # build list of published articles to archive
+    Article.objects.bulk_create([
+        Article(
+            bundle=bundle,
+            ka_id=article['KnowledgeArticleId'],
+            kav_id=article['Id'],
+            status=Article.STATUS_DELETED,
+            title=article['Title'],
+            url_name=article['UrlName'],
+            preview_url=salesforce.get_preview_url(
+                article['KnowledgeArticleId'],
+                online=True,
+            ),
+        )
+        for article in salesforce.get_catalog().online.values()
+        if article['UrlName'].lower() not in url_map
+    ])
     # build list of images to delete
-    for obj in s3.iter_objects():
-        if (
-            not obj['Key'].startswith(settings.AWS_S3_DRAFT_DIR) and
-            obj['Key'].lower() not in image_map
-        ):
-            Image.objects.create(
+    images_used = _get_images_used(bundle)
+    if images_used:
+        Image.objects.bulk_create([
+            Image(
                 bundle=bundle,
                 filename=obj['Key'],
                 status=Image.STATUS_DELETED,
             )
+            for obj in production_objects.values()
+            if obj['Key'].lower() not in images_used
+        ])
+    else:
+        # don't empty the bucket for a bundle without image references
+        logger.info('Not deleting images, %s references no images', bundle)
+    # skip articles and images unchanged since the last published bundle
+    image_checksums = {image: get_md5(image) for image in images}
+    manifest_articles, manifest_images = _get_manifest(
+        bundle,
+        salesforce,
+        production_objects,
+        logger,
+    )
+    changed_html_files = []
+    for html_file in html_files:
+        url_name = article_url_names[html_file]
+        if manifest_articles.get(url_name) == article_checksums[url_name]:
+            del html_map[html_file]
+        else:
+            changed_html_files.append(html_file)
+    changed_images = [
+        image for image in images
+        if manifest_images.get(os.path.basename(image)) !=
+        image_checksums[image]
+    ]
+    logger.info('Skipping %d unchanged articles and %d unchanged images',
+        len(html_files) - len(changed_html_files),
+        len(images) - len(changed_images),
+    )
     # upload draft articles and images
     logger.info('Uploading draft articles and images')
     # process HTML files
-    for n, html_file in enumerate(html_files, start=1):
-        logger.info('Processing HTML file %d of %d: %s',
+
+    def iter_htmls():
+        for html_file in changed_html_files:
+            yield html_map.pop(html_file)
+    for n, (html, article) in enumerate(
+        salesforce.process_articles(iter_htmls(), bundle),
+        start=1,
+    ):
+        if not article:
+            status = 'unchanged'
+        elif article.draft_unchanged:
+            status = '{}, draft unchanged'.format(article.get_status_display())
+        else:
+            status = article.get_status_display()
+        logger.info('Processed article %d of %d: %s (%s)',
             n,
-            len(html_files),
-            html_file.replace(path + os.sep, ''),
+            len(changed_html_files),
+            html.url_name,
+            status,
         )
-        with open(html_file) as f:
-            html_raw = f.read()
-        html = HTML(html_raw)
-        salesforce.process_article(html, bundle)
     # process images
-    for n, image in enumerate(images, start=1):
-        logger.info('Processing image file %d of %d: %s',
+    for n, (image, status) in enumerate(
+        s3.process_images(
+            changed_images,
+            bundle,
+            production_objects,
+            image_checksums,
+        ),
+        start=1,
+    ):
+        logger.info('Processed image file %d of %d: %s',
             n,
-            len(images),
+            len(changed_images),
             image.replace(path + os.sep, ''),
         )
-        s3.process_image(image, bundle)
     # upload unchanged images for article previews
     logger.info('Checking for unchanged images used in draft articles')
-    unchanged_images = set([])
-    for article in bundle.articles.filter(status__in=(
-        Article.STATUS_NEW,
-        Article.STATUS_CHANGED,
-    )):
-        for image in article_image_map[article.url_name]:
-            if not bundle.images.filter(filename=os.path.basename(image)):
-                unchanged_images.add(image)
-    for n, image in enumerate(unchanged_images, start=1):
-        logger.info('Uploading unchanged image %d of %d: %s',
+    unchanged_images = set(
+        image_map[image.lower()][0]
+        for image in bundle.image_references.filter(
+            url_name__in=bundle.articles.filter(status__in=(
+                Article.STATUS_NEW,
+                Article.STATUS_CHANGED,
+            )).values('url_name'),
+        ).exclude(
+            image__in=bundle.images.values('filename'),
+        ).values_list('image', flat=True).distinct()
+    )
+    for n, (image, copied) in enumerate(
+        s3.stage_images(unchanged_images),
+        start=1,
+    ):
+        logger.info('Staged unchanged image %d of %d: %s (%s)',
             n,
             len(unchanged_images),
-            image
+            image,
+            'copied' if copied else 'uploaded',
         )
-        key = settings.AWS_S3_DRAFT_DIR + os.path.basename(image)
-        s3.upload_image(image, key)
     # error if nothing changed
     if not bundle.articles.count() and not bundle.images.count():
         raise SfdocError('No articles or images changed')
+    # record checksums for diffing the next bundle against this one
+    ManifestEntry.objects.bulk_create([
+        ManifestEntry(
+            bundle=bundle,
+            type=ManifestEntry.TYPE_ARTICLE,
+            name=url_name,
+            checksum=checksum,
+        ) for url_name, checksum in article_checksums.items()
+    ] + [
+        ManifestEntry(
+            bundle=bundle,
+            type=ManifestEntry.TYPE_IMAGE,
+            name=os.path.basename(image),
+            checksum=checksum,
+        ) for image, checksum in image_checksums.items()
+    ])
     # finish
     bundle.status = bundle.STATUS_DRAFT
     bundle.save()
@@ -178,36 +509,68 @@ def _publish_drafts(bundle):
     logger = get_logger(bundle)
     salesforce = Salesforce()
     s3 = S3()
+    errors = []
     # publish articles
-    articles = bundle.articles.filter(status__in=[
-        Article.STATUS_NEW,
-        Article.STATUS_CHANGED,
-    ])
-    N = articles.count()
-    for n, article in enumerate(articles.all(), start=1):
-        logger.info('Publishing article %d of %d: %s', n, N, article)
-        salesforce.publish_draft(article.kav_id)
+    articles = {article.kav_id: article for article in bundle.articles.filter(
+        status__in=[
+            Article.STATUS_NEW,
+            Article.STATUS_CHANGED,
+        ],
+    )}
+    N = len(articles)
+    for n, (kav_id, error) in enumerate(
+        salesforce.publish_drafts(articles.keys()),
+        start=1,
+    ):
+        article = articles[kav_id]
+        if error:
+            logger.error('Error publishing article %d of %d: %s: %s',
+                n, N, article, error)
+            errors.append('{}: {}'.format(article, error))
+        else:
+            logger.info('Published article %d of %d: %s', n, N, article)
     # publish images
     images = bundle.images.filter(status__in=[
         Image.STATUS_NEW,
         Image.STATUS_CHANGED,
     ])
     N = images.count()
-    for n, image in enumerate(images.all(), start=1):
-        logger.info('Publishing image %d of %d: %s', n, N, image)
-        s3.copy_to_production(image.filename)
+    for n, filename in enumerate(s3.copy_images_to_production(
+        image.filename for image in images
+    ), start=1):
+        logger.info('Published image %d of %d: %s', n, N, filename)
     # archive articles
-    articles = bundle.articles.filter(status=Article.STATUS_DELETED)
-    N = articles.count()
-    for n, article in enumerate(articles.all(), start=1):
-        logger.info('Archiving article %d of %d: %s', n, N, article)
-        salesforce.archive(article.ka_id, article.kav_id)
+    articles = {article.kav_id: article for article in bundle.articles.filter(
+        status=Article.STATUS_DELETED,
+    )}
+    N = len(articles)
+    for n, (kav_id, error) in enumerate(
+        salesforce.archive_articles(
+            (article.ka_id, article.kav_id) for article in articles.values()
+        ),
+        start=1,
+    ):
+        article = articles[kav_id]
+        if error:
+            logger.error('Error archiving article %d of %d: %s: %s',
+                n, N, article, error)
+            errors.append('{}: {}'.format(article, error))
+        else:
+            logger.info('Archived article %d of %d: %s', n, N, article)
     # delete images
     images = bundle.images.filter(status=Image.STATUS_DELETED)
     N = images.count()
-    for n, image in enumerate(images.all(), start=1):
-        logger.info('Deleting image %d of %d: %s', n, N, image)
-        s3.delete(image.filename)
+    for n, (filename, error) in enumerate(s3.delete_images(
+        image.filename for image in images
+    ), start=1):
+        if error:
+            logger.error('Error deleting image %d of %d: %s: %s',
+                n, N, filename, error)
+            errors.append('{}: {}'.format(filename, error))
+        else:
+            logger.info('Deleted image %d of %d: %s', n, N, filename)
+    if errors:
+        raise SfdocError('Error publishing drafts:\n' + '\n'.join(errors))
 
 
 @job('default', timeout=600)
@@ -221,22 +584,31 @@ def process_bundle(bundle_pk):
     bundle.time_processed = now()
     bundle.save()
     logger = get_logger(bundle)
-    logger.info('Processing %s', bundle)
-    with TemporaryDirectory() as tempdir:
-        try:
-            _process_bundle(bundle, tempdir)
-        except Exception as e:
-            bundle.set_error(e)
-            process_queue.delay()
-            raise
-    logger.info('Processed %s', bundle)
+    try:
+        logger.info('Processing %s', bundle)
+        with TemporaryDirectory() as tempdir:
+            try:
+                _process_bundle(bundle, tempdir)
+            except Exception as e:
+                bundle.set_error(e)
+                process_queue.delay()
+                raise
+        logger.info('Processed %s', bundle)
+    finally:
+        close_logger(logger)
 
 
 @job
 def process_queue():
     """Process the next easyDITA bundle in the queue."""
     s3 = S3()
-    s3.delete_draft_images()
+    for key, error in s3.delete_draft_images():
+        if error:
+            logging.getLogger(__name__).error(
+                'Error deleting draft image %s: %s',
+                key,
+                error,
+            )
     if Bundle.objects.filter(status__in=(
         Bundle.STATUS_PROCESSING,
         Bundle.STATUS_DRAFT,
@@ -253,31 +625,34 @@ def process_webhook(pk):
     """Process an easyDITA webhook."""
     webhook = Webhook.objects.get(pk=pk)
     logger = get_logger(webhook)
-    logger.info('Processing %s', webhook)
-    data = json.loads(webhook.body)
-    if (
-        data['event_id'] == 'dita-ot-publish-complete'
-        and data['event_data']['publish-result'] == 'success'
-    ):
-        bundle, created = Bundle.objects.get_or_create(
-            easydita_id=data['event_data']['output-uuid'],
-            defaults={'easydita_resource_id': data['resource_id']},
-        )
-        webhook.bundle = bundle
-        if created or bundle.is_complete():
-            logger.info('Webhook accepted')
-            webhook.status = Webhook.STATUS_ACCEPTED
-            webhook.save()
-            bundle.queue()
-            process_queue.delay()
+    try:
+        logger.info('Processing %s', webhook)
+        data = json.loads(webhook.body)
+        if (
+            data['event_id'] == 'dita-ot-publish-complete'
+            and data['event_data']['publish-result'] == 'success'
+        ):
+            bundle, created = Bundle.objects.get_or_create(
+                easydita_id=data['event_data']['output-uuid'],
+                defaults={'easydita_resource_id': data['resource_id']},
+            )
+            webhook.bundle = bundle
+            if created or bundle.is_complete():
+                logger.info('Webhook accepted')
+                webhook.status = Webhook.STATUS_ACCEPTED
+                webhook.save()
+                bundle.queue()
+                process_queue.delay()
+            else:
+                logger.info('Webhook rejected (already processing)')
+                webhook.status = Webhook.STATUS_REJECTED
         else:
-            logger.info('Webhook rejected (already processing)')
+            logger.info('Webhook rejected (not dita-ot success)')
             webhook.status = Webhook.STATUS_REJECTED
-    else:
-        logger.info('Webhook rejected (not dita-ot success)')
-        webhook.status = Webhook.STATUS_REJECTED
-    webhook.save()
-    logger.info('Processed %s', webhook)
+        webhook.save()
+        logger.info('Processed %s', webhook)
+    finally:
+        close_logger(logger)
 
 
 @job('default', timeout=600)
@@ -287,15 +662,39 @@ def publish_drafts(bundle_pk):
     bundle.status = Bundle.STATUS_PUBLISHING
     bundle.save()
     logger = get_logger(bundle)
-    logger.info('Publishing drafts for %s', bundle)
     try:
-        _publish_drafts(bundle)
-    except Exception as e:
-        bundle.set_error(e)
+        logger.info('Publishing drafts for %s', bundle)
+        try:
+            _publish_drafts(bundle)
+        except Exception as e:
+            bundle.set_error(e)
+            process_queue.delay()
+            raise
+        bundle.status = Bundle.STATUS_PUBLISHED
+        bundle.time_published = now()
+        bundle.save()
+        # only the manifest and image references of the bundle published
+        # last are kept for a resource, including none of rejected or
+        # failed bundles
+        ManifestEntry.objects.filter(
+            bundle__easydita_resource_id=bundle.easydita_resource_id,
+        ).exclude(bundle=bundle).delete()
+        ImageReference.objects.filter(
+            bundle__easydita_resource_id=bundle.easydita_resource_id,
+        ).exclude(bundle=bundle).delete()
+        logger.info('Published all drafts for %s', bundle)
         process_queue.delay()
-        raise
-    bundle.status = Bundle.STATUS_PUBLISHED
-    bundle.time_published = now()
-    bundle.save()
-    logger.info('Published all drafts for %s', bundle)
-    process_queue.delay()
+    finally:
+        close_logger(logger)
+
+
+@job('default', timeout=600)
+def reconcile_catalog():
+    """Replace the knowledge catalog mirror with the catalog in the org."""
+    Salesforce().reconcile_catalog()
+
+
+@job('default', timeout=600)
+def reconcile_inventory():
+    """Replace the bucket inventory with a listing of the bucket."""
+    S3().reconcile_inventory()
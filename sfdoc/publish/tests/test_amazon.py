@@ -1,7 +1,30 @@
+from datetime import datetime
+import os
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import botocore
+import botocore.endpoint
+from botocore.stub import ANY
+from botocore.stub import Stubber
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from django.utils.timezone import utc
 import responses
 from test_plus.test import TestCase
 
+from ..amazon import DELETE_BATCH_SIZE
+from ..amazon import is_retry_error
 from ..amazon import S3
+from ..exceptions import CancelledError
+from ..models import BucketObject
+from ..models import Bundle
+from ..models import Image
+from ..utils import get_md5
 
 
 class TestS3(TestCase):
@@ -9,3 +32,348 @@ class TestS3(TestCase):
     @responses.activate
     def test_init(self):
         s3 = S3()
+
+    def test_cancel(self):
+        s3 = S3()
+        s3.cancel()
+        with mock.patch.object(
+            botocore.endpoint.Endpoint,
+            'make_request',
+        ) as make_request:
+            with self.assertRaises(CancelledError):
+                s3.api.meta.client.head_object(
+                    Bucket=settings.AWS_S3_BUCKET,
+                    Key='test.png',
+                )
+        make_request.assert_not_called()
+
+
+class TestProcessImages(TestCase):
+
+    def setUp(self):
+        self.bundle = Bundle.objects.create(
+            easydita_id='0123456789',
+            easydita_resource_id='9876543210',
+        )
+        self.tempdir = TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, 'test.png')
+        with open(self.filename, 'wb') as f:
+            f.write(b'image data')
+        self.md5 = get_md5(self.filename)
+        self.s3 = S3()
+        self.stubber = Stubber(self.s3.api.meta.client)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def get_objects(self, etag):
+        return {'test.png': {'Key': 'test.png', 'ETag': '"{}"'.format(etag)}}
+
+    def expect_upload(self):
+        self.stubber.add_response('put_object', {}, {
+            'ACL': 'public-read',
+            'Body': ANY,
+            'Bucket': settings.AWS_S3_BUCKET,
+            'Key': settings.AWS_S3_DRAFT_DIR + 'test.png',
+            'Metadata': {'md5': self.md5},
+        })
+
+    def process_images(self, production_objects):
+        with self.stubber:
+            results = list(self.s3.process_images(
+                [self.filename],
+                self.bundle,
+                production_objects,
+            ))
+        self.stubber.assert_no_pending_responses()
+        return results
+
+    def test_unchanged(self):
+        results = self.process_images(self.get_objects(self.md5))
+        self.assertEqual(results, [(self.filename, None)])
+        self.assertEqual(self.bundle.images.count(), 0)
+
+    def test_changed(self):
+        self.expect_upload()
+        results = self.process_images(self.get_objects('0' * 32))
+        self.assertEqual(results, [(self.filename, Image.STATUS_CHANGED)])
+        image = self.bundle.images.get()
+        self.assertEqual(image.status, Image.STATUS_CHANGED)
+
+    def test_new(self):
+        self.expect_upload()
+        results = self.process_images({})
+        self.assertEqual(results, [(self.filename, Image.STATUS_NEW)])
+        image = self.bundle.images.get()
+        self.assertEqual(image.status, Image.STATUS_NEW)
+
+    def test_multipart_metadata(self):
+        self.stubber.add_response(
+            'head_object',
+            {'Metadata': {'md5': self.md5}},
+            {'Bucket': settings.AWS_S3_BUCKET, 'Key': 'test.png'},
+        )
+        results = self.process_images(self.get_objects('0' * 32 + '-2'))
+        self.assertEqual(results, [(self.filename, None)])
+        self.assertEqual(self.bundle.images.count(), 0)
+
+
+class TestDeleteImages(TestCase):
+
+    def setUp(self):
+        self.s3 = S3()
+        self.stubber = Stubber(self.s3.api.meta.client)
+
+    def test_errors(self):
+        self.stubber.add_response('delete_objects', {
+            'Errors': [{
+                'Key': 'b.png',
+                'Code': 'AccessDenied',
+                'Message': 'Access Denied',
+            }],
+        }, {
+            'Bucket': settings.AWS_S3_BUCKET,
+            'Delete': {
+                'Objects': [{'Key': 'a.png'}, {'Key': 'b.png'}],
+                'Quiet': True,
+            },
+        })
+        with self.stubber:
+            results = list(self.s3.delete_images(['a.png', 'b.png']))
+        self.assertEqual(results, [
+            ('a.png', None),
+            ('b.png', 'AccessDenied: Access Denied'),
+        ])
+
+    def test_batches(self):
+        keys = ['{}.png'.format(n) for n in range(DELETE_BATCH_SIZE + 1)]
+        self.stubber.add_response('delete_objects', {})
+        self.stubber.add_response('delete_objects', {})
+        with self.stubber:
+            results = list(self.s3.delete_images(keys))
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(sorted(results), sorted((key, None) for key in keys))
+
+    @mock.patch('sfdoc.publish.concurrency.time.sleep')
+    def test_slow_down(self, sleep):
+        self.stubber.add_client_error(
+            'delete_objects',
+            service_error_code='SlowDown',
+            http_status_code=503,
+        )
+        self.stubber.add_response('delete_objects', {})
+        with self.stubber:
+            results = list(self.s3.delete_images(['a.png']))
+        self.assertEqual(results, [('a.png', None)])
+        sleep.assert_called_once_with(1.0)
+
+
+class TestStageImages(TestCase):
+
+    def setUp(self):
+        self.s3 = S3()
+        self.stubber = Stubber(self.s3.api.meta.client)
+        self.tempdir = TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, 'test.png')
+        with open(self.filename, 'wb') as f:
+            f.write(b'image data')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_copy(self):
+        self.stubber.add_response('copy_object', {}, {
+            'ACL': 'public-read',
+            'Bucket': settings.AWS_S3_BUCKET,
+            'CopySource': {'Bucket': settings.AWS_S3_BUCKET, 'Key': 'test.png'},
+            'Key': settings.AWS_S3_DRAFT_DIR + 'test.png',
+        })
+        with self.stubber:
+            results = list(self.s3.stage_images([self.filename]))
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(results, [(self.filename, True)])
+
+    def test_missing(self):
+        self.stubber.add_client_error(
+            'copy_object',
+            service_error_code='NoSuchKey',
+            http_status_code=404,
+        )
+        self.stubber.add_response('put_object', {}, {
+            'ACL': 'public-read',
+            'Body': ANY,
+            'Bucket': settings.AWS_S3_BUCKET,
+            'Key': settings.AWS_S3_DRAFT_DIR + 'test.png',
+            'Metadata': {'md5': get_md5(self.filename)},
+        })
+        with self.stubber:
+            results = list(self.s3.stage_images([self.filename]))
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(results, [(self.filename, False)])
+
+
+@override_settings(AWS_S3_INVENTORY=True)
+class TestInventory(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.s3 = S3()
+        self.stubber = Stubber(self.s3.api.meta.client)
+
+    def add_listing(self):
+        last_modified = datetime(2018, 1, 1, tzinfo=utc)
+        self.stubber.add_response('list_objects_v2', {
+            'IsTruncated': False,
+            'Contents': [{
+                'Key': 'a.png',
+                'ETag': '"{}"'.format('a' * 32),
+                'LastModified': last_modified,
+                'Size': 10,
+            }, {
+                'Key': 'b.png',
+                'ETag': '"{}-2"'.format('b' * 32),
+                'LastModified': last_modified,
+                'Size': 20,
+            }, {
+                'Key': settings.AWS_S3_DRAFT_DIR + 'a.png',
+                'ETag': '"{}"'.format('c' * 32),
+                'LastModified': last_modified,
+                'Size': 10,
+            }],
+        }, {'Bucket': settings.AWS_S3_BUCKET})
+
+    def test_get_production_objects(self):
+        BucketObject.objects.create(
+            etag='"{}-2"'.format('b' * 32),
+            key='b.png',
+            last_modified=now(),
+            md5='d' * 32,
+            size=20,
+        )
+        self.add_listing()
+        with self.stubber:
+            objects = self.s3.get_production_objects()
+            # listed once per reconcile interval
+            self.assertEqual(self.s3.get_production_objects(), objects)
+        self.assertEqual(sorted(objects), ['a.png', 'b.png'])
+        self.assertEqual(objects['a.png']['Metadata'], {'md5': 'a' * 32})
+        # known checksums of multipart uploads are kept
+        self.assertEqual(objects['b.png']['Metadata'], {'md5': 'd' * 32})
+        self.assertEqual(BucketObject.objects.count(), 3)
+
+    def test_writes(self):
+        bundle = Bundle.objects.create(
+            easydita_id='0123456789',
+            easydita_resource_id='9876543210',
+        )
+        self.add_listing()
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'c.png')
+            with open(filename, 'wb') as f:
+                f.write(b'image data')
+            md5 = get_md5(filename)
+            self.stubber.add_response('put_object', {})
+            self.stubber.add_response('copy_object', {})
+            self.stubber.add_response('delete_objects', {})
+            with self.stubber:
+                self.s3.check_inventory()
+                list(self.s3.process_images([filename], bundle, {}))
+                list(self.s3.copy_images_to_production(['c.png']))
+                list(self.s3.delete_images(['a.png']))
+        obj = BucketObject.objects.get(key='c.png')
+        self.assertEqual(obj.md5, md5)
+        self.assertEqual(obj.size, 10)
+        self.assertFalse(BucketObject.objects.filter(key='a.png').exists())
+
+    def test_bulk_writes(self):
+        def count_queries(n):
+            objects = [BucketObject(
+                etag='"{}"'.format('a' * 32),
+                key='{}.png'.format(i),
+                last_modified=now(),
+                md5='a' * 32,
+                size=10,
+            ) for i in range(n)]
+            with CaptureQueriesContext(connection) as queries:
+                self.s3._save_inventory(objects)
+                self.s3._copy_inventory([
+                    ('{}.png'.format(i), 'copy-{}.png'.format(i))
+                    for i in range(n)
+                ])
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(10))
+        self.assertEqual(BucketObject.objects.count(), 20)
+
+    def test_delete_draft_images(self):
+        self.add_listing()
+        self.stubber.add_response('delete_objects', {}, {
+            'Bucket': settings.AWS_S3_BUCKET,
+            'Delete': {
+                'Objects': [{'Key': settings.AWS_S3_DRAFT_DIR + 'a.png'}],
+                'Quiet': True,
+            },
+        })
+        with self.stubber:
+            results = list(self.s3.delete_draft_images())
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(results, [(settings.AWS_S3_DRAFT_DIR + 'a.png', None)])
+        self.assertEqual(
+            sorted(BucketObject.objects.values_list('key', flat=True)),
+            ['a.png', 'b.png'],
+        )
+
+    def test_delete_draft_images_error(self):
+        self.add_listing()
+        key = settings.AWS_S3_DRAFT_DIR + 'a.png'
+        self.stubber.add_response('delete_objects', {
+            'Errors': [{
+                'Key': key,
+                'Code': 'AccessDenied',
+                'Message': 'Access Denied',
+            }],
+        }, {
+            'Bucket': settings.AWS_S3_BUCKET,
+            'Delete': {'Objects': [{'Key': key}], 'Quiet': True},
+        })
+        with self.stubber:
+            results = list(self.s3.delete_draft_images())
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(results, [(key, 'AccessDenied: Access Denied')])
+        self.assertEqual(
+            sorted(BucketObject.objects.values_list('key', flat=True)),
+            ['a.png', 'b.png', key],
+        )
+
+
+class TestIsRetryError(TestCase):
+
+    def test_slow_down(self):
+        e = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'SlowDown', 'Message': ''}},
+            'PutObject',
+        )
+        self.assertTrue(is_retry_error(e))
+
+    def test_service_unavailable(self):
+        e = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'ServiceUnavailable', 'Message': ''}},
+            'PutObject',
+        )
+        self.assertTrue(is_retry_error(e))
+        e = botocore.exceptions.ClientError(
+            {
+                'Error': {'Code': 'InternalError', 'Message': ''},
+                'ResponseMetadata': {'HTTPStatusCode': 503},
+            },
+            'CopyObject',
+        )
+        self.assertTrue(is_retry_error(e))
+
+    def test_other(self):
+        e = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'AccessDenied', 'Message': ''}},
+            'PutObject',
+        )
+        self.assertFalse(is_retry_error(e))
+        self.assertFalse(is_retry_error(ValueError()))
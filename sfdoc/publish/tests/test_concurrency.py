@@ -0,0 +1,159 @@
+import threading
+import time
+
+from test_plus.test import TestCase
+
+from ..concurrency import AdaptiveLimit
+from ..concurrency import run_concurrently
+from ..concurrency import run_in_background
+
+
+class RetryError(Exception):
+    pass
+
+
+class TestAdaptiveLimit(TestCase):
+
+    def test_initial(self):
+        self.assertEqual(AdaptiveLimit(8).limit, 4)
+        self.assertEqual(AdaptiveLimit(1).limit, 1)
+
+    def test_increase(self):
+        limit = AdaptiveLimit(8, initial=2)
+        limit.success(1.0)
+        limit.success(1.0)
+        self.assertEqual(limit.limit, 3)
+
+    def test_decrease_slow(self):
+        limit = AdaptiveLimit(8, initial=4)
+        limit.success(1.0)
+        limit.success(10.0)
+        self.assertEqual(limit.limit, 3)
+
+    def test_zero_latency(self):
+        limit = AdaptiveLimit(8, initial=2)
+        limit.success(0.0)
+        limit.success(0.001)
+        self.assertEqual(limit.limit, 3)
+        limit.success(1.0)
+        self.assertEqual(limit.limit, 2)
+
+    def test_throttle(self):
+        limit = AdaptiveLimit(8, initial=8)
+        limit.throttle()
+        self.assertEqual(limit.limit, 4)
+        for _ in range(5):
+            limit.throttle()
+        self.assertEqual(limit.limit, 1)
+
+
+class TestRunConcurrently(TestCase):
+
+    def test_results(self):
+        results = dict(run_concurrently(
+            lambda x: x * 2,
+            range(20),
+            AdaptiveLimit(4),
+        ))
+        self.assertEqual(results, {x: x * 2 for x in range(20)})
+
+    def test_retry(self):
+        calls = []
+
+        def func(x):
+            calls.append(x)
+            if calls.count(x) == 1 and x % 2:
+                raise RetryError
+            return x
+
+        limit = AdaptiveLimit(4)
+        results = dict(run_concurrently(
+            func,
+            range(6),
+            limit,
+            is_throttled=lambda e: isinstance(e, RetryError),
+            backoff=0,
+        ))
+        self.assertEqual(results, {x: x for x in range(6)})
+        self.assertEqual(len(calls), 9)
+
+    def test_retry_backoff(self):
+        calls = []
+
+        def func(x):
+            calls.append(x)
+            if x == 0 and calls.count(x) == 1:
+                raise RetryError
+            time.sleep(0.05)
+            return x
+
+        start = time.monotonic()
+        yielded = {}
+        for x, result in run_concurrently(
+            func,
+            range(8),
+            AdaptiveLimit(4, initial=4),
+            is_throttled=lambda e: isinstance(e, RetryError),
+            backoff=1.0,
+        ):
+            yielded[x] = time.monotonic() - start
+        self.assertEqual(set(yielded), set(range(8)))
+        # the other calls are not held up by the backoff delay
+        for x in range(1, 8):
+            self.assertLess(yielded[x], 0.9)
+        self.assertGreaterEqual(yielded[0], 1.0)
+
+    def test_error(self):
+        def func(x):
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            list(run_concurrently(
+                func,
+                range(3),
+                AdaptiveLimit(2),
+                is_throttled=lambda e: isinstance(e, RetryError),
+            ))
+
+    def test_error_in_flight(self):
+        started = threading.Barrier(3)
+
+        def func(x):
+            started.wait(5)
+            if x == 0:
+                raise ValueError
+            time.sleep(0.05)
+            return x
+
+        yielded = []
+        with self.assertRaises(ValueError):
+            for x, result in run_concurrently(
+                func,
+                range(6),
+                AdaptiveLimit(3, initial=3),
+            ):
+                yielded.append(x)
+        # the calls in flight are finished, and no more are started
+        self.assertEqual(sorted(yielded), [1, 2])
+
+
+class TestRunInBackground(TestCase):
+
+    def test_result(self):
+        event = threading.Event()
+
+        def func(x):
+            event.wait(5)
+            return x * 2
+
+        future = run_in_background(func, 2)
+        self.assertFalse(future.done())
+        event.set()
+        self.assertEqual(future.result(), 4)
+
+    def test_error(self):
+        def func():
+            raise RetryError()
+
+        with self.assertRaises(RetryError):
+            run_in_background(func).result()
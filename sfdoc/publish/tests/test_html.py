@@ -1,4 +1,7 @@
+import pickle
+
 from test_plus.test import TestCase
+from django.conf import settings
 from django.test import override_settings
 
 from ..html import HTML
@@ -88,3 +91,90 @@ class TestHTML(TestCase):
         html.update_links_draft('https://powerofus.force.com')
 
         self.assertIn('https://powerofus.force.com', html.body)
+
+    def test_get_image_paths(self):
+        html = HTML(self.html_s)
+        self.assertEqual(html.get_image_paths(), {'../images/test-image.png'})
+
+    def test_body_updated_after_draft_links(self):
+        html = HTML(self.html_s)
+        self.assertIn('../images/test-image.png', html.body)
+        html.update_links_draft()
+        self.assertIn(
+            'https://{}.s3.amazonaws.com/{}test-image.png'.format(
+                settings.AWS_S3_BUCKET,
+                settings.AWS_S3_DRAFT_DIR,
+            ),
+            html.body,
+        )
+
+    def test_get_body_production(self):
+        html = HTML(self.html_s)
+        html.update_links_draft()
+        body_draft = html.body
+        self.assertEqual(
+            html.get_body_production(),
+            HTML.update_links_production(body_draft),
+        )
+        # the draft body is unchanged
+        self.assertEqual(html.body, body_draft)
+        self.assertIn(settings.AWS_S3_DRAFT_DIR, html.body)
+
+    def test_get_checksum(self):
+        html = HTML(self.html_s)
+        self.assertEqual(html.get_checksum(), HTML(self.html_s).get_checksum())
+        html_changed = HTML(utils.create_test_html(
+            self.article['url_name'],
+            'Changed',
+            self.article['summary'],
+            self.article['body'],
+        ))
+        self.assertNotEqual(html.get_checksum(), html_changed.get_checksum())
+
+    def test_pickle(self):
+        html = HTML(self.html_s)
+        html.scrub()
+        checksum = html.get_checksum()
+        html = pickle.loads(pickle.dumps(html))
+        self.assertEqual(html.url_name, self.article['url_name'])
+        self.assertEqual(html.body, self.article['body'])
+        self.assertEqual(html.get_checksum(), checksum)
+        # the body is parsed again to update the links
+        html.update_links_draft()
+        self.assertIn(settings.AWS_S3_DRAFT_DIR, html.body)
+        self.assertEqual(html.get_checksum(), checksum)
+
+    def test_release_tree(self):
+        html = HTML(self.html_s)
+        html.update_links_draft()
+        body_production = html.get_body_production()
+        html.release_tree()
+        self.assertIsNone(html._body_tag)
+        self.assertIn(settings.AWS_S3_DRAFT_DIR, html.body)
+        self.assertEqual(html.get_body_production(), body_production)
+        self.assertIsNone(html._body_tag)
+        # the body is parsed again when the tree is needed
+        self.assertEqual(
+            html.get_image_paths(),
+            {'https://{}.s3.amazonaws.com/{}test-image.png'.format(
+                settings.AWS_S3_BUCKET,
+                settings.AWS_S3_DRAFT_DIR,
+            )},
+        )
+
+    def test_get_checksum_before_draft_links(self):
+        checksum = HTML(self.html_s).get_checksum()
+        html = HTML(self.html_s)
+        html.update_links_draft()
+        self.assertEqual(html.get_checksum(), checksum)
+
+    @override_settings(SALESFORCE_ARTICLE_CHECKSUM_FIELD='Checksum__c')
+    def test_same_as_record_checksum(self):
+        html = HTML(self.html_s)
+        data = html.create_article_data()
+        self.assertEqual(data['Checksum__c'], html.get_checksum())
+        # the body is not compared when there is a checksum
+        data[settings.SALESFORCE_ARTICLE_BODY_FIELD] = 'Changed'
+        self.assertTrue(html.same_as_record(data))
+        data['Checksum__c'] = '0' * 32
+        self.assertFalse(html.same_as_record(data))
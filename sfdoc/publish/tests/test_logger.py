@@ -0,0 +1,122 @@
+import logging
+from unittest import mock
+
+from django.test import override_settings
+from test_plus.test import TestCase
+
+from ..logger import close_logger
+from ..logger import get_logger
+from ..logger import LogHandler
+from ..models import Bundle
+
+
+@override_settings(LOG_BUFFER_SIZE=3, LOG_FLUSH_INTERVAL=60)
+class TestLogger(TestCase):
+
+    def setUp(self):
+        self.bundles = [
+            Bundle.objects.create(
+                easydita_id=str(n),
+                easydita_resource_id='9876543210',
+            ) for n in range(2)
+        ]
+
+    def tearDown(self):
+        for bundle in self.bundles:
+            close_logger(get_logger(bundle))
+
+    def get_messages(self, bundle):
+        return list(bundle.logs.order_by('time', 'pk').values_list(
+            'message',
+            flat=True,
+        ))
+
+    def test_bound_to_object(self):
+        for bundle in self.bundles:
+            logger = get_logger(bundle)
+            logger.info('Processing %s', bundle)
+            close_logger(logger)
+        for bundle in self.bundles:
+            self.assertEqual(
+                self.get_messages(bundle),
+                ['[INFO] Processing {}'.format(bundle)],
+            )
+
+    def test_buffer(self):
+        logger = get_logger(self.bundles[0])
+        logger.info('one')
+        logger.info('two')
+        self.assertEqual(self.get_messages(self.bundles[0]), [])
+        with self.assertNumQueries(1):
+            logger.info('three')
+        self.assertEqual(
+            self.get_messages(self.bundles[0]),
+            ['[INFO] one', '[INFO] two', '[INFO] three'],
+        )
+
+    def test_flush_interval(self):
+        logger = get_logger(self.bundles[0])
+        with override_settings(LOG_FLUSH_INTERVAL=0):
+            logger.info('one')
+        self.assertEqual(self.get_messages(self.bundles[0]), ['[INFO] one'])
+
+    def test_error(self):
+        logger = get_logger(self.bundles[0])
+        logger.info('one')
+        logger.error('two')
+        self.assertEqual(
+            self.get_messages(self.bundles[0]),
+            ['[INFO] one', '[ERROR] two'],
+        )
+
+    def test_close(self):
+        logger = get_logger(self.bundles[0])
+        logger.info('one')
+        handler = self.get_handler(logger)
+        close_logger(logger)
+        self.assertNotIn(handler, logger.logger.handlers)
+        self.assertIsNone(handler.timer)
+        self.assertEqual(self.get_messages(self.bundles[0]), ['[INFO] one'])
+
+    def get_handler(self, logger):
+        handlers = [
+            handler for handler in logger.logger.handlers
+            if isinstance(handler, LogHandler) and
+            handler.model == self.bundles[0]
+        ]
+        self.assertEqual(len(handlers), 1)
+        return handlers[0]
+
+    def test_shared_logger(self):
+        loggers = [get_logger(bundle) for bundle in self.bundles]
+        self.assertIs(loggers[0].logger, loggers[1].logger)
+        self.assertFalse(any(
+            name.startswith('sfdoc_')
+            for name in logging.Logger.manager.loggerDict
+        ))
+        for logger in loggers:
+            close_logger(logger)
+        self.assertFalse(any(
+            isinstance(handler, LogHandler)
+            for handler in loggers[0].logger.handlers
+        ))
+
+    def test_flush_timer(self):
+        logger = get_logger(self.bundles[0])
+        with mock.patch('sfdoc.publish.logger.threading.Timer') as timer:
+            logger.info('one')
+            logger.info('two')
+        # one timer is started for the buffer
+        timer.assert_called_once_with(
+            60,
+            self.get_handler(logger).flush_on_timer,
+        )
+        timer.return_value.start.assert_called_once_with()
+        self.assertEqual(self.get_messages(self.bundles[0]), [])
+        with mock.patch('sfdoc.publish.logger.connection') as connection:
+            self.get_handler(logger).flush_on_timer()
+        connection.close.assert_called_once_with()
+        self.assertEqual(
+            self.get_messages(self.bundles[0]),
+            ['[INFO] one', '[INFO] two'],
+        )
@@ -1,14 +1,17 @@
+from datetime import timedelta
 import os
 from tempfile import TemporaryDirectory
 
 from bs4 import BeautifulSoup
 from django.conf import settings
+from django.utils.timezone import now
 import responses
 from test_plus.test import TestCase
 
 from ..models import Article
 from ..models import Bundle
 from ..models import Image
+from ..models import ManifestEntry
 from ..models import Webhook
 
 from . import utils
@@ -50,6 +53,68 @@ class TestBundle(TestCase):
         )
         self.articles = [utils.gen_article(n) for n in range(1, 3)]
 
+    def create_bundle(self, easydita_id, **kwargs):
+        return Bundle.objects.create(
+            easydita_id=easydita_id,
+            easydita_resource_id='9876543210',
+            **kwargs
+        )
+
+    def test_get_last_published(self):
+        self.create_bundle(
+            '1',
+            status=Bundle.STATUS_PUBLISHED,
+            time_published=now() - timedelta(days=1),
+        )
+        last = self.create_bundle(
+            '2',
+            status=Bundle.STATUS_PUBLISHED,
+            time_published=now(),
+        )
+        self.create_bundle('3', status=Bundle.STATUS_REJECTED)
+        bundle = self.create_bundle('4')
+        self.assertEqual(bundle.get_last_published(), last)
+        self.assertEqual(last.get_last_published().easydita_id, '1')
+
+    def test_get_manifest(self):
+        bundle = self.create_bundle('1')
+        bundle.manifest.create(
+            type=ManifestEntry.TYPE_ARTICLE,
+            name='article',
+            checksum='a' * 32,
+        )
+        bundle.manifest.create(
+            type=ManifestEntry.TYPE_IMAGE,
+            name='image.png',
+            checksum='b' * 32,
+        )
+        self.assertEqual(
+            bundle.get_manifest(ManifestEntry.TYPE_ARTICLE),
+            {'article': 'a' * 32},
+        )
+        bundle.queue()
+        self.assertFalse(bundle.manifest.exists())
+
+    def test_queue(self):
+        bundle = self.create_bundle('1', status=Bundle.STATUS_ERROR)
+        for n in range(20):
+            Article.objects.create(
+                bundle=bundle,
+                ka_id='ka_{}'.format(n),
+                kav_id='kav_{}'.format(n),
+                url_name='article-{}'.format(n),
+            )
+            Image.objects.create(
+                bundle=bundle,
+                filename='image-{}.png'.format(n),
+            )
+        # rows are deleted with one query per table
+        with self.assertNumQueriesLessThan(15):
+            bundle.queue()
+        self.assertEqual(bundle.status, Bundle.STATUS_QUEUED)
+        self.assertFalse(bundle.articles.exists())
+        self.assertFalse(bundle.images.exists())
+
 
 class TestImage(TestCase):
 
@@ -72,6 +137,12 @@ class TestImage(TestCase):
             'Image {}: {}'.format(self.image.pk, self.image.filename),
         )
 
+    def test_queue_deletes_image_references(self):
+        bundle = self.image.bundle
+        bundle.image_references.create(image='test.png', url_name='a')
+        bundle.queue()
+        self.assertFalse(bundle.image_references.exists())
+
 
 class TestWebhook(TestCase):
 
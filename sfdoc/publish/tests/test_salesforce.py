@@ -1,11 +1,29 @@
+from http import HTTPStatus
+import json
+from unittest import mock
+from urllib.parse import parse_qs
 from urllib.parse import urljoin
+from urllib.parse import urlparse
 
 from django.conf import settings
+from django.core.cache import cache
 from django.test import override_settings
 import responses
+from simple_salesforce.exceptions import SalesforceGeneralError
+from simple_salesforce.exceptions import SalesforceMalformedRequest
 from test_plus.test import TestCase
 
+from ..exceptions import CancelledError
+from ..exceptions import SalesforceError
+from ..html import HTML
+from ..models import Article
+from ..models import Bundle
+from ..models import CatalogArticle
 from ..salesforce import Salesforce
+from ..salesforce import is_request_retry_error
+from ..salesforce import is_retry_error
+
+from . import utils
 
 
 def get_salesforce_instance(instance_url, sandbox):
@@ -18,6 +36,8 @@ def get_salesforce_instance(instance_url, sandbox):
         'access_token': 'abc123',
     }
     responses.add('POST', url=url, json=json)
+    # don't reuse sessions cached by other tests
+    cache.clear()
     return Salesforce()
 
 
@@ -43,6 +63,54 @@ class TestSalesforce(TestCase):
         )
         self.assertEqual(len(responses.calls), 1)
 
+    @responses.activate
+    def test_init_cached_session(self):
+        """Sessions are shared between instances."""
+        salesforce = get_salesforce_instance(
+            'https://testinstance.salesforce.com',
+            False,
+        )
+        salesforce2 = Salesforce()
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(salesforce2.api.session_id, salesforce.api.session_id)
+
+    @responses.activate
+    def test_invalid_session(self):
+        """Expired sessions are renewed and the call is retried."""
+        instance_url = 'https://testinstance.salesforce.com'
+        salesforce = get_salesforce_instance(instance_url, False)
+        responses.reset()
+        url = urljoin(settings.SALESFORCE_LOGIN_URL, 'services/oauth2/token')
+        responses.add('POST', url=url, json={
+            'instance_url': instance_url,
+            'access_token': 'def456',
+        })
+        authorizations = []
+
+        def query(request):
+            authorizations.append(request.headers['Authorization'])
+            if request.headers['Authorization'] == 'Bearer abc123':
+                return (HTTPStatus.UNAUTHORIZED, {}, json.dumps([{
+                    'errorCode': 'INVALID_SESSION_ID',
+                    'message': 'Session expired or invalid',
+                }]))
+            body = {'done': True, 'totalSize': 0, 'records': []}
+            return (HTTPStatus.OK, {}, json.dumps(body))
+
+        responses.add_callback(
+            'GET',
+            url='{}/services/data/v{}/query/'.format(
+                instance_url,
+                settings.SALESFORCE_API_VERSION,
+            ),
+            callback=query,
+        )
+        salesforce.api.query('SELECT Id FROM Knowledge__kav')
+        self.assertEqual(authorizations, ['Bearer abc123', 'Bearer def456'])
+        self.assertEqual(salesforce.api.session_id, 'def456')
+        # the new session is shared
+        self.assertEqual(Salesforce().api.session_id, 'def456')
+
     @responses.activate
     @override_settings(SALESFORCE_SANDBOX=True)
     def test_get_community_loc_sandbox(self):
@@ -86,3 +154,869 @@ class TestSalesforce(TestCase):
                 settings.SALESFORCE_COMMUNITY
             ),
         )
+
+    @responses.activate
+    @override_settings(SALESFORCE_QUERY_BATCH_SIZE=200)
+    def test_query_iter(self):
+        instance_url = 'https://testinstance.salesforce.com'
+        salesforce = get_salesforce_instance(instance_url, False)
+        base_path = '/services/data/v{}/query/'.format(
+            settings.SALESFORCE_API_VERSION,
+        )
+        responses.add(
+            'GET',
+            url=instance_url + base_path,
+            json={
+                'done': False,
+                'totalSize': 2,
+                'nextRecordsUrl': base_path + '01g-200',
+                'records': [{'Id': 'kav_1'}],
+            },
+        )
+        responses.add(
+            'GET',
+            url=instance_url + base_path + '01g-200',
+            json={'done': True, 'totalSize': 2, 'records': [{'Id': 'kav_2'}]},
+        )
+        records = salesforce.query_iter('SELECT Id FROM Knowledge__kav')
+        self.assertEqual(next(records)['Id'], 'kav_1')
+        # another thread renews the session between pages
+        salesforce.api.headers['Authorization'] = 'Bearer renewed'
+        self.assertEqual([r['Id'] for r in records], ['kav_2'])
+        for call in responses.calls[-2:]:
+            self.assertEqual(
+                call.request.headers['Sforce-Query-Options'],
+                'batchSize=200',
+            )
+        self.assertEqual(
+            responses.calls[-1].request.headers['Authorization'],
+            'Bearer renewed',
+        )
+
+    @responses.activate
+    def test_cancel(self):
+        salesforce = get_salesforce_instance(
+            'https://testinstance.salesforce.com',
+            False,
+        )
+        salesforce.cancel()
+        with self.assertRaises(CancelledError):
+            list(salesforce.query_iter('SELECT Id FROM Knowledge__kav'))
+        self.assertEqual(len(responses.calls), 1)
+
+
+class TestUploadArticle(TestCase):
+
+    def setUp(self):
+        self.instance_url = 'https://testinstance.salesforce.com'
+        article = utils.gen_article(1)
+        self.html = HTML(utils.create_test_html(
+            article['url_name'],
+            article['title'],
+            article['summary'],
+            article['body'],
+        ))
+
+    def get_online_record(self, **kwargs):
+        record = {
+            'Id': 'kav_online',
+            'KnowledgeArticleId': 'ka_1',
+            'UrlName': self.html.url_name.upper(),
+            'Title': self.html.title,
+            'Summary': self.html.summary,
+            'IsVisibleInCsp': True,
+            'IsVisibleInPkb': True,
+            'IsVisibleInPrm': True,
+            settings.SALESFORCE_ARTICLE_BODY_FIELD: self.html.body,
+            settings.SALESFORCE_ARTICLE_AUTHOR_FIELD: self.html.author,
+            settings.SALESFORCE_ARTICLE_AUTHOR_OVERRIDE_FIELD: (
+                self.html.author_override
+            ),
+        }
+        record.update(kwargs)
+        return record
+
+    @responses.activate
+    def test_load_catalog(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        utils.mock_catalog(
+            self.instance_url,
+            [{'Id': 'kav_draft', 'KnowledgeArticleId': 'ka_1', 'UrlName': 'A'}],
+            [self.get_online_record()],
+        )
+        catalog = salesforce.get_catalog()
+        self.assertEqual(catalog.get_draft('a')['Id'], 'kav_draft')
+        self.assertEqual(
+            catalog.get_online(self.html.url_name)['Id'],
+            'kav_online',
+        )
+        # loaded once, without bodies
+        salesforce.get_catalog()
+        self.assertEqual(len(responses.calls), 3)
+        for call in responses.calls[-2:]:
+            query_s = parse_qs(urlparse(call.request.url).query)
+            self.assertNotIn(
+                settings.SALESFORCE_ARTICLE_BODY_FIELD,
+                query_s['q'][0],
+            )
+
+    @responses.activate
+    @override_settings(SALESFORCE_ARTICLE_CHECKSUM_FIELD='Checksum__c')
+    def test_load_catalog_checksum(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        utils.mock_catalog(self.instance_url, [], [
+            self.get_online_record(Checksum__c=self.html.get_checksum()),
+        ])
+        catalog = salesforce.get_catalog()
+        query_s = parse_qs(urlparse(responses.calls[-1].request.url).query)
+        self.assertNotIn(settings.SALESFORCE_ARTICLE_BODY_FIELD, query_s['q'][0])
+        self.assertEqual(len(responses.calls), 3)
+        self.assertTrue(
+            self.html.same_as_record(catalog.get_online(self.html.url_name)),
+        )
+
+    @responses.activate
+    @override_settings(SALESFORCE_ARTICLE_CHECKSUM_FIELD='Checksum__c')
+    def test_load_bodies(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        body_field = settings.SALESFORCE_ARTICLE_BODY_FIELD
+        online = [
+            self.get_online_record(Checksum__c=None),
+            self.get_online_record(
+                Id='kav_other',
+                UrlName='other',
+                Checksum__c=None,
+            ),
+            self.get_online_record(
+                Id='kav_checksum',
+                UrlName='checksum',
+                Checksum__c='abc',
+            ),
+        ]
+        queries = []
+
+        def callback(request):
+            query_s = parse_qs(urlparse(request.url).query)['q'][0]
+            queries.append(query_s)
+            if 'Id IN' in query_s:
+                records = [
+                    {'Id': record['Id'], body_field: record[body_field]}
+                    for record in online if record['Id'] in query_s
+                ]
+            elif "PublishStatus='online'" in query_s:
+                records = [
+                    {k: v for k, v in record.items() if k != body_field}
+                    for record in online
+                ]
+            else:
+                records = []
+            body = {'done': True, 'totalSize': len(records), 'records': records}
+            return (HTTPStatus.OK, {}, json.dumps(body))
+
+        responses.add_callback(
+            'GET',
+            url='{}/services/data/v{}/query/'.format(
+                self.instance_url,
+                settings.SALESFORCE_API_VERSION,
+            ),
+            callback=callback,
+            content_type='application/json',
+        )
+        catalog = salesforce.get_catalog()
+        self.assertEqual(len(queries), 2)
+        # bodies are only loaded for the given articles without checksum
+        salesforce.load_bodies([self.html.url_name, 'checksum', 'missing'])
+        self.assertEqual(len(queries), 3)
+        self.assertIn("Id IN ('kav_online')", queries[-1])
+        record = catalog.get_online(self.html.url_name)
+        self.assertTrue(self.html.same_as_record(record))
+        self.assertNotIn(body_field, catalog.get_online('other'))
+        self.assertNotIn(body_field, catalog.get_online('checksum'))
+        # loaded once
+        salesforce.load_bodies([self.html.url_name])
+        self.assertEqual(len(queries), 3)
+        catalog.drop_bodies([self.html.url_name])
+        self.assertNotIn(body_field, record)
+
+    @responses.activate
+    def test_unchanged(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        utils.mock_catalog(self.instance_url, [], [self.get_online_record()])
+        self.assertIsNone(salesforce.upload_article(self.html))
+
+    @responses.activate
+    def test_changed(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        utils.mock_catalog(
+            self.instance_url,
+            [],
+            [self.get_online_record(Title='Old Title')],
+        )
+        utils.mock_create_draft(self.instance_url, 'ka_1', 'kav_draft')
+        utils.mock_update_draft(self.instance_url, 'kav_draft')
+        self.assertEqual(
+            salesforce.upload_article(self.html),
+            ('kav_draft', 'ka_1', Article.STATUS_CHANGED, False),
+        )
+        self.assertEqual(
+            salesforce.get_catalog().get_draft(self.html.url_name)['Id'],
+            'kav_draft',
+        )
+
+    @responses.activate
+    @mock.patch('sfdoc.publish.concurrency.time.sleep')
+    def test_retry_update_after_create_draft(self, sleep):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        bundle = Bundle.objects.create(
+            easydita_id='0123456789',
+            easydita_resource_id='9876543210',
+        )
+        utils.mock_catalog(
+            self.instance_url,
+            [],
+            [self.get_online_record(Title='Old Title')],
+        )
+        utils.mock_create_draft(self.instance_url, 'ka_1', 'kav_draft')
+        updates = []
+
+        def update(request):
+            updates.append(request)
+            if len(updates) == 1:
+                return (HTTPStatus.BAD_REQUEST, {}, json.dumps([{
+                    'errorCode': 'UNABLE_TO_LOCK_ROW',
+                    'message': 'unable to obtain exclusive access',
+                }]))
+            return (HTTPStatus.NO_CONTENT, {}, '')
+
+        responses.add_callback(
+            'PATCH',
+            url='{}/services/data/v{}/sobjects/{}/kav_draft'.format(
+                self.instance_url,
+                settings.SALESFORCE_API_VERSION,
+                settings.SALESFORCE_ARTICLE_TYPE,
+            ),
+            callback=update,
+        )
+        results = list(salesforce.process_articles([self.html], bundle))
+        article = results[0][1]
+        self.assertEqual(article.kav_id, 'kav_draft')
+        self.assertEqual(article.status, Article.STATUS_CHANGED)
+        self.assertFalse(article.draft_unchanged)
+        # the draft is created once, and updated again on the retry
+        self.assertEqual(len([
+            call for call in responses.calls
+            if call.request.url.endswith('masterVersions')
+        ]), 1)
+        self.assertEqual(len(updates), 2)
+
+    @responses.activate
+    @mock.patch('sfdoc.publish.concurrency.time.sleep')
+    def test_retry_after_create_article(self, sleep):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        bundle = Bundle.objects.create(
+            easydita_id='0123456789',
+            easydita_resource_id='9876543210',
+        )
+        lookups = []
+
+        def query(request):
+            query_s = parse_qs(urlparse(request.url).query)['q'][0]
+            records = []
+            if "Id='kav_new'" in query_s:
+                lookups.append(query_s)
+                if len(lookups) == 1:
+                    return (HTTPStatus.FORBIDDEN, {}, json.dumps([{
+                        'errorCode': 'REQUEST_LIMIT_EXCEEDED',
+                        'message': 'limit exceeded',
+                    }]))
+                records = [{'Id': 'kav_new', 'KnowledgeArticleId': 'ka_new'}]
+            body = {'done': True, 'totalSize': len(records), 'records': records}
+            return (HTTPStatus.OK, {}, json.dumps(body))
+
+        responses.add_callback(
+            'GET',
+            url='{}/services/data/v{}/query/'.format(
+                self.instance_url,
+                settings.SALESFORCE_API_VERSION,
+            ),
+            callback=query,
+            content_type='application/json',
+        )
+        utils.mock_create_article(self.instance_url, 'kav_new')
+        utils.mock_update_draft(self.instance_url, 'kav_new')
+        results = list(salesforce.process_articles([self.html], bundle))
+        article = results[0][1]
+        self.assertEqual(article.kav_id, 'kav_new')
+        self.assertEqual(article.ka_id, 'ka_new')
+        self.assertEqual(article.status, Article.STATUS_NEW)
+        # the article is created once
+        self.assertEqual(len([
+            call for call in responses.calls
+            if call.request.method == 'POST' and
+            call.request.url.endswith('/{}/'.format(
+                settings.SALESFORCE_ARTICLE_TYPE,
+            ))
+        ]), 1)
+        self.assertEqual(len(lookups), 2)
+
+    @responses.activate
+    def test_draft_unchanged(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        utils.mock_catalog(
+            self.instance_url,
+            [self.get_online_record(Id='kav_draft')],
+            [self.get_online_record(Title='Old Title')],
+        )
+        # no draft update
+        self.assertEqual(
+            salesforce.upload_article(self.html),
+            ('kav_draft', 'ka_1', Article.STATUS_CHANGED, True),
+        )
+
+    @responses.activate
+    def test_draft_and_online_unchanged(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        utils.mock_catalog(
+            self.instance_url,
+            [self.get_online_record(Id='kav_draft')],
+            [self.get_online_record()],
+        )
+        self.assertIsNone(salesforce.upload_article(self.html))
+
+    @responses.activate
+    def test_draft_changed(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        utils.mock_catalog(
+            self.instance_url,
+            [self.get_online_record(Id='kav_draft', Title='Old Title')],
+            [self.get_online_record(Title='Old Title')],
+        )
+        utils.mock_update_draft(self.instance_url, 'kav_draft')
+        self.assertEqual(
+            salesforce.upload_article(self.html),
+            ('kav_draft', 'ka_1', Article.STATUS_CHANGED, False),
+        )
+
+
+class TestProcessArticleBatch(TestCase):
+
+    def setUp(self):
+        self.instance_url = 'https://testinstance.salesforce.com'
+        self.bundle = Bundle.objects.create(
+            easydita_id='0123456789',
+            easydita_resource_id='9876543210',
+        )
+        self.htmls = []
+        for n in range(1, 5):
+            article = utils.gen_article(n)
+            self.htmls.append(HTML(utils.create_test_html(
+                article['url_name'],
+                article['title'],
+                article['summary'],
+                article['body'],
+            )))
+
+    def get_online_record(self, html, kav_id, ka_id, title):
+        html.update_links_draft()
+        return {
+            'Id': kav_id,
+            'KnowledgeArticleId': ka_id,
+            'UrlName': html.url_name,
+            'Title': title,
+            'Summary': html.summary,
+            'IsVisibleInCsp': True,
+            'IsVisibleInPkb': True,
+            'IsVisibleInPrm': True,
+            settings.SALESFORCE_ARTICLE_BODY_FIELD: html.get_body_production(),
+            settings.SALESFORCE_ARTICLE_AUTHOR_FIELD: html.author,
+            settings.SALESFORCE_ARTICLE_AUTHOR_OVERRIDE_FIELD: (
+                html.author_override
+            ),
+        }
+
+    def mock_requests(self):
+        html1, html2, html3, html4 = self.htmls
+        drafts = [
+            self.get_online_record(html3, 'kav_3', 'ka_3', 'Old Title'),
+        ]
+        online = [
+            self.get_online_record(html1, 'kav_1', 'ka_1', html1.title),
+            self.get_online_record(html2, 'kav_2o', 'ka_2', 'Old Title'),
+        ]
+        base_url = '{}/services/data/v{}/'.format(
+            self.instance_url,
+            settings.SALESFORCE_API_VERSION,
+        )
+
+        def query(request):
+            query_s = parse_qs(urlparse(request.url).query)['q'][0]
+            if 'Id IN' in query_s:
+                records = [{'Id': 'kav_4', 'KnowledgeArticleId': 'ka_4'}]
+            elif "PublishStatus='draft'" in query_s:
+                records = drafts
+            else:
+                records = online
+            body = {'done': True, 'totalSize': len(records), 'records': records}
+            return (HTTPStatus.OK, {}, json.dumps(body))
+
+        def update(request):
+            results = []
+            for record in json.loads(request.body)['records']:
+                if record['id'] == 'kav_3':
+                    results.append({'success': False, 'errors': [{
+                        'statusCode': 'INVALID_FIELD',
+                        'message': 'bad field',
+                    }]})
+                else:
+                    results.append({
+                        'id': record['id'],
+                        'success': True,
+                        'errors': [],
+                    })
+            return (HTTPStatus.OK, {}, json.dumps(results))
+
+        responses.add_callback('GET', url=base_url + 'query/', callback=query)
+        responses.add(
+            'POST',
+            url=base_url + 'composite/sobjects',
+            json=[{'id': 'kav_4', 'success': True, 'errors': []}],
+        )
+        responses.add_callback(
+            'PATCH',
+            url=base_url + 'composite/sobjects',
+            callback=update,
+        )
+        utils.mock_create_draft(self.instance_url, 'ka_2', 'kav_2')
+
+    @responses.activate
+    @override_settings(SALESFORCE_API_VERSION='42.0')
+    def test_process_articles(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        self.mock_requests()
+        processed = []
+        with self.assertRaisesRegex(SalesforceError, 'INVALID_FIELD'):
+            for html, article in salesforce.process_articles(
+                self.htmls,
+                self.bundle,
+            ):
+                processed.append((html.url_name, article))
+        html1, html2, html3, html4 = self.htmls
+        self.assertEqual([p[0] for p in processed], [
+            html1.url_name,
+            html2.url_name,
+            html4.url_name,
+        ])
+        self.assertIsNone(processed[0][1])
+        self.assertEqual(processed[1][1].kav_id, 'kav_2')
+        self.assertEqual(processed[1][1].ka_id, 'ka_2')
+        self.assertEqual(processed[1][1].status, Article.STATUS_CHANGED)
+        self.assertEqual(processed[2][1].kav_id, 'kav_4')
+        self.assertEqual(processed[2][1].ka_id, 'ka_4')
+        self.assertEqual(processed[2][1].status, Article.STATUS_NEW)
+        self.assertEqual(self.bundle.articles.count(), 2)
+
+
+@override_settings(SALESFORCE_API_VERSION='44.0')
+class TestPublishBatch(TestCase):
+
+    def setUp(self):
+        self.instance_url = 'https://testinstance.salesforce.com'
+        self.base_url = '{}/services/data/v{}/'.format(
+            self.instance_url,
+            '44.0',
+        )
+        self.body = '<img src="https://{}.s3.amazonaws.com/{}a.png"/>'.format(
+            settings.AWS_S3_BUCKET,
+            settings.AWS_S3_DRAFT_DIR,
+        )
+
+    def mock_action(self, action, failed, **params):
+        def callback(request):
+            results = []
+            for item in json.loads(request.body)['inputs']:
+                kav_id = item['articleVersionIdList'][0]
+                self.assertEqual(
+                    item,
+                    dict(params, articleVersionIdList=[kav_id]),
+                )
+                if kav_id in failed:
+                    results.append({'isSuccess': False, 'errors': [{
+                        'statusCode': 'INVALID_STATUS',
+                        'message': 'cannot {}'.format(action),
+                    }]})
+                else:
+                    results.append({'isSuccess': True, 'errors': None})
+            return (HTTPStatus.OK, {}, json.dumps(results))
+
+        responses.add_callback(
+            'POST',
+            url=self.base_url + 'actions/standard/' + action,
+            callback=callback,
+        )
+
+    @responses.activate
+    def test_publish_drafts(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        records = [{
+            'Id': kav_id,
+            settings.SALESFORCE_ARTICLE_BODY_FIELD: self.body,
+        } for kav_id in ('kav_1', 'kav_2')]
+        responses.add('GET', url=self.base_url + 'query/', json={
+            'done': True,
+            'totalSize': len(records),
+            'records': records,
+        })
+        responses.add(
+            'PATCH',
+            url=self.base_url + 'composite/sobjects',
+            json=[
+                {'id': 'kav_1', 'success': True, 'errors': []},
+                {'id': 'kav_2', 'success': True, 'errors': []},
+            ],
+        )
+        self.mock_action(
+            'publishKnowledgeArticles',
+            ['kav_2'],
+            pubActionType='PUBLISH_ARTICLE',
+        )
+        results = dict(salesforce.publish_drafts(['kav_1', 'kav_2', 'kav_3']))
+        self.assertIsNone(results['kav_1'])
+        self.assertIn('INVALID_STATUS', results['kav_2'])
+        self.assertIn('not found', results['kav_3'])
+        # links updated to production
+        data = json.loads(responses.calls[2].request.body)
+        self.assertNotIn(
+            settings.AWS_S3_DRAFT_DIR,
+            data['records'][0][settings.SALESFORCE_ARTICLE_BODY_FIELD],
+        )
+        self.assertEqual(
+            data['records'][0][settings.SALESFORCE_ARTICLE_TEXT_INDEX_FIELD],
+            data['records'][0][settings.SALESFORCE_ARTICLE_BODY_FIELD],
+        )
+        # only drafts found are published
+        data = json.loads(responses.calls[3].request.body)
+        self.assertEqual(len(data['inputs']), 2)
+
+    @responses.activate
+    def test_archive_articles(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        responses.add('GET', url=self.base_url + 'query/', json={
+            'done': True,
+            'totalSize': 1,
+            'records': [{'Id': 'kav_1d', 'KnowledgeArticleId': 'ka_1'}],
+        })
+        responses.add(
+            'DELETE',
+            url=(
+                self.base_url +
+                'knowledgeManagement/articleVersions/masterVersions/kav_1d'
+            ),
+            status=HTTPStatus.NO_CONTENT,
+        )
+        self.mock_action('archiveKnowledgeArticles', [])
+        results = dict(salesforce.archive_articles([
+            ('ka_1', 'kav_1'),
+            ('ka_2', 'kav_2'),
+        ]))
+        self.assertEqual(results, {'kav_1': None, 'kav_2': None})
+        self.assertEqual(len(responses.calls), 4)
+
+    @responses.activate
+    @override_settings(SALESFORCE_CATALOG_MIRROR=True)
+    def test_archive_articles_mirror(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        CatalogArticle.objects.create(
+            ka_id='ka_1',
+            kav_id='kav_1d',
+            publish_status='draft',
+            system_modstamp='2018-01-01T00:00:00Z',
+            title='A',
+            url_name='a',
+        )
+
+        def query(request):
+            query_s = parse_qs(urlparse(request.url).query)['q'][0]
+            records = []
+            if "SELECT COUNT() " in query_s and "'draft'" in query_s:
+                records = [{'Id': 'kav_1d', 'KnowledgeArticleId': 'ka_1'}]
+            body = {'done': True, 'totalSize': len(records), 'records': records}
+            return (HTTPStatus.OK, {}, json.dumps(body))
+
+        responses.add_callback(
+            'GET',
+            url=self.base_url + 'query/',
+            callback=query,
+            content_type='application/json',
+        )
+        responses.add(
+            'DELETE',
+            url=(
+                self.base_url +
+                'knowledgeManagement/articleVersions/masterVersions/kav_1d'
+            ),
+            status=HTTPStatus.NO_CONTENT,
+        )
+        self.mock_action('archiveKnowledgeArticles', [])
+        results = dict(salesforce.archive_articles([
+            ('ka_1', 'kav_1'),
+            ('ka_2', 'kav_2'),
+        ]))
+        self.assertEqual(results, {'kav_1': None, 'kav_2': None})
+        # drafts to delete are found in the mirror, not with a query by ID
+        self.assertFalse(any(
+            'KnowledgeArticleId IN' in call.request.url
+            for call in responses.calls
+        ))
+        self.assertEqual(responses.calls[-2].request.method, 'DELETE')
+
+
+@override_settings(SALESFORCE_API_VERSION='42.0')
+class TestSaveRecords(TestCase):
+
+    def setUp(self):
+        self.instance_url = 'https://testinstance.salesforce.com'
+        self.url = '{}/services/data/v42.0/composite/sobjects'.format(
+            self.instance_url,
+        )
+
+    @responses.activate
+    @mock.patch('sfdoc.publish.concurrency.time.sleep')
+    def test_request_retry(self, sleep):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        failures = [
+            (HTTPStatus.FORBIDDEN, [{
+                'errorCode': 'REQUEST_LIMIT_EXCEEDED',
+                'message': 'limit exceeded',
+            }]),
+            (HTTPStatus.SERVICE_UNAVAILABLE, 'unavailable'),
+        ]
+
+        def callback(request):
+            if failures:
+                status, body = failures.pop(0)
+                return (status, {}, json.dumps(body))
+            results = [
+                {'id': 'kav_{}'.format(n), 'success': True, 'errors': []}
+                for n, record in enumerate(json.loads(request.body)['records'])
+            ]
+            return (HTTPStatus.OK, {}, json.dumps(results))
+
+        responses.add_callback('PATCH', url=self.url, callback=callback)
+        results = salesforce.save_records('PATCH', [{'Id': 'kav_0'}])
+        self.assertEqual(results[0]['id'], 'kav_0')
+        self.assertEqual(len(responses.calls), 4)
+        self.assertEqual(sleep.call_count, 2)
+
+    @responses.activate
+    @mock.patch('sfdoc.publish.concurrency.time.sleep')
+    def test_create_server_error(self, sleep):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        responses.add(
+            'POST',
+            url=self.url,
+            status=HTTPStatus.SERVICE_UNAVAILABLE,
+            body='unavailable',
+        )
+        with self.assertRaises(SalesforceGeneralError):
+            salesforce.save_records('POST', [{'Title': 'A'}])
+        self.assertEqual(len(responses.calls), 2)
+        sleep.assert_not_called()
+
+    @responses.activate
+    def test_request_error(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        responses.add(
+            'POST',
+            url=self.url,
+            status=HTTPStatus.BAD_REQUEST,
+            json=[{'errorCode': 'INVALID_FIELD', 'message': 'bad field'}],
+        )
+        with self.assertRaises(SalesforceMalformedRequest):
+            salesforce.save_records('POST', [{'Title': 'A'}])
+        self.assertEqual(len(responses.calls), 2)
+
+
+@override_settings(
+    SALESFORCE_CATALOG_MIRROR=True,
+    SALESFORCE_ARTICLE_CHECKSUM_FIELD='Checksum__c',
+)
+class TestCatalogMirror(TestCase):
+
+    def setUp(self):
+        self.instance_url = 'https://testinstance.salesforce.com'
+        self.records = {'draft': [], 'online': []}
+        self.queries = []
+
+    def get_record(self, kav_id, url_name, modstamp, checksum='abc'):
+        return {
+            'Id': kav_id,
+            'KnowledgeArticleId': 'ka_' + url_name,
+            'Title': url_name.title(),
+            'UrlName': url_name,
+            'LastPublishedDate': None,
+            'SystemModstamp': modstamp,
+            'Checksum__c': checksum,
+            'Summary': None,
+            'IsVisibleInCsp': True,
+            'IsVisibleInPkb': True,
+            'IsVisibleInPrm': True,
+            settings.SALESFORCE_ARTICLE_BODY_FIELD: None,
+            settings.SALESFORCE_ARTICLE_AUTHOR_FIELD: None,
+            settings.SALESFORCE_ARTICLE_AUTHOR_OVERRIDE_FIELD: None,
+        }
+
+    def mock_queries(self):
+        def callback(request):
+            query_s = parse_qs(urlparse(request.url).query)['q'][0]
+            self.queries.append(query_s)
+            publish_status = query_s.split("PublishStatus='")[1].split("'")[0]
+            records = self.records[publish_status]
+            if query_s.startswith('SELECT COUNT() '):
+                body = {'done': True, 'totalSize': len(records), 'records': []}
+                return (HTTPStatus.OK, {}, json.dumps(body))
+            if 'Id IN (' in query_s:
+                kav_ids = query_s.split('Id IN (')[1].split(')')[0]
+                records = [
+                    record for record in records
+                    if "'{}'".format(record['Id']) in kav_ids
+                ]
+            if 'SystemModstamp>=' in query_s:
+                since = query_s.split('SystemModstamp>=')[1]
+                records = [
+                    record for record in records
+                    if record['SystemModstamp'][:19] >= since[:19]
+                ]
+            body = {'done': True, 'totalSize': len(records), 'records': records}
+            return (HTTPStatus.OK, {}, json.dumps(body))
+
+        responses.add_callback(
+            'GET',
+            url='{}/services/data/v{}/query/'.format(
+                self.instance_url,
+                settings.SALESFORCE_API_VERSION,
+            ),
+            callback=callback,
+            content_type='application/json',
+        )
+
+    @responses.activate
+    def test_reconcile(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        self.mock_queries()
+        self.records['draft'].append(
+            self.get_record('kav_1d', 'a', '2018-01-02T00:00:00.000+0000'),
+        )
+        self.records['online'].append(
+            self.get_record('kav_1', 'a', '2018-01-01T00:00:00.000+0000'),
+        )
+        CatalogArticle.objects.create(
+            ka_id='ka_x',
+            kav_id='kav_x',
+            publish_status='online',
+            system_modstamp='2018-01-01T00:00:00Z',
+            title='X',
+            url_name='x',
+        )
+        salesforce.reconcile_catalog()
+        self.assertEqual(
+            sorted(CatalogArticle.objects.values_list('kav_id', flat=True)),
+            ['kav_1', 'kav_1d'],
+        )
+        self.assertEqual(len(self.queries), 2)
+        self.assertNotIn('SystemModstamp>=', self.queries[0])
+        article = CatalogArticle.objects.get(kav_id='kav_1')
+        self.assertEqual(article.checksum, 'abc')
+        self.assertEqual(article.summary, '')
+        self.assertTrue(article.is_visible_in_pkb)
+
+    @responses.activate
+    def test_sync(self):
+        salesforce = get_salesforce_instance(self.instance_url, False)
+        self.mock_queries()
+        self.records['online'] = [
+            self.get_record('kav_1', 'a', '2018-01-01T00:00:00.000+0000'),
+            self.get_record('kav_2', 'b', '2018-01-01T00:00:00.000+0000'),
+        ]
+        self.records['draft'] = [
+            self.get_record('kav_3d', 'c', '2018-01-01T00:00:00.000+0000'),
+        ]
+        salesforce.sync_catalog()
+        # the empty mirror is reconciled
+        self.assertEqual(len(self.queries), 2)
+        # b is republished, c's draft is deleted and d is created
+        self.records['online'] = [
+            self.get_record('kav_1', 'a', '2018-01-01T00:00:00.000+0000'),
+            self.get_record('kav_2b', 'b', '2018-01-03T00:00:00.000+0000',
+                            checksum='def'),
+        ]
+        self.records['draft'] = [
+            self.get_record('kav_4d', 'd', '2018-01-02T00:00:00.000+0000',
+                            checksum=None),
+        ]
+        self.queries = []
+        catalog = salesforce.load_catalog()
+        self.assertTrue(all(
+            'SystemModstamp>=2018-01-01T00:00:00Z' in query_s
+            for query_s in self.queries[:2]
+        ))
+        # drafts are looked up by ID, since one is missing in the org
+        self.assertEqual(len(self.queries), 5)
+        self.assertIn("Id IN ('kav_3d','kav_4d')", self.queries[3])
+        self.assertTrue(all(
+            query_s.startswith('SELECT COUNT() ') or 'Id' in query_s.split('WHERE')[1]
+            for query_s in self.queries[2:]
+        ))
+        self.assertEqual(
+            sorted(CatalogArticle.objects.values_list('kav_id', flat=True)),
+            ['kav_1', 'kav_2b', 'kav_4d'],
+        )
+        self.assertEqual(set(catalog.drafts), {'d'})
+        self.assertEqual(set(catalog.online), {'a', 'b'})
+        self.assertEqual(catalog.get_online('b')['Checksum__c'], 'def')
+        # the compared fields come from the mirror, bodies are not loaded
+        self.assertEqual(catalog.get_draft('d')['IsVisibleInCsp'], True)
+        self.assertFalse(any(
+            settings.SALESFORCE_ARTICLE_BODY_FIELD in query_s
+            for query_s in self.queries
+        ))
+
+
+class TestIsRetryError(TestCase):
+
+    def get_error(self, error_code):
+        return SalesforceMalformedRequest(
+            'https://testinstance.salesforce.com',
+            400,
+            'Knowledge__kav',
+            [{'errorCode': error_code, 'message': 'error'}],
+        )
+
+    def test_lock_row(self):
+        self.assertTrue(is_retry_error(self.get_error('UNABLE_TO_LOCK_ROW')))
+
+    def test_request_limit(self):
+        self.assertTrue(is_retry_error(
+            self.get_error('REQUEST_LIMIT_EXCEEDED'),
+        ))
+
+    def test_other(self):
+        self.assertFalse(is_retry_error(self.get_error('INVALID_FIELD')))
+
+    def test_unstructured(self):
+        self.assertFalse(is_retry_error(SalesforceError(
+            'Error creating new draft: UNABLE_TO_LOCK_ROW',
+        )))
+
+    def test_server_error(self):
+        e = SalesforceGeneralError(
+            'https://testinstance.salesforce.com',
+            503,
+            'Knowledge__kav',
+            'unavailable',
+        )
+        self.assertFalse(is_retry_error(e))
+        self.assertTrue(is_request_retry_error(e))
+        self.assertTrue(is_request_retry_error(
+            self.get_error('REQUEST_LIMIT_EXCEEDED'),
+        ))
+        self.assertFalse(is_request_retry_error(self.get_error('INVALID_FIELD')))
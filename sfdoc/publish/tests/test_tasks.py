@@ -0,0 +1,401 @@
+from datetime import timedelta
+import hashlib
+import os
+from tempfile import TemporaryDirectory
+import time
+from unittest import mock
+import zipfile
+
+from django.conf import settings
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from test_plus.test import TestCase
+
+from ..amazon import S3
+from ..exceptions import DownloadError
+from ..exceptions import HtmlError
+from ..exceptions import SalesforceError
+from ..logger import close_logger
+from ..logger import get_logger
+from ..models import Article
+from ..models import Bundle
+from ..models import Image
+from ..models import ImageReference
+from ..models import ManifestEntry
+from ..salesforce import KnowledgeCatalog
+from ..salesforce import Salesforce
+from ..tasks import _get_images_used
+from ..tasks import _get_manifest
+from ..tasks import _process_bundle
+from ..tasks import _scrub_html_files
+from ..tasks import publish_drafts
+
+from . import utils
+
+
+class TestScrubHtmlFiles(TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.articles = [utils.gen_article(n) for n in range(1, 6)]
+        self.html_files = []
+        for article in self.articles:
+            html_file = os.path.join(self.tempdir.name, article['filename'])
+            with open(html_file, 'w') as f:
+                f.write(utils.create_test_html(
+                    article['url_name'],
+                    article['title'],
+                    article['summary'],
+                    article['body'],
+                ))
+            self.html_files.append(html_file)
+        self.image = os.path.abspath(os.path.join(
+            self.tempdir.name,
+            '../images/test-image.png',
+        ))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def check_results(self, results):
+        self.assertEqual(len(results), len(self.articles))
+        for article, result in zip(self.articles, results):
+            html, url_name, checksum, image_paths, error = result
+            self.assertIsNone(error)
+            self.assertEqual(url_name, article['url_name'])
+            self.assertEqual(len(checksum), 32)
+            self.assertEqual(image_paths, {self.image})
+            self.assertEqual(html.url_name, url_name)
+            self.assertEqual(html.get_checksum(), checksum)
+            # links are updated before the tree is released
+            self.assertTrue(html.has_draft_links)
+            self.assertIsNone(html._body_tag)
+            self.assertIn(
+                'https://{}.s3.amazonaws.com/{}test-image.png'.format(
+                    settings.AWS_S3_BUCKET,
+                    settings.AWS_S3_DRAFT_DIR,
+                ),
+                html.body,
+            )
+            self.assertNotIn(
+                settings.AWS_S3_DRAFT_DIR,
+                html.get_body_production(),
+            )
+
+    @override_settings(SCRUB_WORKERS=1)
+    def test_scrub_serial(self):
+        results = list(_scrub_html_files(self.html_files))
+        self.check_results(results)
+
+    @override_settings(SCRUB_WORKERS=2)
+    def test_scrub_pool(self):
+        results = list(_scrub_html_files(self.html_files))
+        self.check_results(results)
+
+    @override_settings(SCRUB_WORKERS=2, WHITELIST_HTML={})
+    def test_scrub_pool_error(self):
+        results = list(_scrub_html_files(self.html_files))
+        for html, url_name, checksum, image_paths, error in results:
+            self.assertIsInstance(error, HtmlError)
+
+    @override_settings(SCRUB_WORKERS=2)
+    def test_scrub_pool_sources(self):
+        html_sources = {}
+        for html_file in self.html_files:
+            with open(html_file) as f:
+                html_sources[html_file] = f.read()
+            os.remove(html_file)
+        results = list(_scrub_html_files(self.html_files, html_sources.pop))
+        self.assertEqual(html_sources, {})
+        self.check_results(results)
+
+
+class TestGetImagesUsed(TestCase):
+
+    def create_bundle(self, easydita_id, resource_id, images, **kwargs):
+        bundle = Bundle.objects.create(
+            easydita_id=easydita_id,
+            easydita_resource_id=resource_id,
+            **kwargs
+        )
+        for image in images:
+            bundle.image_references.create(image=image, url_name='article')
+        return bundle
+
+    def test_images_used(self):
+        bundle = self.create_bundle('1', 'resource1', ['A.png', 'a.png'])
+        # other bundles' references are not used, as for article archiving
+        self.create_bundle('2', 'resource1', ['b.png'],
+                           status=Bundle.STATUS_PUBLISHED,
+                           time_published=now())
+        self.create_bundle('3', 'resource2', ['c.png'],
+                           status=Bundle.STATUS_PUBLISHED,
+                           time_published=now())
+        self.assertEqual(_get_images_used(bundle), {'a.png'})
+
+    def test_no_images(self):
+        bundle = self.create_bundle('1', 'resource1', [])
+        self.assertEqual(_get_images_used(bundle), set([]))
+
+
+class TestGetManifest(TestCase):
+
+    def setUp(self):
+        self.time_published = now() - timedelta(days=1)
+        self.last_published = Bundle.objects.create(
+            easydita_id='1',
+            easydita_resource_id='9876543210',
+            status=Bundle.STATUS_PUBLISHED,
+            time_published=self.time_published,
+        )
+        self.last_published.manifest.create(
+            type=ManifestEntry.TYPE_ARTICLE,
+            name='article',
+            checksum='a' * 32,
+        )
+        self.last_published.manifest.create(
+            type=ManifestEntry.TYPE_IMAGE,
+            name='image.png',
+            checksum='b' * 32,
+        )
+        self.bundle = Bundle.objects.create(
+            easydita_id='2',
+            easydita_resource_id='9876543210',
+        )
+        self.production_objects = {
+            'image.png': {'Key': 'image.png', 'ETag': '"{}"'.format('b' * 32)},
+        }
+
+    def get_manifest(self, time_published):
+        salesforce = mock.Mock()
+        salesforce.get_catalog.return_value = KnowledgeCatalog([], [{
+            'Id': 'kav',
+            'KnowledgeArticleId': 'ka',
+            'UrlName': 'Article',
+            'LastPublishedDate': time_published.strftime(
+                '%Y-%m-%dT%H:%M:%S.000+0000',
+            ),
+        }])
+        return _get_manifest(
+            self.bundle,
+            salesforce,
+            self.production_objects,
+            mock.Mock(),
+        )
+
+    def test_manifest(self):
+        articles, images = self.get_manifest(
+            self.time_published - timedelta(minutes=1),
+        )
+        self.assertEqual(articles, {'article': 'a' * 32})
+        self.assertEqual(images, {'image.png': 'b' * 32})
+
+    def test_article_drift(self):
+        articles, images = self.get_manifest(
+            self.time_published + timedelta(minutes=1),
+        )
+        self.assertEqual(articles, {})
+        self.assertEqual(images, {})
+
+    def test_image_drift(self):
+        self.production_objects['image.png']['ETag'] = '"{}"'.format('c' * 32)
+        articles, images = self.get_manifest(
+            self.time_published - timedelta(minutes=1),
+        )
+        self.assertEqual(articles, {})
+        self.assertEqual(images, {})
+
+    def test_no_published_bundle(self):
+        self.last_published.delete()
+        self.assertEqual(self.get_manifest(now()), ({}, {}))
+
+
+@override_settings(
+    LOG_BUFFER_SIZE=1000,
+    LOG_FLUSH_INTERVAL=60,
+    SCRUB_WORKERS=1,
+)
+class TestProcessBundleQueries(TestCase):
+    """
+    The number of queries made to process a bundle does not grow with the
+    number of articles, images or image links.
+    """
+
+    def create_bundle_zip(self, path, n):
+        """
+        Create a bundle of n articles that all use the same n images.
+        Every other image is unchanged in production.
+        """
+        zip_file = os.path.join(path, 'source.zip')
+        production = []
+        with zipfile.ZipFile(zip_file, 'w') as z:
+            body = 'Test article content\n'
+            for k in range(n):
+                data = 'image data {}'.format(k).encode()
+                z.writestr('images/image{}.png'.format(k), data)
+                body += '<img src="../images/image{}.png"/>\n'.format(k)
+                if k % 2:
+                    production.append({
+                        'Key': 'image{}.png'.format(k),
+                        'ETag': '"{}"'.format(hashlib.md5(data).hexdigest()),
+                    })
+            for m in range(n):
+                article = utils.gen_article(m)
+                z.writestr('html/' + article['filename'], utils.create_test_html(
+                    article['url_name'],
+                    article['title'],
+                    article['summary'],
+                    body,
+                ))
+        production.append({'Key': 'orphan.png', 'ETag': '"{}"'.format('0' * 32)})
+        return zip_file, production
+
+    def count_queries(self, n):
+        bundle = Bundle.objects.create(
+            easydita_id=str(n),
+            easydita_resource_id='9876543210',
+        )
+        api = mock.Mock()
+        api.base_url = 'https://testinstance.salesforce.com/services/data/v41.0/'
+        catalog = KnowledgeCatalog([], [{
+            'Id': 'kav_old',
+            'KnowledgeArticleId': 'ka_old',
+            'Title': 'Old',
+            'UrlName': 'old-article',
+        }])
+
+        def upload_article(salesforce, html):
+            return (
+                'kav_' + html.url_name,
+                'ka_' + html.url_name,
+                Article.STATUS_NEW,
+                False,
+            )
+
+        with TemporaryDirectory() as tempdir:
+            zip_file, production = self.create_bundle_zip(tempdir, n)
+
+            def download(url, filename, auth=None):
+                os.rename(zip_file, filename)
+                return os.path.getsize(filename)
+
+            with mock.patch('sfdoc.publish.tasks.download', download), \
+                    mock.patch.object(Salesforce, '_get_salesforce_api',
+                                      return_value=api), \
+                    mock.patch.object(Salesforce, 'load_catalog',
+                                      return_value=catalog), \
+                    mock.patch.object(Salesforce, 'upload_article',
+                                      autospec=True,
+                                      side_effect=upload_article), \
+                    mock.patch.object(S3, 'iter_objects',
+                                      return_value=production), \
+                    mock.patch.object(S3, 'upload_image'), \
+                    mock.patch.object(S3, 'copy_to_draft') as copy_to_draft:
+                with CaptureQueriesContext(connection) as queries:
+                    _process_bundle(bundle, tempdir)
+                    close_logger(get_logger(bundle))
+        # all articles are new, the deleted article is archived
+        self.assertEqual(
+            bundle.articles.filter(status=Article.STATUS_NEW).count(),
+            n,
+        )
+        self.assertEqual(
+            bundle.articles.filter(status=Article.STATUS_DELETED).count(),
+            1,
+        )
+        # changed images are uploaded, unchanged images are staged
+        self.assertEqual(
+            bundle.images.filter(status=Image.STATUS_NEW).count(),
+            (n + 1) // 2,
+        )
+        self.assertEqual(copy_to_draft.call_count, n // 2)
+        self.assertEqual(
+            bundle.images.get(status=Image.STATUS_DELETED).filename,
+            'orphan.png',
+        )
+        return len(queries)
+
+    def test_query_count(self):
+        counts = {n: self.count_queries(n) for n in (2, 4, 8)}
+        # n articles use n images each; the first run also loads the
+        # content type of Log messages
+        self.assertEqual(counts[8], counts[4])
+        self.assertLessEqual(counts[4], counts[2])
+
+
+class TestPublishDrafts(TestCase):
+
+    def create_bundle(self, easydita_id, resource_id, status):
+        bundle = Bundle.objects.create(
+            easydita_id=easydita_id,
+            easydita_resource_id=resource_id,
+            status=status,
+        )
+        bundle.manifest.create(
+            type=ManifestEntry.TYPE_IMAGE,
+            name='a.png',
+            checksum='abc',
+        )
+        bundle.image_references.create(image='a.png', url_name='article')
+        return bundle
+
+    def test_cleanup(self):
+        bundle = self.create_bundle('1', 'resource1', Bundle.STATUS_DRAFT)
+        for easydita_id, status in (
+            ('2', Bundle.STATUS_PUBLISHED),
+            ('3', Bundle.STATUS_REJECTED),
+            ('4', Bundle.STATUS_ERROR),
+        ):
+            self.create_bundle(easydita_id, 'resource1', status)
+        other = self.create_bundle('5', 'resource2', Bundle.STATUS_PUBLISHED)
+        with mock.patch('sfdoc.publish.tasks._publish_drafts'), \
+                mock.patch('sfdoc.publish.tasks.process_queue'):
+            publish_drafts(bundle.pk)
+        # the rows of the resource's other bundles are deleted
+        for model in (ManifestEntry, ImageReference):
+            self.assertEqual(
+                set(model.objects.values_list('bundle', flat=True)),
+                {bundle.pk, other.pk},
+            )
+
+
+@override_settings(LOG_BUFFER_SIZE=1000, LOG_FLUSH_INTERVAL=60)
+class TestProcessBundleBackground(TestCase):
+
+    def test_error(self):
+        bundle = Bundle.objects.create(
+            easydita_id='0123456789',
+            easydita_resource_id='9876543210',
+        )
+        api = mock.Mock()
+        listed = []
+
+        def iter_objects(s3):
+            # the bucket is listed until the bundle fails
+            while not s3.cancelled:
+                time.sleep(0.01)
+            s3.api.meta.client.list_objects_v2(Bucket='bucket')
+            listed.append(True)
+
+        with TemporaryDirectory() as tempdir, \
+                mock.patch('sfdoc.publish.tasks.download',
+                           side_effect=DownloadError('download failed')), \
+                mock.patch.object(Salesforce, '_get_salesforce_api',
+                                  return_value=api), \
+                mock.patch.object(Salesforce, 'load_catalog',
+                                  side_effect=SalesforceError('query failed')), \
+                mock.patch.object(S3, 'iter_objects', autospec=True,
+                                  side_effect=iter_objects):
+            with self.assertRaisesRegex(DownloadError, 'download failed'):
+                _process_bundle(bundle, tempdir)
+            close_logger(get_logger(bundle))
+        # the listing was stopped, and the catalog error is logged
+        self.assertEqual(listed, [])
+        messages = list(bundle.logs.values_list('message', flat=True))
+        self.assertIn(
+            '[ERROR] Error loading in the background: query failed',
+            messages,
+        )
+        self.assertFalse(any('cancelled' in m for m in messages))
@@ -1,7 +1,23 @@
+import base64
+import hashlib
+from io import BytesIO
+import os
+from tempfile import TemporaryDirectory
+from unittest import mock
+from zipfile import ZipFile
+
 from django.test import override_settings
+import requests
+import responses
 from test_plus.test import TestCase
 
+from ..exceptions import DownloadError
+from ..exceptions import UnzipError
+from ..utils import download
+from ..utils import DOWNLOAD_CHUNK_SIZE
 from ..utils import is_url_whitelisted
+from ..utils import unzip
+from ..utils import ZipIndex
 
 
 class TestIsUrlWhitelisted(TestCase):
@@ -13,3 +29,273 @@ class TestIsUrlWhitelisted(TestCase):
     @override_settings(WHITELIST_URL=['*.example.com/*'])
     def test_url_whitelist_wildcard(self):
         self.assertTrue(is_url_whitelisted('http://www.example.com/a'))
+
+
+class TestDownload(TestCase):
+
+    url = 'https://example.com/bundle.zip'
+    data = b'0123456789' * 10
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, 'bundle.zip')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def get_content_md5(self, data):
+        return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+    @responses.activate
+    def test_download(self):
+        responses.add(
+            responses.GET,
+            self.url,
+            body=self.data,
+            headers={'Content-MD5': self.get_content_md5(self.data)},
+        )
+        size = download(self.url, self.filename)
+        self.assertEqual(size, len(self.data))
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    @responses.activate
+    def test_checksum_mismatch(self):
+        responses.add(
+            responses.GET,
+            self.url,
+            body=self.data,
+            headers={'Content-MD5': self.get_content_md5(b'other')},
+        )
+        with self.assertRaises(DownloadError):
+            download(self.url, self.filename)
+
+    def download_dropping(self, drop_at):
+        """Download, dropping the first full response after drop_at bytes."""
+        def iter_content(response, chunk_size=1):
+            data = b''.join(original_iter_content(response, chunk_size))
+            if (
+                response.status_code == 200 and
+                chunk_size == DOWNLOAD_CHUNK_SIZE and
+                len(responses.calls) == 1
+            ):
+                # drop the connection part way through
+                yield data[:drop_at]
+                raise requests.exceptions.ChunkedEncodingError()
+            yield data
+
+        original_iter_content = requests.Response.iter_content
+
+        with mock.patch.object(
+            requests.Response,
+            'iter_content',
+            autospec=True,
+            side_effect=iter_content,
+        ):
+            return download(self.url, self.filename)
+
+    def read(self):
+        with open(self.filename, 'rb') as f:
+            return f.read()
+
+    @responses.activate
+    def test_resume(self):
+        def callback(request):
+            self.assertEqual(request.headers['Accept-Encoding'], 'identity')
+            if 'Range' not in request.headers:
+                return (200, {'ETag': '"v1"'}, self.data)
+            self.assertEqual(request.headers['Range'], 'bytes=40-')
+            self.assertEqual(request.headers['If-Range'], '"v1"')
+            return (206, {}, self.data[40:])
+
+        responses.add_callback(responses.GET, self.url, callback=callback)
+        size = self.download_dropping(40)
+        self.assertEqual(size, len(self.data))
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(self.read(), self.data)
+
+    @responses.activate
+    def test_resume_changed(self):
+        changed = b'abcdefghij' * 10
+
+        def callback(request):
+            if 'Range' not in request.headers:
+                return (200, {'ETag': '"v1"'}, self.data)
+            # If-Range doesn't match, the whole new file is sent
+            return (200, {'ETag': '"v2"'}, changed)
+
+        responses.add_callback(responses.GET, self.url, callback=callback)
+        size = self.download_dropping(40)
+        self.assertEqual(size, len(changed))
+        self.assertEqual(self.read(), changed)
+
+    @responses.activate
+    def test_resume_no_validator(self):
+        def callback(request):
+            self.assertNotIn('Range', request.headers)
+            return (200, {'ETag': 'W/"v1"'}, self.data)
+
+        responses.add_callback(responses.GET, self.url, callback=callback)
+        size = self.download_dropping(40)
+        self.assertEqual(size, len(self.data))
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(self.read(), self.data)
+
+    @responses.activate
+    def test_resume_complete(self):
+        def callback(request):
+            if 'Range' not in request.headers:
+                return (200, {'Last-Modified': 'Mon, 01 Jan 2018'}, self.data)
+            self.assertEqual(
+                request.headers['If-Range'],
+                'Mon, 01 Jan 2018',
+            )
+            return (416, {'Content-Range': 'bytes */100'}, b'')
+
+        responses.add_callback(responses.GET, self.url, callback=callback)
+        size = self.download_dropping(len(self.data))
+        self.assertEqual(size, len(self.data))
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(self.read(), self.data)
+
+    @responses.activate
+    def test_size_mismatch(self):
+        def callback(request):
+            return (200, {'Content-Length': '1000'}, self.data)
+
+        responses.add_callback(responses.GET, self.url, callback=callback)
+        with self.assertRaises(DownloadError):
+            download(self.url, self.filename)
+
+
+class TestUnzip(TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'bundle')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def make_zip(self, files):
+        data = BytesIO()
+        with ZipFile(data, 'w') as f:
+            for name, content in files.items():
+                f.writestr(name, content)
+        return data.getvalue()
+
+    def read(self, *parts):
+        with open(os.path.join(self.path, *parts), 'rb') as f:
+            return f.read()
+
+    def test_recursive(self):
+        inner = self.make_zip({'b.html': b'inner'})
+        outer = BytesIO(self.make_zip({
+            'a.html': b'outer',
+            'sub/inner.zip': inner,
+        }))
+        unzip(outer, self.path, recursive=True)
+        self.assertEqual(self.read('a.html'), b'outer')
+        self.assertEqual(self.read('sub', 'inner', 'b.html'), b'inner')
+        self.assertFalse(
+            os.path.exists(os.path.join(self.path, 'sub', 'inner.zip'))
+        )
+
+    def test_not_recursive(self):
+        inner = self.make_zip({'b.html': b'inner'})
+        outer = BytesIO(self.make_zip({'inner.zip': inner}))
+        unzip(outer, self.path)
+        self.assertEqual(self.read('inner.zip'), inner)
+
+    def test_path_traversal(self):
+        unzip(BytesIO(self.make_zip({'../../a.html': b'a'})), self.path)
+        self.assertEqual(self.read('a.html'), b'a')
+
+    def test_directories(self):
+        data = self.make_zip({
+            './': b'',
+            '.': b'',
+            '..': b'',
+            'sub\\': b'',
+            'sub/a.html': b'a',
+        })
+        unzip(BytesIO(data), self.path)
+        self.assertEqual(os.listdir(self.path), ['sub'])
+        self.assertEqual(self.read('sub', 'a.html'), b'a')
+
+    @override_settings(UNZIP_MAX_DEPTH=1)
+    def test_max_depth(self):
+        data = self.make_zip({'a.html': b'a'})
+        for n in range(3):
+            data = self.make_zip({'nested.zip': data})
+        with self.assertRaises(UnzipError):
+            unzip(BytesIO(data), self.path, recursive=True)
+
+    @override_settings(UNZIP_MAX_MEMBERS=2)
+    def test_max_members(self):
+        data = self.make_zip({'a.html': b'', 'b.html': b'', 'c.html': b''})
+        with self.assertRaises(UnzipError):
+            unzip(BytesIO(data), self.path)
+
+    @override_settings(UNZIP_MAX_SIZE=10)
+    def test_max_size(self):
+        data = self.make_zip({'a.html': b'0' * 11})
+        with self.assertRaises(UnzipError):
+            unzip(BytesIO(data), self.path)
+
+
+class TestZipIndex(TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'bundle')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def make_zip(self, files):
+        data = BytesIO()
+        with ZipFile(data, 'w') as f:
+            for name, content in files.items():
+                f.writestr(name, content)
+        return data.getvalue()
+
+    def test_index(self):
+        inner = self.make_zip({'b.png': b'image'})
+        outer = BytesIO(self.make_zip({
+            'a.html': b'html',
+            'images/inner.zip': inner,
+            'source.pdf': b'pdf',
+        }))
+        a = os.path.join(self.path, 'a.html')
+        b = os.path.join(self.path, 'images', 'inner', 'b.png')
+        with ZipIndex(outer, self.path, recursive=True) as zip_index:
+            self.assertEqual(list(zip_index), sorted([
+                a,
+                b,
+                os.path.join(self.path, 'source.pdf'),
+            ]))
+            self.assertEqual(zip_index.read(a), b'html')
+            zip_index.extract(b)
+        with open(b, 'rb') as f:
+            self.assertEqual(f.read(), b'image')
+        self.assertEqual(os.listdir(self.path), ['images'])
+
+    def test_directories(self):
+        data = BytesIO(self.make_zip({
+            './': b'',
+            '.': b'',
+            'sub\\': b'',
+            'sub/a.html': b'a',
+        }))
+        with ZipIndex(data, self.path) as zip_index:
+            self.assertEqual(list(zip_index), [
+                os.path.join(self.path, 'sub', 'a.html'),
+            ])
+
+    @override_settings(UNZIP_MAX_SIZE=10)
+    def test_max_size(self):
+        data = BytesIO(self.make_zip({'a.html': b'0' * 11}))
+        with ZipIndex(data, self.path) as zip_index:
+            with self.assertRaises(UnzipError):
+                zip_index.read(os.path.join(self.path, 'a.html'))
@@ -1,9 +1,14 @@
+from datetime import timedelta
 import json
+from unittest import mock
 
 from django.test import RequestFactory
+from django.utils.timezone import now
 from test_plus.test import TestCase
 
 from .. import views
+from ..models import Bundle
+from ..models import Log
 
 
 class BaseViewTestCase(TestCase):
@@ -24,3 +29,72 @@ class TestWebhookView(BaseViewTestCase):
         request.user = self.user
         response = views.webhook(request)
         self.response_200(response)
+
+
+@mock.patch.object(views, 'LOGS_PER_PAGE', 2)
+class TestLogsViews(BaseViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = True
+        self.user.save()
+        self.bundle = Bundle.objects.create(
+            easydita_id='0123456789',
+            easydita_resource_id='9876543210',
+            status=Bundle.STATUS_PROCESSING,
+        )
+        time = now()
+        self.logs = [
+            Log.objects.create(
+                content_object=self.bundle,
+                message='message {}'.format(n),
+                # the first two messages are logged at the same time
+                time=time + timedelta(seconds=max(n, 1)),
+            ) for n in range(5)
+        ]
+
+    def get(self, view, **params):
+        request = self.factory.get('/', data=params)
+        request.user = self.user
+        return view(request, pk=self.bundle.pk)
+
+    def test_logs(self):
+        response = self.get(views.logs)
+        self.assertContains(response, 'message 1')
+        self.assertNotContains(response, 'message 2')
+        self.assertContains(response, '?after={}'.format(
+            self.logs[1].get_cursor(),
+        ))
+        response = self.get(views.logs, after=self.logs[3].get_cursor())
+        self.assertContains(response, 'message 4')
+        self.assertNotContains(response, 'message 3')
+
+    def test_logs_since(self):
+        response = self.get(views.logs_since, after=self.logs[0].get_cursor())
+        data = json.loads(response.content.decode())
+        self.assertEqual(data['messages'][0][-9:], 'message 1')
+        self.assertEqual(data['messages'][1][-9:], 'message 2')
+        self.assertEqual(data['cursor'], self.logs[2].get_cursor())
+        self.assertTrue(data['more'])
+        self.assertTrue(data['running'])
+        response = self.get(views.logs_since, after=self.logs[4].get_cursor())
+        data = json.loads(response.content.decode())
+        self.assertEqual(data['messages'], [])
+        self.assertEqual(data['cursor'], self.logs[4].get_cursor())
+        self.assertFalse(data['more'])
+
+    def test_bundle_tail(self):
+        response = self.get(views.bundle)
+        self.assertContains(response, 'message 4')
+        self.assertContains(response, self.logs[4].get_cursor())
+        self.assertContains(response, 'logs/since/')
+
+    def test_invalid_cursor(self):
+        response = self.get(views.logs_since, after='abc')
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_out_of_range(self):
+        after = '{}-1'.format(10 ** 20)
+        for view in (views.logs, views.logs_since):
+            response = self.get(view, after=after)
+            self.assertEqual(response.status_code, 400)
@@ -1,7 +1,10 @@
 from http import HTTPStatus
 from io import BytesIO
+import json
+from urllib.parse import parse_qs
 from urllib.parse import urlencode
 from urllib.parse import urljoin
+from urllib.parse import urlparse
 from zipfile import ZipFile
 
 from django.conf import settings
@@ -143,6 +146,30 @@ def mock_query(
     )
 
 
+def mock_catalog(instance_url, drafts, online):
+    """Mock the catalog queries for draft and online articles."""
+    url = '{}/services/data/v{}/query/'.format(
+        instance_url,
+        settings.SALESFORCE_API_VERSION,
+    )
+
+    def callback(request):
+        query_s = parse_qs(urlparse(request.url).query)['q'][0]
+        if "PublishStatus='draft'" in query_s:
+            records = drafts
+        else:
+            records = online
+        body = {'done': True, 'totalSize': len(records), 'records': records}
+        return (HTTPStatus.OK, {}, json.dumps(body))
+
+    responses.add_callback(
+        'GET',
+        url=url,
+        callback=callback,
+        content_type='application/json',
+    )
+
+
 def mock_update_draft(instance_url, kav_id):
     url = urljoin(instance_url, 'services/data/v{}/sobjects/{}/{}'.format(
         settings.SALESFORCE_API_VERSION,
@@ -23,6 +23,11 @@ urlpatterns = [
         view=views.logs,
         name='logs',
     ),
+    url(
+        regex=r'^bundles/(?P<pk>\d+)/logs/since/$',
+        view=views.logs_since,
+        name='logs_since',
+    ),
     url(
         regex=r'^bundles/(?P<pk>\d+)/requeue/$',
         view=views.requeue,
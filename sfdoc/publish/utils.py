@@ -1,9 +1,146 @@
+import base64
 import fnmatch
+import hashlib
+from http import HTTPStatus
+from io import BytesIO
 import os
+from tempfile import SpooledTemporaryFile
 from urllib.parse import urlparse
 from zipfile import ZipFile
 
+import django
 from django.conf import settings
+import requests
+
+from .exceptions import DownloadError
+from .exceptions import UnzipError
+
+# size of chunks written to disk while downloading
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# errors after which a download is resumed
+DOWNLOAD_RETRY_ERRORS = (
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+# size of chunks copied while extracting
+UNZIP_CHUNK_SIZE = 1024 * 1024
+
+# nested ZIP files larger than this are spooled to disk
+UNZIP_SPOOL_SIZE = 64 * 1024 * 1024
+
+
+def download(url, filename, auth=None, retries=3, timeout=60):
+    """
+    Stream a URL to a file, resuming with a Range request if the connection
+    drops. A download is only resumed if the file is unchanged (If-Range
+    with its ETag or Last-Modified date); otherwise it starts over. The
+    result is checked against the Content-Length and Content-MD5 headers
+    when the server sends them. Returns the file size in bytes.
+    """
+    size = None
+    content_md5 = None
+    validator = None
+    attempt = 0
+    with open(filename, 'wb') as f:
+        while True:
+            # ask for the file as stored, so byte counts are valid offsets
+            headers = {'Accept-Encoding': 'identity'}
+            if f.tell() and validator:
+                headers['Range'] = 'bytes={}-'.format(f.tell())
+                headers['If-Range'] = validator
+            try:
+                response = requests.get(
+                    url,
+                    auth=auth,
+                    headers=headers,
+                    stream=True,
+                    timeout=timeout,
+                )
+                try:
+                    if (
+                        response.status_code ==
+                        HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE and
+                        'Range' in headers
+                    ):
+                        if _is_downloaded(response, size, f.tell()):
+                            # the connection dropped after the last byte
+                            break
+                        # start over without a Range
+                        validator = None
+                        continue
+                    response.raise_for_status()
+                    if response.status_code != HTTPStatus.PARTIAL_CONTENT:
+                        # full response, (re)start from the beginning
+                        f.seek(0)
+                        f.truncate()
+                        size = None
+                        validator = None
+                        if 'Content-Encoding' not in response.headers:
+                            # only content as stored can be resumed by offset
+                            size = response.headers.get('Content-Length')
+                            validator = _get_validator(response)
+                        content_md5 = response.headers.get('Content-MD5')
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                finally:
+                    response.close()
+            except DOWNLOAD_RETRY_ERRORS:
+                attempt += 1
+                if attempt > retries:
+                    raise
+                continue
+            break
+        downloaded = f.tell()
+    if size is not None and downloaded != int(size):
+        raise DownloadError('Downloaded {} bytes, expected {}: {}'.format(
+            downloaded,
+            size,
+            url,
+        ))
+    if content_md5 is not None:
+        expected = base64.b64decode(content_md5).hex()
+        if get_md5(filename) != expected:
+            raise DownloadError('Checksum mismatch: {}'.format(url))
+    return downloaded
+
+
+def _get_validator(response):
+    """Get the If-Range value for resuming a response, if it has one."""
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        # weak ETags can't be used with If-Range
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def _is_downloaded(response, size, downloaded):
+    """Check if a 416 response says that all bytes are downloaded."""
+    content_range = response.headers.get('Content-Range', '')
+    if content_range.startswith('bytes */'):
+        return content_range[len('bytes */'):] == str(downloaded)
+    return size is not None and int(size) == downloaded
+
+
+def get_md5(filename):
+    """Get the MD5 hex digest of a file."""
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def init_worker_process(values):
+    """
+    Set up Django in a worker process that was not forked from the parent,
+    with the given setting values of the parent.
+    """
+    django.setup()
+    for name, value in values.items():
+        setattr(settings, name, value)
 
 
 def is_html(filename):
@@ -33,16 +170,148 @@ def skip_html_file(filename):
 
 
 def unzip(zipfile, path, recursive=False):
-    """Recursive unzip."""
+    """
+    Extract a ZIP file, streaming each member to disk. If recursive, nested
+    ZIP files are extracted in the same pass to a directory named after the
+    archive, without being written to disk themselves. Raises UnzipError if
+    the bundle exceeds the UNZIP_MAX_* limits.
+    """
+    totals = {'members': 0, 'size': 0}
+    _unzip(zipfile, path, recursive, 0, totals)
+
+
+def _unzip(zipfile, path, recursive, depth, totals):
+    _check_depth(depth)
     with ZipFile(zipfile) as f:
-        f.extractall(path)
-    if recursive:
-        for dirpath, dirnames, filenames in os.walk(path):
-            for filename in filenames:
-                root, ext = os.path.splitext(filename)
-                if ext.lower() == '.zip':
-                    unzip(
-                        os.path.join(dirpath, filename),
-                        os.path.join(dirpath, root),
-                        recursive,
-                    )
+        for info in f.infolist():
+            target = _get_member_path(path, info.filename)
+            if target is None:
+                continue
+            _count_member(totals)
+            root, ext = os.path.splitext(target)
+            with f.open(info) as src:
+                if recursive and ext.lower() == '.zip':
+                    with SpooledTemporaryFile(UNZIP_SPOOL_SIZE) as dst:
+                        _copy_member(src, dst, totals)
+                        dst.seek(0)
+                        _unzip(dst, root, recursive, depth + 1, totals)
+                else:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with open(target, 'wb') as dst:
+                        _copy_member(src, dst, totals)
+
+
+def _check_depth(depth):
+    if depth > settings.UNZIP_MAX_DEPTH:
+        raise UnzipError('ZIP files nested more than {} deep'.format(
+            settings.UNZIP_MAX_DEPTH,
+        ))
+
+
+def _count_member(totals):
+    totals['members'] += 1
+    if totals['members'] > settings.UNZIP_MAX_MEMBERS:
+        raise UnzipError('Bundle has more than {} files'.format(
+            settings.UNZIP_MAX_MEMBERS,
+        ))
+
+
+def _copy_member(src, dst, totals):
+    """Copy an archive member, counting bytes against UNZIP_MAX_SIZE."""
+    for chunk in iter(lambda: src.read(UNZIP_CHUNK_SIZE), b''):
+        totals['size'] += len(chunk)
+        if totals['size'] > settings.UNZIP_MAX_SIZE:
+            raise UnzipError('Bundle is larger than {} bytes'.format(
+                settings.UNZIP_MAX_SIZE,
+            ))
+        dst.write(chunk)
+
+
+def _get_member_path(path, filename):
+    """
+    Get the extraction path of an archive member, staying under path.
+    Returns None for directory entries and members without a file name.
+    """
+    filename = filename.replace('\\', '/')
+    parts = [
+        part for part in filename.split('/')
+        if part not in ('', '.', '..')
+    ]
+    if filename.endswith('/') or not parts:
+        return None
+    return os.path.join(path, *parts)
+
+
+class ZipIndex:
+    """
+    Index of the files in a ZIP file, keyed by the path that unzip() would
+    extract them to. Files are read from the archive on demand, so only the
+    files that are needed have to be written to disk. Nested ZIP files are
+    indexed too if recursive, and held in spooled temporary files until the
+    index is closed. The UNZIP_MAX_* limits apply as for unzip().
+    """
+
+    def __init__(self, zipfile, path, recursive=False):
+        self.members = {}
+        self._files = []
+        self._totals = {'members': 0, 'size': 0}
+        try:
+            self._index(zipfile, os.path.abspath(path), recursive, 0)
+        except Exception:
+            self.close()
+            raise
+
+    def __contains__(self, filename):
+        return filename in self.members
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return iter(sorted(self.members))
+
+    def __len__(self):
+        return len(self.members)
+
+    def _index(self, zipfile, path, recursive, depth):
+        _check_depth(depth)
+        f = ZipFile(zipfile)
+        self._files.append(f)
+        for info in f.infolist():
+            target = _get_member_path(path, info.filename)
+            if target is None:
+                continue
+            _count_member(self._totals)
+            root, ext = os.path.splitext(target)
+            if recursive and ext.lower() == '.zip':
+                spool = SpooledTemporaryFile(UNZIP_SPOOL_SIZE)
+                self._files.append(spool)
+                with f.open(info) as src:
+                    _copy_member(src, spool, self._totals)
+                spool.seek(0)
+                self._index(spool, root, recursive, depth + 1)
+            else:
+                self.members[target] = (f, info)
+
+    def close(self):
+        """Close the archive and discard spooled nested archives."""
+        while self._files:
+            self._files.pop().close()
+
+    def extract(self, filename):
+        """Extract a file to its path."""
+        f, info = self.members[filename]
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with f.open(info) as src, open(filename, 'wb') as dst:
+            _copy_member(src, dst, self._totals)
+
+    def read(self, filename):
+        """Read a file from the archive."""
+        f, info = self.members[filename]
+        dst = BytesIO()
+        with f.open(info) as src:
+            _copy_member(src, dst, self._totals)
+        return dst.getvalue()
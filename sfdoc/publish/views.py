@@ -3,7 +3,9 @@ from django.core.paginator import EmptyPage
 from django.core.paginator import PageNotAnInteger
 from django.core.paginator import Paginator
 from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
 from django.http import HttpResponseRedirect
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.shortcuts import render
 from django.views.decorators.cache import never_cache
@@ -12,24 +14,42 @@ from django.views.decorators.http import require_POST
 
 from .forms import PublishToProductionForm
 from .forms import RequeueBundleForm
+from .logger import close_logger
 from .logger import get_logger
 from .models import Article
 from .models import Bundle
 from .models import Image
+from .models import Log
 from .models import Webhook
 from .tasks import process_queue
 from .tasks import process_webhook
 from .tasks import publish_drafts
 
+# maximum number of log messages per page or JSON response
+LOGS_PER_PAGE = 500
+
+
+def _get_logs_after(bundle, cursor):
+    """
+    Get up to LOGS_PER_PAGE log messages of a bundle logged after a cursor,
+    and whether there are more. Raises ValueError or OverflowError if the
+    cursor is invalid.
+    """
+    logs = list(Log.filter_after(bundle.logs.all(), cursor)[
+        :LOGS_PER_PAGE + 1
+    ])
+    return logs[:LOGS_PER_PAGE], len(logs) > LOGS_PER_PAGE
+
 
 @never_cache
 @staff_member_required
 def bundle(request, pk):
     bundle = get_object_or_404(Bundle, pk=pk)
-    logs = reversed(bundle.logs.all().order_by('-time')[:10])
+    logs = list(reversed(bundle.logs.all().order_by('-time', '-pk')[:10]))
     context = {
         'bundle': bundle,
         'logs': logs,
+        'logs_cursor': logs[-1].get_cursor() if logs else '',
         'ready_for_review': bundle.status == Bundle.STATUS_DRAFT,
     }
     return render(request, 'bundle.html', context=context)
@@ -88,14 +108,42 @@ def index(request):
 @staff_member_required
 def logs(request, pk):
     bundle = get_object_or_404(Bundle, pk=pk)
-    logs = bundle.logs.all().order_by('time')
+    try:
+        logs, more = _get_logs_after(bundle, request.GET.get('after'))
+    except (ValueError, OverflowError):
+        return HttpResponseBadRequest('Invalid cursor')
     context = {
         'bundle': bundle,
         'logs': logs,
     }
+    if request.GET.get('after'):
+        context['link_first'] = '?'
+    if more:
+        context['link_next'] = '?after={}'.format(logs[-1].get_cursor())
     return render(request, 'logs.html', context=context)
 
 
+@never_cache
+@staff_member_required
+def logs_since(request, pk):
+    """Get the log messages of a bundle logged after a cursor as JSON."""
+    bundle = get_object_or_404(Bundle, pk=pk)
+    cursor = request.GET.get('after', '')
+    try:
+        logs, more = _get_logs_after(bundle, cursor)
+    except (ValueError, OverflowError):
+        return HttpResponseBadRequest('Invalid cursor')
+    if logs:
+        cursor = logs[-1].get_cursor()
+    return JsonResponse({
+        'cursor': cursor,
+        'messages': [log.get_message() for log in logs],
+        'more': more,
+        'running': bundle.is_running(),
+        'status': bundle.get_status_display(),
+    })
+
+
 @never_cache
 @staff_member_required
 def requeue(request, pk):
@@ -108,7 +156,10 @@ def requeue(request, pk):
         if form.is_valid() and request.POST['choice'] == 'Requeue':
             bundle.queue()
             logger = get_logger(bundle)
-            logger.info('Requeued %s', bundle)
+            try:
+                logger.info('Requeued %s', bundle)
+            finally:
+                close_logger(logger)
             process_queue.delay()
         return HttpResponseRedirect('../')
     else:
@@ -120,23 +171,26 @@ def requeue(request, pk):
 @staff_member_required
 def review(request, pk):
     bundle = get_object_or_404(Bundle, pk=pk)
-    logger = get_logger(bundle)
     if bundle.status != Bundle.STATUS_DRAFT:
         return HttpResponseRedirect('../')
     context = {'bundle': bundle}
     if request.method == 'POST':
         form = PublishToProductionForm(request.POST)
         if form.is_valid():
-            if form.approved():
-                logger.info('Approved %s', bundle)
-                bundle.status = Bundle.STATUS_PUBLISHING
-                bundle.save()
-                publish_drafts.delay(bundle.pk)
-            else:
-                logger.info('Rejected %s', bundle)
-                bundle.status = Bundle.STATUS_REJECTED
-                bundle.save()
-                process_queue.delay()
+            logger = get_logger(bundle)
+            try:
+                if form.approved():
+                    logger.info('Approved %s', bundle)
+                    bundle.status = Bundle.STATUS_PUBLISHING
+                    bundle.save()
+                    publish_drafts.delay(bundle.pk)
+                else:
+                    logger.info('Rejected %s', bundle)
+                    bundle.status = Bundle.STATUS_REJECTED
+                    bundle.save()
+                    process_queue.delay()
+            finally:
+                close_logger(logger)
         return HttpResponseRedirect('../')
     else:
         form = PublishToProductionForm()